@@ -161,9 +161,18 @@ USE_TZ = True
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-SESSION_ENGINE = "django.contrib.sessions.backends.db"
+# food.sessions only writes a session when its data changes or its expiry moves by more than
+# SESSION_REFRESH_SECONDS, and caches the rows in each process; set
+# SESSION_ENGINE=django.contrib.sessions.backends.db to go back to the stock store
+SESSION_ENGINE = os.getenv('SESSION_ENGINE', 'food.sessions')
 SESSION_COOKIE_AGE = int(os.getenv('SESSION_COOKIE_AGE', '86400'))  # 1 day
 SESSION_SAVE_EVERY_REQUEST = os.getenv('SESSION_SAVE_EVERY_REQUEST', 'True') == 'True'
+SESSION_REFRESH_SECONDS = int(os.getenv('SESSION_REFRESH_SECONDS', '3600'))
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '10000'))
+
+# Route the I/O-bound views to their async versions (food/async_views.py). run_uvicorn.py
+# turns this on; leave it off under waitress, which runs every view in a thread anyway
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
 SESSION_EXPIRE_AT_BROWSER_CLOSE = os.getenv('SESSION_EXPIRE_AT_BROWSER_CLOSE', 'False') == 'True'
 
 
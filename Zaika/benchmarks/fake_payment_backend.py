@@ -0,0 +1,221 @@
+"""
+Local stand-in for the Express payment backend and BillDesk, for load
+testing the payment path on one machine with no network.
+
+Serves the two endpoints Zaika uses:
+
+  POST /api/payments/create-order-zaikaa
+      Answers like Express: {"success": true, "data": {"merchantid",
+      "bdorderid", "rdata"}} with BillDesk-shaped values, after --latency
+      milliseconds (plus up to --jitter). --error-rate of calls get a 500,
+      --decline-rate get {"success": false}, and --timeout-rate hang for
+      --hang seconds before answering, to trip the client's read timeout.
+
+  GET /api/payments/forward?merchantid=..&bdorderid=..&rdata=..
+      Plays the BillDesk payment page: redirects the browser straight back
+      to Zaika's /zaikaa/payment-success/ (or, for --fail-rate of payments,
+      /zaikaa/payment-failed/) with the order_id sent to create-order.
+      With --webhook-secret it also POSTs the result to Zaika's
+      /zaikaa/payment-confirm/, signed like Express, as the server-to-server
+      confirmation.
+
+  GET /stats
+      Counters since start, as JSON.
+
+Point Zaika at it and drive the flow with any HTTP load tool that keeps
+cookies and follows redirects:
+
+    python benchmarks/fake_payment_backend.py --port 8100 --latency 150 --error-rate 0.02
+    BACKEND_URL=http://127.0.0.1:8100 python run_waitress.py
+
+Usage (from the Zaika folder):
+    python benchmarks/fake_payment_backend.py [--port 8100] [--zaika-url http://127.0.0.1:8000]
+        [--latency 100] [--jitter 50] [--error-rate 0] [--decline-rate 0]
+        [--timeout-rate 0] [--hang 30] [--fail-rate 0] [--webhook-secret S] [--seed N]
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import secrets
+import string
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import Request, urlopen
+
+MERCHANT_ID = 'BDZAIKAUAT'
+MAX_PENDING_ORDERS = 100000
+
+
+class FakeBackend:
+
+    def __init__(self, options):
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.lock = threading.Lock()
+        self.orders = {}  # bdorderid -> Zaika order_id, oldest first
+        self.stats = Counter()
+
+    def chance(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def delay(self):
+        with self.lock:
+            jitter = self.random.uniform(0, self.options.jitter)
+        time.sleep((self.options.latency + jitter) / 1000)
+
+    def create_order(self, order_id):
+        """Returns (HTTP status, JSON body) for a create-order call."""
+        self.delay()
+        if self.chance(self.options.timeout_rate):
+            self.count('create_timeout')
+            time.sleep(self.options.hang)
+        if self.chance(self.options.error_rate):
+            self.count('create_error')
+            return 500, {'success': False, 'message': 'Internal Server Error'}
+        if self.chance(self.options.decline_rate):
+            self.count('create_declined')
+            return 200, {'success': False, 'message': 'Order creation declined by BillDesk'}
+
+        # BillDesk order ids are 'OA' plus ten upper-case letters/digits; rdata is an opaque hex blob
+        bdorderid = 'OA' + ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(10))
+        with self.lock:
+            self.orders[bdorderid] = order_id
+            while len(self.orders) > MAX_PENDING_ORDERS:
+                del self.orders[next(iter(self.orders))]
+        self.count('create_ok')
+        return 200, {
+            'success': True,
+            'data': {'merchantid': MERCHANT_ID, 'bdorderid': bdorderid, 'rdata': secrets.token_hex(256)},
+        }
+
+    def forward(self, params):
+        """Returns the Zaika callback URL the browser is sent back to."""
+        bdorderid = params.get('bdorderid', '')
+        with self.lock:
+            order_id = self.orders.pop(bdorderid, None)
+        base = self.options.zaika_url.rstrip('/')
+        if order_id is None or params.get('merchantid') != MERCHANT_ID or not params.get('rdata'):
+            self.count('forward_unknown')
+            query = {'order_id': order_id or '', 'error': 'Invalid request', 'reason': 'Unknown bdorderid'}
+            return f"{base}/zaikaa/payment-failed/?{urlencode(query)}"
+
+        self.delay()
+        if self.chance(self.options.fail_rate):
+            self.count('payment_failed')
+            query = {'order_id': order_id, 'error': 'Payment failed', 'reason': 'Transaction declined by bank'}
+            return f"{base}/zaikaa/payment-failed/?{urlencode(query)}"
+        self.count('payment_ok')
+        txn_id = 'U' + ''.join(secrets.choice(string.digits) for _ in range(13))
+        query = {'order_id': order_id, 'txn_id': txn_id, 'status': 'success'}
+        if self.options.webhook_secret:
+            threading.Thread(target=self.confirm, args=(query,), daemon=True).start()
+        return f"{base}/zaikaa/payment-success/?{urlencode(query)}"
+
+    def confirm(self, result):
+        """Send the server-to-server confirmation, racing the browser's redirect."""
+        body = json.dumps(result).encode()
+        signature = hmac.new(self.options.webhook_secret.encode(), body, hashlib.sha256).hexdigest()
+        request = Request(
+            f"{self.options.zaika_url.rstrip('/')}/zaikaa/payment-confirm/", data=body, method='POST',
+            headers={'Content-Type': 'application/json', 'X-Zaika-Signature': f'sha256={signature}'},
+        )
+        try:
+            with urlopen(request, timeout=10) as response:
+                response.read()
+            self.count('confirm_ok')
+        except OSError as e:
+            print(f"Confirmation for {result['order_id']} failed: {e}")
+            self.count('confirm_error')
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like Express
+    backend = None
+
+    def do_POST(self):
+        path = urlparse(self.path).path.rstrip('/')
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if path != '/api/payments/create-order-zaikaa':
+            return self.send_json(404, {'success': False, 'message': 'Not found'})
+        try:
+            order_id = json.loads(body or b'{}').get('order_id')
+        except ValueError:
+            return self.send_json(400, {'success': False, 'message': 'Invalid JSON'})
+        if not order_id:
+            return self.send_json(400, {'success': False, 'message': 'order_id is required'})
+        status, data = self.backend.create_order(order_id)
+        self.send_json(status, data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path.rstrip('/')
+        if path == '/api/payments/forward':
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            self.send_response(302)
+            self.send_header('Location', self.backend.forward(params))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif path == '/stats':
+            with self.backend.lock:
+                stats = dict(self.backend.stats, pending_orders=len(self.backend.orders))
+            self.send_json(200, stats)
+        else:
+            self.send_json(404, {'success': False, 'message': 'Not found'})
+
+    def send_json(self, status, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        if self.backend.options.verbose:
+            super().log_message(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--zaika-url', default='http://127.0.0.1:8000', help='where callbacks redirect to')
+    parser.add_argument('--latency', type=float, default=100, help='milliseconds added to every call')
+    parser.add_argument('--jitter', type=float, default=50, help='up to this many extra milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of create-order calls answered 500')
+    parser.add_argument('--decline-rate', type=float, default=0.0, help='share answered success: false')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='share that hang for --hang seconds')
+    parser.add_argument('--hang', type=float, default=30, help='seconds a hanging call waits')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of payments sent to payment-failed/')
+    parser.add_argument('--webhook-secret', default='', help='PAYMENT_WEBHOOK_SECRET; sends signed confirmations')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    options = parser.parse_args()
+
+    Handler.backend = FakeBackend(options)
+    ThreadingHTTPServer.request_queue_size = 1024  # The default backlog of 5 resets concurrent connects
+    server = ThreadingHTTPServer((options.host, options.port), Handler)
+    server.daemon_threads = True
+    print(f"Fake payment backend on http://{options.host}:{options.port}, calling back to {options.zaika_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(dict(Handler.backend.stats), indent=2))
+
+
+if __name__ == '__main__':
+    main()
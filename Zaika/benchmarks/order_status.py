@@ -0,0 +1,124 @@
+"""
+Benchmark: check_order_status queries over a synthetic orderlist.
+
+Builds a temporary copy of "orderlist" with --rows rows (default 1M) on the
+database configured in Zaikaa/settings.py. A temporary table disappears with
+the session, so nothing is left behind. It then times:
+
+  before  the old two COUNT(*) queries, with no index on email/status
+  after   the single FILTER aggregate, with the partial indexes from
+          food/migrations/0004_orderlist_status_indexes.py
+
+Usage (from the Zaika folder):
+    python benchmarks/order_status.py [--rows 1000000] [--emails 20000] [--repeat 200] [--explain]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Zaikaa.settings')
+
+import django
+
+django.setup()
+
+from django.db import connection
+
+TABLE = 'orderlist_bench'
+
+BEFORE = [
+    f"""SELECT COUNT(*) FROM "{TABLE}" WHERE "email" = %s AND "status" = 'Pending';""",
+    f"""SELECT COUNT(*) FROM "{TABLE}" WHERE "email" = %s AND "status" = 'Approved' AND "tokenid" IS NULL;""",
+]
+AFTER = [
+    f"""
+    SELECT
+        COUNT(*) FILTER (WHERE "status" = 'Pending'),
+        COUNT(*) FILTER (WHERE "status" = 'Approved' AND "tokenid" IS NULL)
+    FROM "{TABLE}"
+    WHERE "email" = %s
+      AND ("status" = 'Pending' OR ("status" = 'Approved' AND "tokenid" IS NULL));
+    """,
+]
+
+
+def build(cursor, rows, emails):
+    print(f"Building {rows:,} rows for {emails:,} emails...")
+    cursor.execute(f'CREATE TEMP TABLE "{TABLE}" (LIKE "orderlist" INCLUDING DEFAULTS);')
+    # End-of-day shape: almost everything delivered, a thin tail still open
+    cursor.execute(f"""
+        INSERT INTO "{TABLE}" ("email", "name", "contact_no", "shop_id", "item_name", "qty", "total_amt",
+                               "status", "tokenid", "timestamp", "mode_of_payment")
+        SELECT
+            'user' || (n %% %s) || '@zaika.local', 'User', '0000000000', 1 + n %% 30, 'Item ' || n %% 200, 1, 50,
+            CASE WHEN n %% 1000 = 0 THEN 'Pending'
+                 WHEN n %% 1000 = 1 THEN 'Approved'
+                 WHEN n %% 10 < 2 THEN 'Completed'
+                 ELSE 'Delivered' END,
+            CASE WHEN n %% 1000 IN (0, 1) THEN NULL ELSE 1000 + n / 5 END,
+            now() - (n || ' seconds')::interval,
+            CASE WHEN n %% 2 = 0 THEN 'cash' ELSE 'Online' END
+        FROM generate_series(1, %s) AS n;
+    """, [emails, rows])
+    cursor.execute(f'ANALYZE "{TABLE}";')
+
+
+def add_indexes(cursor):
+    cursor.execute(f"""CREATE INDEX ON "{TABLE}" ("email") WHERE "status" = 'Pending';""")
+    cursor.execute(f"""CREATE INDEX ON "{TABLE}" ("email") WHERE "status" = 'Approved' AND "tokenid" IS NULL;""")
+    cursor.execute(f'ANALYZE "{TABLE}";')
+
+
+def run(cursor, queries, sample_emails):
+    samples = []
+    for email in sample_emails:
+        start = time.perf_counter()
+        for sql in queries:
+            cursor.execute(sql, [email])
+            cursor.fetchall()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples) * 1000, samples[int(len(samples) * 0.95) - 1] * 1000
+
+
+def explain(cursor, queries, email):
+    for sql in queries:
+        cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + sql, [email])
+        print("\n".join(row[0] for row in cursor.fetchall()))
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--emails', type=int, default=20_000)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--explain', action='store_true', help='print EXPLAIN ANALYZE for both variants')
+    args = parser.parse_args()
+
+    sample_emails = [f'user{random.randrange(args.emails)}@zaika.local' for _ in range(args.repeat)]
+    with connection.cursor() as cursor:
+        build(cursor, args.rows, args.emails)
+
+        before = run(cursor, BEFORE, sample_emails)
+        if args.explain:
+            explain(cursor, BEFORE, sample_emails[0])
+
+        add_indexes(cursor)
+        after = run(cursor, AFTER, sample_emails)
+        if args.explain:
+            explain(cursor, AFTER, sample_emails[0])
+
+        cursor.execute(f'DROP TABLE "{TABLE}";')
+
+    print(f"{'variant':<8} {'median ms':>10} {'p95 ms':>10}")
+    print(f"{'before':<8} {before[0]:>10.3f} {before[1]:>10.3f}")
+    print(f"{'after':<8} {after[0]:>10.3f} {after[1]:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Benchmark: BillDesk success-callback latency as the cart grows.
+
+Runs against the database configured in Zaikaa/settings.py. Everything
+happens inside a transaction that is rolled back, so no rows are left
+behind. The callbacks take their pickup tokens from an in-memory allocator:
+the real one claims blocks on its own connection, outside that transaction,
+and would use up today's tokens.
+
+Usage (from the Zaika folder):
+    python benchmarks/payment_callback.py [--sizes 1,5,10,25,50,100,250] [--repeat 20]
+
+For each cart size it reports the median time of:
+  per-row    one INSERT ... RETURNING per line (the old callback)
+  multi-row  food.orders.insert_order_lines
+  copy       food.orders.copy_order_lines
+  callback   the full payment_success_billdesk view
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Zaikaa.settings')
+
+import django
+
+django.setup()
+
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.db import connection, transaction
+from django.test import RequestFactory
+
+from food.cart import CartItem, save_session_cart, parse_cart
+from food.menu_cache import bump_menu_version
+from food import tokens
+from food.orders import copy_order_lines, insert_order_lines
+from food.views import payment_success_billdesk
+
+
+class Rollback(Exception):
+    pass
+
+
+class InMemoryAllocator(tokens.TokenAllocator):
+    """Hands out token blocks without claiming them in token_counters."""
+
+    def _claim_block(self, day):
+        start = self._end if self._day == day else tokens.TOKEN_START
+        self._day = day
+        self._next = start
+        self._end = start + self.block_size
+        self._blocks_claimed += 1
+
+
+FIELDS = dict(
+    email='bench@zaika.local', name='Bench', contact_no='0000000000',
+    status='Approved', tokenid=1, mode_of_payment='Online',
+)
+
+
+def per_row(cursor, items, timestamp):
+    for item in items:
+        cursor.execute("""
+            INSERT INTO "orderlist"
+            ("email", "name", "contact_no", "shop_id", "item_name", "qty", "total_amt", "status", "tokenid", "timestamp", "mode_of_payment")
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING "order_id";
+        """, [FIELDS['email'], FIELDS['name'], FIELDS['contact_no'], item.shop_id, item.item_name,
+              item.qty, item.total_price, FIELDS['status'], FIELDS['tokenid'], timestamp, FIELDS['mode_of_payment']])
+        cursor.fetchone()
+
+
+def multi_row(cursor, items, timestamp):
+    insert_order_lines(cursor, items, timestamp=timestamp, **FIELDS)
+
+
+def copy(cursor, items, timestamp):
+    copy_order_lines(cursor, items, timestamp=timestamp, **FIELDS)
+
+
+def time_writer(writer, items, repeat):
+    samples = []
+    for _ in range(repeat):
+        with connection.cursor() as cursor:
+            sid = transaction.savepoint()
+            start = time.perf_counter()
+            writer(cursor, items, datetime.now())
+            samples.append(time.perf_counter() - start)
+            transaction.savepoint_rollback(sid)
+    return statistics.median(samples)
+
+
+def time_callback(cart, repeat):
+    factory = RequestFactory()
+    samples = []
+    for run in range(repeat):
+        # A fresh (order_id, txn_id) each run, so the payment ledger never answers from an earlier one
+        order_id, txn_id = f'bench-{len(cart)}-{run}', f'benchtxn-{len(cart)}-{run}'
+        request = factory.get('/zaikaa/payment-success/', {'order_id': order_id, 'txn_id': txn_id, 'status': 'success'})
+        request.session = SessionStore()
+        # The session is checking out this order, so record_payment() takes the cart from it
+        request.session.update({'user_name': 'Bench', 'user_email': 'bench@zaika.local', 'user_phone': '0000000000',
+                                'order_id': order_id})
+        save_session_cart(request.session, cart)
+        sid = transaction.savepoint()
+        start = time.perf_counter()
+        response = payment_success_billdesk(request)
+        samples.append(time.perf_counter() - start)
+        transaction.savepoint_rollback(sid)
+        if response.status_code != 302:
+            raise SystemExit(f"Callback failed with {response.status_code}: {response.content[:200]!r}")
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1,5,10,25,50,100,250')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    print(f"{'lines':>6} {'per-row ms':>11} {'multi-row ms':>13} {'copy ms':>9} {'callback ms':>12}")
+    try:
+        with transaction.atomic(), mock.patch.object(tokens, '_allocator', InMemoryAllocator()):
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO "shops" ("shop_name", "passkey") VALUES ('Benchmark Stall', '00000')
+                    RETURNING "shop_id";
+                """)
+                shop_id = cursor.fetchone()[0]
+                cursor.execute("""
+                    INSERT INTO "menuitems" ("name", "price", "shop_id", "availability")
+                    SELECT 'Bench item ' || n, 50, %s, 1 FROM generate_series(1, %s) AS n
+                    RETURNING "id";
+                """, [shop_id, max(sizes)])
+                item_ids = [row[0] for row in cursor.fetchall()]
+
+            for size in sizes:
+                items = [CartItem(item_id, shop_id, 1, f'Bench item {n}', 50, 50)
+                         for n, item_id in enumerate(item_ids[:size], start=1)]
+                cart = parse_cart([[item.item_id, shop_id, 1] for item in items])
+                print(f"{size:>6} "
+                      f"{time_writer(per_row, items, args.repeat) * 1000:>11.2f} "
+                      f"{time_writer(multi_row, items, args.repeat) * 1000:>13.2f} "
+                      f"{time_writer(copy, items, args.repeat) * 1000:>9.2f} "
+                      f"{time_callback(cart, args.repeat) * 1000:>12.2f}")
+            raise Rollback
+    except Rollback:
+        pass
+    # The callback may have cached a menu snapshot that included the benchmark stall
+    bump_menu_version()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
 
 
 class FoodConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'food'
+
+    def ready(self):
+        # Importing these registers their event bus subscriptions
+        from . import event_bus, menu_cache, order_events, order_history  # noqa: F401
+
+        # Listen for other worker processes' changes once this process serves requests
+        request_started.connect(event_bus.start_listener, dispatch_uid='food.event_bus.start_listener')
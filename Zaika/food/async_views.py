@@ -0,0 +1,166 @@
+"""
+Async versions of the I/O-bound views, routed instead of the sync ones
+when ASYNC_VIEWS is on (run_uvicorn.py turns it on; see food/urls.py).
+
+Under ASGI a sync view holds a thread for as long as it runs, which for the
+payment call and the waiting-page stream is mostly spent waiting on
+someone else. These views wait as coroutines instead:
+
+* `create_order` calls the Express backend through the async gateway
+  client (`async_express_gateway()`);
+* `order_status_stream` awaits `await_order_change()` between status
+  events, so an idle waiting page costs a future rather than a thread
+  (it has no sync twin: under WSGI the waiting page polls instead);
+* `check_order_status` and `payment_success_billdesk` run their database
+  work with `sync_to_async`, holding a thread only while it runs.
+
+The others return exactly what their sync twins in food/views.py return;
+the shared pieces live there.
+"""
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.views.decorators.csrf import csrf_protect
+
+from .cart import get_session_cart, shop_ids_of
+from .order_events import order_change_version, await_order_change
+from .payment_gateway import async_express_gateway, GatewayUnavailable
+from .payments import UnknownPayment, record_payment, save_payment_intent
+from .pricing import price_cart
+from .views import (
+    ORDER_STATUS_MAX_HOLD, ORDER_STATUS_HEARTBEAT, _order_status, _unchanged_status, _stamped,
+    _express_order_payload, _billdesk_redirect,
+    _session_payment, _finish_checkout,
+)
+
+
+async def create_order(request):
+    if await request.session.aget("is_authenticated"):
+        # aget() loaded the session, so the reads below do not query
+        cart = get_session_cart(request.session)
+        user_name = request.session['user_name']
+        user_email = request.session['user_email']
+        user_phone = request.session['user_phone']
+        order_id = request.POST.get('order_id') or request.session.get('order_id')
+        if not order_id:
+            return HttpResponse("Order ID missing. Please try again.", status=400)
+
+        # Price the cart on the server from the menu snapshot (may rebuild it)
+        priced = await sync_to_async(price_cart)(cart)
+        payload = _express_order_payload(order_id, user_name, user_email, user_phone, priced, shop_ids_of(cart))
+
+        gateway = async_express_gateway()
+
+        try:
+            await sync_to_async(save_payment_intent)(order_id, user_name, user_email, user_phone, cart)
+            response = await gateway.post('/api/payments/create-order-zaikaa', json=payload)
+            data = response.json()
+            print(f"Express API response: {data}")
+            return _billdesk_redirect(request.session, gateway.base_url, order_id, response.status_code, data)
+
+        except GatewayUnavailable:
+            return HttpResponse("The payment server is unavailable. Please try again in a minute.", status=503)
+
+        except Exception as e:
+            print(f"Error calling Express API: {e}")
+            return HttpResponse(f"Failed to connect to payment server: {str(e)}", status=500)
+
+    else:
+        return redirect('ulogin')
+
+
+@csrf_protect
+async def check_order_status(request):
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+            email = data.get('email')
+
+            if not email:
+                return JsonResponse({'status': 'error', 'message': 'Email not provided'}, status=400)
+
+            unchanged, stamp = _unchanged_status(email, data.get('stamp'))
+            if unchanged:
+                return JsonResponse(unchanged)
+            return JsonResponse(_stamped(await sync_to_async(_order_status)(email), stamp))
+
+        except json.JSONDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+        except Exception as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+    return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+
+
+async def order_status_stream(request):
+    """
+    GET /zaikaa/order_status/stream/
+    Sends a `status` event with the same payload as check_order_status, then
+    waits until approve_order / remove_order signal a change for this user's
+    email and sends the new status. Heartbeat comments keep proxies from
+    dropping the connection; the stream closes after ORDER_STATUS_MAX_HOLD
+    seconds and EventSource reconnects on its own.
+    """
+    if not await request.session.aget("is_authenticated"):
+        return JsonResponse({'status': 'error', 'message': 'Login required'}, status=401)
+    email = await request.session.aget('user_email')
+    if not email:
+        return JsonResponse({'status': 'error', 'message': 'Email not provided'}, status=400)
+
+    response = StreamingHttpResponse(_order_status_events(email), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let a reverse proxy buffer the stream
+    return response
+
+
+async def _order_status_events(email):
+    yield 'retry: 3000\n\n'
+    deadline = time.monotonic() + ORDER_STATUS_MAX_HOLD
+    seen = order_change_version(email)
+    payload = await sync_to_async(_order_status)(email)
+    yield f'event: status\ndata: {json.dumps(payload)}\n\n'
+
+    while payload['status'] == 'pending':
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        changed, seen = await await_order_change(email, seen, min(ORDER_STATUS_HEARTBEAT, remaining))
+        if not changed:
+            yield ': heartbeat\n\n'
+            continue
+        payload = await sync_to_async(_order_status)(email)
+        yield f'event: status\ndata: {json.dumps(payload)}\n\n'
+
+
+async def payment_success_billdesk(request):
+    """GET /zaikaa/payment-success?order_id=xxx&txn_id=xxx&status=success, as the sync view."""
+    if request.method == 'GET':
+        order_id = request.GET.get('order_id')
+        txn_id = request.GET.get('txn_id')
+        status = request.GET.get('status')
+
+        print(f"Payment success callback: order_id={order_id}, txn_id={txn_id}, status={status}")
+
+        if not order_id or not txn_id or status != 'success':
+            return redirect('payment_failed_billdesk')
+
+        # Load the session here, so the helpers below do not query from the event loop
+        await request.session.aget('order_id')
+
+        try:
+            token_id = (await sync_to_async(record_payment)(
+                order_id, txn_id, source='redirect', fallback=_session_payment(request.session, order_id),
+            ))[0]
+        except UnknownPayment:
+            return HttpResponse("Session expired. Please try again.", status=400)
+        except Exception as e:
+            print(f"Error processing payment success: {e}")
+            return HttpResponse(f"Error processing order: {str(e)}", status=500)
+
+        _finish_checkout(request.session, order_id)
+        return redirect('success', token_id=token_id)
+
+    return HttpResponse("Invalid request method", status=405)
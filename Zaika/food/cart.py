@@ -0,0 +1,91 @@
+"""
+Structured cart for Zaika.
+
+A cart is a list of `CartLine(item_id, shop_id, qty)` built only from ids.
+It is what the browser posts (`confirm_order.js` / the home page form), what
+lives in the session under `CART_SESSION_KEY`, and what the order views
+consume. Item names and prices are never parsed out of strings; they are
+attached by `food.pricing.price_cart()` from the cached menu snapshot.
+"""
+import json
+from typing import NamedTuple
+
+CART_SESSION_KEY = 'cart'
+MAX_QTY_PER_LINE = 50
+
+
+class CartLine(NamedTuple):
+    item_id: int
+    shop_id: int
+    qty: int
+
+
+class CartItem(NamedTuple):
+    item_id: int
+    shop_id: int
+    qty: int
+    item_name: str
+    price: object        # Decimal from menuitems.price
+    total_price: object  # price * qty
+
+
+def parse_cart(raw):
+    """
+    Parse a posted or stored cart into a list of CartLine.
+
+    `raw` is either a JSON string or an already-decoded list of
+    `[item_id, shop_id, qty]` triples. Repeated items are merged and
+    quantities are capped at MAX_QTY_PER_LINE. Raises ValueError on anything
+    malformed.
+    """
+    if isinstance(raw, (str, bytes)):
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Cart is not valid JSON: {e}")
+    if not isinstance(raw, list):
+        raise ValueError("Cart must be a list of [item_id, shop_id, qty]")
+
+    lines = {}
+    for entry in raw:
+        if not isinstance(entry, (list, tuple)) or len(entry) != 3:
+            raise ValueError(f"Invalid cart line: {entry!r}")
+        try:
+            item_id, shop_id, qty = (int(value) for value in entry)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid cart line: {entry!r}")
+        if item_id <= 0 or shop_id <= 0 or qty < 1:
+            raise ValueError(f"Invalid cart line: {entry!r}")
+        qty = min(qty, MAX_QTY_PER_LINE)
+
+        if item_id in lines:
+            previous = lines[item_id]
+            if previous.shop_id != shop_id:
+                raise ValueError(f"Item {item_id} posted for two different shops")
+            qty = min(previous.qty + qty, MAX_QTY_PER_LINE)
+        lines[item_id] = CartLine(item_id, shop_id, qty)
+    return list(lines.values())
+
+
+def get_session_cart(session):
+    """Return the cart stored in the session (empty if missing or corrupt)."""
+    try:
+        return parse_cart(session.get(CART_SESSION_KEY, []))
+    except ValueError:
+        return []
+
+
+def save_session_cart(session, lines):
+    # Plain lists keep the serialized session small
+    session[CART_SESSION_KEY] = [list(line) for line in lines]
+    session.modified = True
+
+
+def clear_session_cart(session):
+    session[CART_SESSION_KEY] = []
+    session.modified = True
+
+
+def shop_ids_of(lines):
+    return sorted({line.shop_id for line in lines})
+
@@ -0,0 +1,199 @@
+"""
+Cross-process change notifications over Postgres LISTEN/NOTIFY.
+
+Each waitress process keeps in-process state (the menu snapshot, waiting-page
+streams) that must hear about writes made by *other* processes. This bus
+carries small typed events between them:
+
+    publish(MENU_CHANGED)
+    publish(ORDER_STATUS_CHANGED, {'emails': [...]})
+    publish(ORDERS_WRITTEN, {'emails': [...]})
+    subscribe(MENU_CHANGED, handler)    # handler(payload_dict)
+
+`publish()` sends `pg_notify` on the caller's connection, so Postgres only
+delivers the event if the surrounding transaction commits. Handlers in the
+publishing process run directly on commit. Every other process receives the
+event on its listener thread, which holds its own connection blocked on
+LISTEN. The thread is started by the first request a process serves.
+
+If the listener loses its connection, events may have been missed. After it
+reconnects it dispatches BUS_RECONNECTED so subscribers can drop whatever
+they cache. On databases other than Postgres, events are only delivered
+inside the publishing process.
+
+A NOTIFY payload must be shorter than 8000 bytes. An event too large for
+one (say, a bulk approval naming hundreds of emails) is split across
+several notifications, halving its longest list until each part fits. If
+it cannot be split, the other processes get BUS_RECONNECTED instead and
+drop everything they cache. The publishing process always dispatches the
+event whole.
+"""
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+
+from django.db import connection, connections, transaction
+from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'zaika_events'
+
+# Event types
+MENU_CHANGED = 'menu_changed'
+ORDER_STATUS_CHANGED = 'order_status_changed'
+ORDERS_WRITTEN = 'orders_written'
+SHOP_DELETED = 'shop_deleted'
+SESSION_CHANGED = 'session_changed'
+BUS_RECONNECTED = 'bus_reconnected'  # events may have been missed (also sent for an event too large to notify)
+
+MAX_NOTIFY_BYTES = 7999  # Postgres rejects NOTIFY payloads of 8000 bytes or more
+LISTEN_TIMEOUT = 5.0   # seconds between liveness checks of the listener connection
+RECONNECT_DELAY = 2.0
+
+_handlers = {}
+_handlers_lock = threading.Lock()
+_listener = None
+_listener_lock = threading.Lock()
+_origin = (None, None)  # (pid, id) of this process, regenerated after fork
+
+
+def _origin_id():
+    """Unique id of this process (pids alone repeat across hosts and forks)."""
+    global _origin
+    pid = os.getpid()
+    if _origin[0] != pid:
+        _origin = (pid, f'{pid}-{uuid.uuid4().hex[:8]}')
+    return _origin[1]
+
+
+def listening_id():
+    """
+    Id of this process's current LISTEN session, or None while it has none.
+    Two equal ids mean the listener stayed connected in between, so every
+    event committed meanwhile has been (or is about to be) dispatched here.
+    On other databases events only exist in-process and are never missed.
+    """
+    if connection.vendor != 'postgresql':
+        return _origin_id()
+    listener = _listener
+    if listener is None or listener.pid != os.getpid():
+        return None
+    return listener.listening
+
+
+def subscribe(event_type, handler):
+    with _handlers_lock:
+        _handlers.setdefault(event_type, []).append(handler)
+
+
+def publish(event_type, payload=None):
+    """
+    Publish an event to every process once the current transaction commits.
+    """
+    payload = dict(payload or {})
+    if connection.vendor == 'postgresql':
+        messages = list(dict.fromkeys(_messages(event_type, payload)))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, m) FROM unnest(%s::text[]) AS m;", [CHANNEL, messages])
+    transaction.on_commit(lambda: _dispatch(event_type, payload))
+
+
+def _messages(event_type, payload):
+    """NOTIFY payloads carrying this event, each under MAX_NOTIFY_BYTES."""
+    message = json.dumps({'type': event_type, 'origin': _origin_id(), 'payload': payload})
+    if len(message.encode()) <= MAX_NOTIFY_BYTES:
+        return [message]
+    lists = [key for key, value in payload.items() if isinstance(value, list) and len(value) > 1]
+    if not lists:
+        logger.warning("%s event too large to notify (%d bytes); asking other processes to reload", event_type, len(message.encode()))
+        return [json.dumps({'type': BUS_RECONNECTED, 'origin': _origin_id(), 'payload': {}})]
+    key = max(lists, key=lambda key: len(payload[key]))
+    half = len(payload[key]) // 2
+    return (_messages(event_type, {**payload, key: payload[key][:half]})
+            + _messages(event_type, {**payload, key: payload[key][half:]}))
+
+
+def _dispatch(event_type, payload):
+    with _handlers_lock:
+        handlers = list(_handlers.get(event_type, ()))
+    for handler in handlers:
+        try:
+            handler(payload)
+        except Exception:
+            logger.exception("Event handler %r failed for %s", handler, event_type)
+
+
+def start_listener(**kwargs):
+    """Start this process's listener thread (idempotent; connected to request_started)."""
+    global _listener
+    if (_listener is not None and _listener.pid == os.getpid()) or connection.vendor != 'postgresql':
+        return
+    with _listener_lock:
+        # A listener inherited through fork() has no thread in this process
+        if _listener is None or _listener.pid != os.getpid():
+            _listener = _Listener()
+            _listener.start()
+
+
+class _Listener(threading.Thread):
+
+    def __init__(self):
+        super().__init__(name='zaika-event-bus', daemon=True)
+        self.pid = os.getpid()
+        self.origin = _origin_id()
+        self.listening = None  # See listening_id()
+
+    def run(self):
+        connected_before = False
+        while True:
+            db = connections['default'].copy()
+            try:
+                db.ensure_connection()
+                db.connection.autocommit = True
+                with db.connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{CHANNEL}";')
+                if connected_before:
+                    _dispatch(BUS_RECONNECTED, {})
+                connected_before = True
+                self.listening = f'{self.origin}-{uuid.uuid4().hex[:8]}'
+                self._listen(db.connection)
+            except Exception:
+                logger.exception("Event bus listener lost its connection; reconnecting")
+            finally:
+                self.listening = None
+                try:
+                    db.close()
+                except Exception:
+                    pass
+            time.sleep(RECONNECT_DELAY)
+
+    def _listen(self, conn):
+        if is_psycopg3:
+            while True:
+                for notify in conn.notifies(timeout=LISTEN_TIMEOUT):
+                    self._handle(notify.payload)
+                conn.execute('SELECT 1;')  # Surface a dead connection
+        else:
+            while True:
+                if select.select([conn], [], [], LISTEN_TIMEOUT) == ([], [], []):
+                    with conn.cursor() as cursor:
+                        cursor.execute('SELECT 1;')
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._handle(conn.notifies.pop(0).payload)
+
+    def _handle(self, raw):
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            logger.warning("Ignoring malformed event: %r", raw)
+            return
+        if message.get('origin') == self.origin:
+            return  # Already dispatched locally on commit
+        _dispatch(message.get('type'), message.get('payload') or {})
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from food.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the sales rollup tables from orderlist (order writes wait while it runs)."
+
+    def handle(self, *args, **options):
+        rebuild_rollups()
+        self.stdout.write("Sales rollups rebuilt")
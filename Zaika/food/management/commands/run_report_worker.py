@@ -0,0 +1,40 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from food.reports import ReportWorker
+
+
+class Command(BaseCommand):
+    help = "Run queued admin report jobs (see food/reports.py). Started by run_waitress.py."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=float, default=2.0, help='seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='run every queued job, then exit')
+
+    def handle(self, *args, **options):
+        worker = ReportWorker()
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+
+        self.stdout.write(f"Report worker {worker.name} waiting for jobs")
+        try:
+            while not stopping:
+                try:
+                    if worker.run_next() is not None:
+                        continue
+                except Exception as e:
+                    # Database restarts and the like: drop the connection and try again later
+                    self.stderr.write(f"Report worker error: {e}")
+                    worker.close()
+                    connection.close()
+                if options['once']:
+                    break
+                time.sleep(options['poll'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            worker.close()
+        self.stdout.write("Report worker stopped")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from food.sessions import SWEEP_BATCH_SIZE, sweep_expired_sessions
+
+
+class Command(BaseCommand):
+    help = "Delete expired sessions in small batches (see food/sessions.py). Safe to run while serving."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE, help='rows deleted per statement')
+        parser.add_argument('--pause', type=float, default=0.1, help='seconds to wait between batches')
+        parser.add_argument('--max-batches', type=int, default=None, help='stop after this many batches')
+
+    def handle(self, *args, **options):
+        deleted = sweep_expired_sessions(options['batch_size'], options['pause'], options['max_batches'])
+        self.stdout.write(f"Deleted {deleted} expired session(s)")
@@ -0,0 +1,180 @@
+"""
+In-process menu snapshot cache for Zaika.
+
+The menu (shops joined with their available items) changes only a few times
+an hour, but `home()` used to rebuild it on every hit. Instead we keep one
+immutable snapshot per menu version:
+
+* `get_menu_snapshot()` returns the snapshot for the current version,
+  building it from the database on a miss.
+* `bump_menu_version()` is called by every view that writes to `shops` or
+  `menuitems`; it publishes MENU_CHANGED on the event bus, so the next
+  reader in *every* worker process rebuilds.
+
+Concurrent misses are single-flighted: only one thread runs the query, the
+others wait on the build lock and then reuse its result.
+
+Each snapshot also carries its compact JSON encoding and a strong ETag for
+the menu API, so conditional requests are answered without touching the DB,
+and the price table that `food.pricing` uses to total carts.
+"""
+import hashlib
+import json
+import threading
+from types import MappingProxyType
+from typing import NamedTuple
+
+from django.db import connection
+
+from . import event_bus
+
+
+class MenuItem(NamedTuple):
+    item_id: int
+    item_name: str
+    price: object  # Decimal straight from the "price" column
+    shop_id: int
+    availability: str = 'Available'
+
+
+class Shop(NamedTuple):
+    shop_id: int
+    shop_name: str
+    items: tuple
+
+
+class PriceEntry(NamedTuple):
+    shop_id: int
+    item_name: str
+    price: object
+    available: bool
+
+
+class MenuSnapshot(NamedTuple):
+    version: int
+    shops: MappingProxyType        # shop_name -> Shop (available items only), ordered by shop_id
+    price_table: MappingProxyType  # item_id -> PriceEntry, every item including unavailable ones
+    price_version: str             # content hash of price_table, stamped on orders
+    payload: bytes                 # compact JSON served by the menu API
+    etag: str                      # strong ETag (quoted) for `payload`
+
+
+_version = 0
+_snapshot = None
+_state_lock = threading.Lock()   # guards _version / _snapshot
+_build_lock = threading.Lock()   # single-flights rebuilds
+
+
+def menu_version():
+    """Return the current in-process menu version."""
+    return _version
+
+
+def bump_menu_version():
+    """
+    Invalidate the cached snapshot in every process. Delivered only once the
+    surrounding transaction commits, so a reader can never cache a menu that
+    is about to change.
+    """
+    event_bus.publish(event_bus.MENU_CHANGED)
+
+
+def _bump(payload=None):
+    global _version
+    with _state_lock:
+        _version += 1
+
+
+event_bus.subscribe(event_bus.MENU_CHANGED, _bump)
+event_bus.subscribe(event_bus.SHOP_DELETED, _bump)
+event_bus.subscribe(event_bus.BUS_RECONNECTED, _bump)  # we may have missed a change
+
+
+def get_menu_snapshot():
+    """Return the menu snapshot for the current version, building it if needed."""
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == _version:
+        return snapshot
+
+    with _build_lock:
+        # Another thread may have built it while we were waiting
+        snapshot = _snapshot
+        version = _version
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        snapshot = _build_snapshot(version)
+        _store(snapshot)
+        return snapshot
+
+
+def _store(snapshot):
+    global _snapshot
+    with _state_lock:
+        # Never replace a newer snapshot with an older one
+        if _snapshot is None or _snapshot.version <= snapshot.version:
+            _snapshot = snapshot
+
+
+def _build_snapshot(version):
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT
+                s.shop_id,
+                s.shop_name,
+                m.id AS item_id,
+                m.name AS item_name,
+                m.price,
+                m.availability
+            FROM
+                shops s
+            JOIN
+                menuitems m ON s.shop_id = m.shop_id
+            ORDER BY
+                s.shop_id, m.id;
+        """)
+        rows = cursor.fetchall()
+
+    shop_items = {}
+    shop_ids = {}
+    price_table = {}
+    for shop_id, shop_name, item_id, item_name, price, availability in rows:
+        available = availability == 1  # Availability column has 0 or 1
+        price_table[item_id] = PriceEntry(shop_id, item_name, price, available)
+        if not available:
+            continue
+        item = MenuItem(item_id, item_name, price, shop_id)
+        if shop_name not in shop_items:
+            shop_items[shop_name] = []
+            shop_ids[shop_name] = shop_id
+        shop_items[shop_name].append(item)
+
+    # Rows arrive ordered by shop_id, item_id so no re-sorting is needed
+    shops = {
+        name: Shop(shop_ids[name], name, tuple(items))
+        for name, items in shop_items.items()
+    }
+    payload = _encode_payload(shops)
+    # Both hashes are derived from the content rather than the in-process
+    # counter, so every worker process agrees on them for the same menu
+    etag = '"%s"' % hashlib.sha1(payload).hexdigest()[:20]
+    price_version = hashlib.sha1(
+        repr(sorted((item_id, entry.shop_id, str(entry.price)) for item_id, entry in price_table.items())).encode()
+    ).hexdigest()[:12]
+    return MenuSnapshot(
+        version, MappingProxyType(shops), MappingProxyType(price_table), price_version, payload, etag,
+    )
+
+
+def _encode_payload(shops):
+    data = {
+        'shops': [
+            {
+                'id': shop.shop_id,
+                'name': shop.shop_name,
+                'items': [[item.item_id, item.item_name, str(item.price)] for item in shop.items],
+            }
+            for shop in shops.values()
+        ],
+    }
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
@@ -0,0 +1,19 @@
+# The raw-SQL tables (shops, menuitems, orderlist, users) are not Django
+# models; schema changes to them are shipped as RunSQL migrations and
+# mirrored in schema.sql.
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='ALTER TABLE IF EXISTS "orderlist" ADD COLUMN IF NOT EXISTS "menu_version" VARCHAR(16);',
+            reverse_sql='ALTER TABLE IF EXISTS "orderlist" DROP COLUMN IF EXISTS "menu_version";',
+        ),
+    ]
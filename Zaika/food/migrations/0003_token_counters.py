@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0002_orderlist_menu_version'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='''
+                CREATE TABLE IF NOT EXISTS "token_counters" (
+                    "event_day" DATE PRIMARY KEY,
+                    "next_token" INTEGER NOT NULL
+                );
+            ''',
+            reverse_sql='DROP TABLE IF EXISTS "token_counters";',
+        ),
+    ]
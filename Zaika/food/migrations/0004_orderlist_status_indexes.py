@@ -0,0 +1,40 @@
+# Partial indexes behind the single-pass status query in check_order_status.
+# Built CONCURRENTLY so a live orderlist stays writable, which means this
+# migration cannot run inside a transaction.
+
+from django.db import migrations
+
+INDEXES = {
+    'idx_orderlist_pending_email':
+        'ON "orderlist" ("email") WHERE "status" = \'Pending\'',
+    'idx_orderlist_approved_untokened_email':
+        'ON "orderlist" ("email") WHERE "status" = \'Approved\' AND "tokenid" IS NULL',
+}
+
+
+def create_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('orderlist');")
+        if cursor.fetchone()[0] is None:
+            return  # Tables not created yet; schema.sql defines these indexes too
+        for name, definition in INDEXES.items():
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" {definition};')
+
+
+def drop_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for name in INDEXES:
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}";')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('food', '0003_token_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
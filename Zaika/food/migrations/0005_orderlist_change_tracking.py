@@ -0,0 +1,69 @@
+# Change tracking for the stall bookings delta feed (food.views.bookings_changes).
+#
+# Every INSERT/UPDATE on orderlist stamps the row with the time and the id of
+# the writing transaction, from a trigger, so no writer has to remember to.
+# The indexes are built CONCURRENTLY, so this migration cannot run inside a
+# transaction.
+
+from django.db import migrations
+
+TRACKING_SQL = [
+    'ALTER TABLE "orderlist" ADD COLUMN IF NOT EXISTS "updated_at" TIMESTAMP;',
+    'ALTER TABLE "orderlist" ADD COLUMN IF NOT EXISTS "change_xid" xid8;',
+    """
+    CREATE OR REPLACE FUNCTION orderlist_track_change() RETURNS trigger AS $$
+    BEGIN
+        NEW."updated_at" := CURRENT_TIMESTAMP;
+        NEW."change_xid" := pg_current_xact_id();
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    'DROP TRIGGER IF EXISTS "orderlist_track_change" ON "orderlist";',
+    """
+    CREATE TRIGGER "orderlist_track_change"
+    BEFORE INSERT OR UPDATE ON "orderlist"
+    FOR EACH ROW EXECUTE FUNCTION orderlist_track_change();
+    """,
+]
+
+INDEXES = {
+    'idx_orderlist_shop_status_timestamp':
+        'ON "orderlist" ("shop_id", "status", "timestamp")',
+    'idx_orderlist_shop_change_xid':
+        'ON "orderlist" ("shop_id", "change_xid")',
+}
+
+
+def add_tracking(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('orderlist');")
+        if cursor.fetchone()[0] is None:
+            return  # Tables not created yet; schema.sql defines all of this too
+        for sql in TRACKING_SQL:
+            cursor.execute(sql)
+        for name, definition in INDEXES.items():
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" {definition};')
+
+
+def remove_tracking(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for name in INDEXES:
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}";')
+        cursor.execute('DROP TRIGGER IF EXISTS "orderlist_track_change" ON "orderlist";')
+        cursor.execute('DROP FUNCTION IF EXISTS orderlist_track_change();')
+        cursor.execute('ALTER TABLE IF EXISTS "orderlist" DROP COLUMN IF EXISTS "change_xid";')
+        cursor.execute('ALTER TABLE IF EXISTS "orderlist" DROP COLUMN IF EXISTS "updated_at";')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('food', '0004_orderlist_status_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_tracking, remove_tracking),
+    ]
@@ -0,0 +1,34 @@
+# Partial index behind the keyset-paginated cash approval queue
+# (adminapproval walks Pending lines in order_id order). Built CONCURRENTLY,
+# so this migration cannot run inside a transaction.
+
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('orderlist');")
+        if cursor.fetchone()[0] is None:
+            return  # Tables not created yet; schema.sql defines this index too
+        cursor.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_orderlist_pending_order_id" '
+            'ON "orderlist" ("order_id") WHERE "status" = \'Pending\';'
+        )
+
+
+def drop_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS "idx_orderlist_pending_order_id";')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('food', '0005_orderlist_change_tracking'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
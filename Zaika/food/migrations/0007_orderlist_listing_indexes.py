@@ -0,0 +1,41 @@
+# Indexes behind the keyset-paginated allorders listing, which walks
+# ("timestamp", "order_id") newest first, optionally for a single shop.
+# Status filters with a shop use idx_orderlist_shop_status_timestamp (0005).
+# Built CONCURRENTLY, so this migration cannot run inside a transaction.
+
+from django.db import migrations
+
+INDEXES = {
+    'idx_orderlist_timestamp_order_id':
+        'ON "orderlist" ("timestamp", "order_id")',
+    'idx_orderlist_shop_timestamp_order_id':
+        'ON "orderlist" ("shop_id", "timestamp", "order_id")',
+}
+
+
+def create_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('orderlist');")
+        if cursor.fetchone()[0] is None:
+            return  # Tables not created yet; schema.sql defines these indexes too
+        for name, definition in INDEXES.items():
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" {definition};')
+
+
+def drop_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for name in INDEXES:
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}";')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('food', '0006_orderlist_pending_queue_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
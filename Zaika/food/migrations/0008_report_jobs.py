@@ -0,0 +1,62 @@
+# Background report jobs (food/reports.py). The job queue is claimed with
+# FOR UPDATE SKIP LOCKED by `manage.py run_report_worker`; the updated_at
+# index keeps the data watermark used in report cache keys a cheap lookup.
+# Built CONCURRENTLY, so this migration cannot run inside a transaction.
+
+from django.db import migrations
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS "report_jobs" (
+        "job_id" SERIAL PRIMARY KEY,
+        "kind" VARCHAR(32) NOT NULL,
+        "params" TEXT NOT NULL,
+        "cache_key" VARCHAR(40) NOT NULL,
+        "status" VARCHAR(16) NOT NULL DEFAULT 'queued',
+        "progress" INTEGER NOT NULL DEFAULT 0,
+        "artifact" VARCHAR(255),
+        "error" TEXT,
+        "worker" VARCHAR(64),
+        "attempts" INTEGER NOT NULL DEFAULT 0,
+        "created_at" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        "heartbeat_at" TIMESTAMP,
+        "finished_at" TIMESTAMP
+    );
+"""
+
+INDEXES = {
+    'idx_report_jobs_open':
+        'ON "report_jobs" ("job_id") WHERE "status" IN (\'queued\', \'running\')',
+    'idx_report_jobs_cache_key':
+        'ON "report_jobs" ("cache_key")',
+    'idx_orderlist_updated_at':
+        'ON "orderlist" ("updated_at")',
+}
+
+
+def create_jobs(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('orderlist');")
+        if cursor.fetchone()[0] is None:
+            return  # Tables not created yet; schema.sql defines all of this too
+        cursor.execute(CREATE_TABLE)
+        for name, definition in INDEXES.items():
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" {definition};')
+
+
+def drop_jobs(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS "idx_orderlist_updated_at";')
+        cursor.execute('DROP TABLE IF EXISTS "report_jobs";')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('food', '0007_orderlist_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_jobs, drop_jobs),
+    ]
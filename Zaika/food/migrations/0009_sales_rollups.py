@@ -0,0 +1,198 @@
+# Pre-aggregated sales by shop, item and hour (read by the admin sales
+# dashboard, food/rollups.py). Statement-level triggers on orderlist keep
+# them current in the same transaction as every order write, COPY included:
+# a line counts as a sale once it leaves 'Pending', and is taken back out if
+# it is deleted or its sale fields change. Existing orders are folded in once
+# here, with orderlist locked against writes so none are missed or counted
+# twice.
+
+from django.db import migrations
+
+# An order line that counts as a sale
+SALE_LINE = 'COALESCE("status", \'Pending\') <> \'Pending\' AND "timestamp" IS NOT NULL AND "shop_id" IS NOT NULL'
+
+CREATE_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS "sales_by_shop" (
+        "shop_id" INTEGER NOT NULL,
+        "sale_day" DATE NOT NULL,
+        "order_lines" INTEGER NOT NULL DEFAULT 0,
+        "items_sold" INTEGER NOT NULL DEFAULT 0,
+        "revenue" DECIMAL(12, 2) NOT NULL DEFAULT 0,
+        "cash_revenue" DECIMAL(12, 2) NOT NULL DEFAULT 0,
+        "online_revenue" DECIMAL(12, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY ("sale_day", "shop_id")
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS "sales_by_item" (
+        "shop_id" INTEGER NOT NULL,
+        "item_name" VARCHAR(255) NOT NULL,
+        "sale_day" DATE NOT NULL,
+        "order_lines" INTEGER NOT NULL DEFAULT 0,
+        "items_sold" INTEGER NOT NULL DEFAULT 0,
+        "revenue" DECIMAL(12, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY ("sale_day", "shop_id", "item_name")
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS "sales_by_hour" (
+        "shop_id" INTEGER NOT NULL,
+        "sale_hour" TIMESTAMP NOT NULL,
+        "order_lines" INTEGER NOT NULL DEFAULT 0,
+        "items_sold" INTEGER NOT NULL DEFAULT 0,
+        "revenue" DECIMAL(12, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY ("sale_hour", "shop_id")
+    );
+    """,
+    """
+    DO $$ BEGIN
+        CREATE TYPE orderlist_sale AS (
+            "shop_id" INTEGER, "item_name" VARCHAR(255), "sold_at" TIMESTAMP, "mode_of_payment" VARCHAR(50),
+            "qty" INTEGER, "total_amt" DECIMAL(10, 2), "sign" INTEGER
+        );
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$;
+    """,
+    """
+    CREATE OR REPLACE FUNCTION orderlist_rollup() RETURNS trigger AS $$
+    DECLARE
+        deltas orderlist_sale[] := '{}';
+    BEGIN
+        -- One signed delta per sale line the statement took away or added. An
+        -- update that leaves a sale as it was (Approved -> Completed ->
+        -- Delivered) gives a -1 and a +1 that cancel out in the GROUP BYs.
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            deltas := deltas || ARRAY(
+                SELECT ROW("shop_id", "item_name", "timestamp", "mode_of_payment", "qty", "total_amt", -1)::orderlist_sale
+                FROM old_rows WHERE SALE_LINE);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            deltas := deltas || ARRAY(
+                SELECT ROW("shop_id", "item_name", "timestamp", "mode_of_payment", "qty", "total_amt", 1)::orderlist_sale
+                FROM new_rows WHERE SALE_LINE);
+        END IF;
+        IF cardinality(deltas) = 0 THEN
+            RETURN NULL;
+        END IF;
+
+        -- Rows are upserted in key order so concurrent order writes lock them
+        -- in the same order and cannot deadlock each other
+        INSERT INTO "sales_by_shop" AS s ("shop_id", "sale_day", "order_lines", "items_sold", "revenue", "cash_revenue", "online_revenue")
+        SELECT "shop_id", "sold_at"::date, SUM("sign"), SUM("sign" * "qty"), SUM("sign" * "total_amt"),
+               COALESCE(SUM("sign" * "total_amt") FILTER (WHERE "mode_of_payment" = 'cash'), 0),
+               COALESCE(SUM("sign" * "total_amt") FILTER (WHERE "mode_of_payment" = 'Online'), 0)
+        FROM unnest(deltas)
+        GROUP BY 1, 2
+        HAVING SUM("sign") <> 0 OR SUM("sign" * "qty") <> 0 OR SUM("sign" * "total_amt") <> 0
+        ORDER BY 2, 1
+        ON CONFLICT ("sale_day", "shop_id") DO UPDATE SET
+            "order_lines" = s."order_lines" + EXCLUDED."order_lines",
+            "items_sold" = s."items_sold" + EXCLUDED."items_sold",
+            "revenue" = s."revenue" + EXCLUDED."revenue",
+            "cash_revenue" = s."cash_revenue" + EXCLUDED."cash_revenue",
+            "online_revenue" = s."online_revenue" + EXCLUDED."online_revenue";
+
+        INSERT INTO "sales_by_item" AS i ("shop_id", "item_name", "sale_day", "order_lines", "items_sold", "revenue")
+        SELECT "shop_id", "item_name", "sold_at"::date, SUM("sign"), SUM("sign" * "qty"), SUM("sign" * "total_amt")
+        FROM unnest(deltas)
+        GROUP BY 1, 2, 3
+        HAVING SUM("sign") <> 0 OR SUM("sign" * "qty") <> 0 OR SUM("sign" * "total_amt") <> 0
+        ORDER BY 3, 1, 2
+        ON CONFLICT ("sale_day", "shop_id", "item_name") DO UPDATE SET
+            "order_lines" = i."order_lines" + EXCLUDED."order_lines",
+            "items_sold" = i."items_sold" + EXCLUDED."items_sold",
+            "revenue" = i."revenue" + EXCLUDED."revenue";
+
+        INSERT INTO "sales_by_hour" AS h ("shop_id", "sale_hour", "order_lines", "items_sold", "revenue")
+        SELECT "shop_id", date_trunc('hour', "sold_at"), SUM("sign"), SUM("sign" * "qty"), SUM("sign" * "total_amt")
+        FROM unnest(deltas)
+        GROUP BY 1, 2
+        HAVING SUM("sign") <> 0 OR SUM("sign" * "qty") <> 0 OR SUM("sign" * "total_amt") <> 0
+        ORDER BY 2, 1
+        ON CONFLICT ("sale_hour", "shop_id") DO UPDATE SET
+            "order_lines" = h."order_lines" + EXCLUDED."order_lines",
+            "items_sold" = h."items_sold" + EXCLUDED."items_sold",
+            "revenue" = h."revenue" + EXCLUDED."revenue";
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """.replace('SALE_LINE', SALE_LINE),
+    # Statement-level, so a whole cart or bulk approval is folded in at once
+    'DROP TRIGGER IF EXISTS "orderlist_rollup_insert" ON "orderlist";',
+    'DROP TRIGGER IF EXISTS "orderlist_rollup_update" ON "orderlist";',
+    'DROP TRIGGER IF EXISTS "orderlist_rollup_delete" ON "orderlist";',
+    """
+    CREATE TRIGGER "orderlist_rollup_insert" AFTER INSERT ON "orderlist"
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION orderlist_rollup();
+    """,
+    """
+    CREATE TRIGGER "orderlist_rollup_update" AFTER UPDATE ON "orderlist"
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION orderlist_rollup();
+    """,
+    """
+    CREATE TRIGGER "orderlist_rollup_delete" AFTER DELETE ON "orderlist"
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION orderlist_rollup();
+    """,
+]
+
+# Rebuild from scratch (food.rollups.rebuild_rollups() runs the same statements)
+BACKFILL_SQL = [
+    'LOCK TABLE "orderlist" IN SHARE MODE;',
+    'TRUNCATE "sales_by_shop", "sales_by_item", "sales_by_hour";',
+    f"""
+    INSERT INTO "sales_by_shop" ("shop_id", "sale_day", "order_lines", "items_sold", "revenue", "cash_revenue", "online_revenue")
+    SELECT "shop_id", "timestamp"::date, COUNT(*), SUM("qty"), SUM("total_amt"),
+           COALESCE(SUM("total_amt") FILTER (WHERE "mode_of_payment" = 'cash'), 0),
+           COALESCE(SUM("total_amt") FILTER (WHERE "mode_of_payment" = 'Online'), 0)
+    FROM "orderlist"
+    WHERE {SALE_LINE}
+    GROUP BY 1, 2;
+    """,
+    f"""
+    INSERT INTO "sales_by_item" ("shop_id", "item_name", "sale_day", "order_lines", "items_sold", "revenue")
+    SELECT "shop_id", "item_name", "timestamp"::date, COUNT(*), SUM("qty"), SUM("total_amt")
+    FROM "orderlist"
+    WHERE {SALE_LINE}
+    GROUP BY 1, 2, 3;
+    """,
+    f"""
+    INSERT INTO "sales_by_hour" ("shop_id", "sale_hour", "order_lines", "items_sold", "revenue")
+    SELECT "shop_id", date_trunc('hour', "timestamp"), COUNT(*), SUM("qty"), SUM("total_amt")
+    FROM "orderlist"
+    WHERE {SALE_LINE}
+    GROUP BY 1, 2;
+    """,
+]
+
+
+def create_rollups(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('orderlist');")
+        if cursor.fetchone()[0] is None:
+            return  # Tables not created yet; schema.sql defines all of this too
+        for sql in CREATE_SQL + BACKFILL_SQL:
+            cursor.execute(sql)
+
+
+def drop_rollups(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for event in ('insert', 'update', 'delete'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS "orderlist_rollup_{event}" ON "orderlist";')
+        cursor.execute('DROP FUNCTION IF EXISTS orderlist_rollup();')
+        cursor.execute('DROP TYPE IF EXISTS orderlist_sale;')
+        cursor.execute('DROP TABLE IF EXISTS "sales_by_shop", "sales_by_item", "sales_by_hour";')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0008_report_jobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_rollups, drop_rollups),
+    ]
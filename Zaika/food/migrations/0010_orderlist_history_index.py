@@ -0,0 +1,40 @@
+# Index behind the customer past-orders API (food/order_history.py), which
+# pages through an email's tokens newest first and checks the time of its
+# latest token before serving a cached page. Only lines with a token are
+# listed, so only those are indexed. Built CONCURRENTLY, so this migration
+# cannot run inside a transaction.
+
+from django.db import migrations
+
+INDEXES = {
+    'idx_orderlist_email_timestamp_tokenid':
+        'ON "orderlist" ("email", "timestamp", "tokenid") WHERE "tokenid" IS NOT NULL',
+}
+
+
+def create_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('orderlist');")
+        if cursor.fetchone()[0] is None:
+            return  # Tables not created yet; schema.sql defines this index too
+        for name, definition in INDEXES.items():
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" {definition};')
+
+
+def drop_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for name in INDEXES:
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}";')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('food', '0009_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,53 @@
+# Payment ledger (food/payments.py). payment_intents keeps the customer and
+# cart under the order id handed to Express; payment_ledger records each
+# (order_id, txn_id) once, and its unique index is the lookup a repeated
+# callback is answered from.
+
+from django.db import migrations
+
+CREATE_TABLES = """
+    CREATE TABLE IF NOT EXISTS "payment_intents" (
+        "order_id" VARCHAR(64) PRIMARY KEY,
+        "email" VARCHAR(255) NOT NULL,
+        "name" VARCHAR(255) NOT NULL,
+        "contact_no" VARCHAR(15) NOT NULL,
+        "cart" TEXT NOT NULL,
+        "created_at" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS "payment_ledger" (
+        "ledger_id" SERIAL PRIMARY KEY,
+        "order_id" VARCHAR(64) NOT NULL,
+        "txn_id" VARCHAR(64) NOT NULL,
+        "source" VARCHAR(16) NOT NULL,
+        "status" VARCHAR(16) NOT NULL DEFAULT 'recorded',
+        "email" VARCHAR(255),
+        "tokenid" INTEGER,
+        "created_at" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        CONSTRAINT "payment_ledger_order_txn" UNIQUE ("order_id", "txn_id")
+    );
+"""
+
+
+def create_ledger(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('orderlist');")
+        if cursor.fetchone()[0] is None:
+            return  # Tables not created yet; schema.sql defines all of this too
+        cursor.execute(CREATE_TABLES)
+
+
+def drop_ledger(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS "payment_ledger";')
+        cursor.execute('DROP TABLE IF EXISTS "payment_intents";')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0010_orderlist_history_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_ledger, drop_ledger),
+    ]
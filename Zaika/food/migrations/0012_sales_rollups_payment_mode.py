@@ -0,0 +1,133 @@
+# The sales_by_shop upsert in orderlist_rollup() skipped updates whose only
+# effect was moving revenue between cash and online, so a cash line that
+# got mode_of_payment = 'cash' after it was approved never reached
+# cash_revenue. Replace the trigger function with the fixed one and rebuild
+# the rollups from orderlist, with orderlist locked against writes.
+#
+# The SQL is a copy, not an import from food/rollups.py, so this migration
+# keeps doing what it did when it was written.
+
+from django.db import migrations
+
+# An order line that counts as a sale
+SALE_LINE = 'COALESCE("status", \'Pending\') <> \'Pending\' AND "timestamp" IS NOT NULL AND "shop_id" IS NOT NULL'
+
+# orderlist_rollup() as in 0009, with the cash/online sums added to the sales_by_shop HAVING
+FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION orderlist_rollup() RETURNS trigger AS $$
+    DECLARE
+        deltas orderlist_sale[] := '{}';
+    BEGIN
+        -- One signed delta per sale line the statement took away or added. An
+        -- update that leaves a sale as it was (Approved -> Completed ->
+        -- Delivered) gives a -1 and a +1 that cancel out in the GROUP BYs.
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            deltas := deltas || ARRAY(
+                SELECT ROW("shop_id", "item_name", "timestamp", "mode_of_payment", "qty", "total_amt", -1)::orderlist_sale
+                FROM old_rows WHERE SALE_LINE);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            deltas := deltas || ARRAY(
+                SELECT ROW("shop_id", "item_name", "timestamp", "mode_of_payment", "qty", "total_amt", 1)::orderlist_sale
+                FROM new_rows WHERE SALE_LINE);
+        END IF;
+        IF cardinality(deltas) = 0 THEN
+            RETURN NULL;
+        END IF;
+
+        -- Rows are upserted in key order so concurrent order writes lock them
+        -- in the same order and cannot deadlock each other
+        INSERT INTO "sales_by_shop" AS s ("shop_id", "sale_day", "order_lines", "items_sold", "revenue", "cash_revenue", "online_revenue")
+        SELECT "shop_id", "sold_at"::date, SUM("sign"), SUM("sign" * "qty"), SUM("sign" * "total_amt"),
+               COALESCE(SUM("sign" * "total_amt") FILTER (WHERE "mode_of_payment" = 'cash'), 0),
+               COALESCE(SUM("sign" * "total_amt") FILTER (WHERE "mode_of_payment" = 'Online'), 0)
+        FROM unnest(deltas)
+        GROUP BY 1, 2
+        -- A payment mode set after approval (cash lines get 'cash' in a later UPDATE)
+        -- only moves revenue between cash and online, so those sums count too
+        HAVING SUM("sign") <> 0 OR SUM("sign" * "qty") <> 0 OR SUM("sign" * "total_amt") <> 0
+            OR SUM("sign" * "total_amt") FILTER (WHERE "mode_of_payment" = 'cash') <> 0
+            OR SUM("sign" * "total_amt") FILTER (WHERE "mode_of_payment" = 'Online') <> 0
+        ORDER BY 2, 1
+        ON CONFLICT ("sale_day", "shop_id") DO UPDATE SET
+            "order_lines" = s."order_lines" + EXCLUDED."order_lines",
+            "items_sold" = s."items_sold" + EXCLUDED."items_sold",
+            "revenue" = s."revenue" + EXCLUDED."revenue",
+            "cash_revenue" = s."cash_revenue" + EXCLUDED."cash_revenue",
+            "online_revenue" = s."online_revenue" + EXCLUDED."online_revenue";
+
+        INSERT INTO "sales_by_item" AS i ("shop_id", "item_name", "sale_day", "order_lines", "items_sold", "revenue")
+        SELECT "shop_id", "item_name", "sold_at"::date, SUM("sign"), SUM("sign" * "qty"), SUM("sign" * "total_amt")
+        FROM unnest(deltas)
+        GROUP BY 1, 2, 3
+        HAVING SUM("sign") <> 0 OR SUM("sign" * "qty") <> 0 OR SUM("sign" * "total_amt") <> 0
+        ORDER BY 3, 1, 2
+        ON CONFLICT ("sale_day", "shop_id", "item_name") DO UPDATE SET
+            "order_lines" = i."order_lines" + EXCLUDED."order_lines",
+            "items_sold" = i."items_sold" + EXCLUDED."items_sold",
+            "revenue" = i."revenue" + EXCLUDED."revenue";
+
+        INSERT INTO "sales_by_hour" AS h ("shop_id", "sale_hour", "order_lines", "items_sold", "revenue")
+        SELECT "shop_id", date_trunc('hour', "sold_at"), SUM("sign"), SUM("sign" * "qty"), SUM("sign" * "total_amt")
+        FROM unnest(deltas)
+        GROUP BY 1, 2
+        HAVING SUM("sign") <> 0 OR SUM("sign" * "qty") <> 0 OR SUM("sign" * "total_amt") <> 0
+        ORDER BY 2, 1
+        ON CONFLICT ("sale_hour", "shop_id") DO UPDATE SET
+            "order_lines" = h."order_lines" + EXCLUDED."order_lines",
+            "items_sold" = h."items_sold" + EXCLUDED."items_sold",
+            "revenue" = h."revenue" + EXCLUDED."revenue";
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """.replace('SALE_LINE', SALE_LINE)
+
+# Recompute every rollup from orderlist; run with orderlist locked against writes
+BACKFILL_SQL = [
+    'TRUNCATE "sales_by_shop", "sales_by_item", "sales_by_hour";',
+    f"""
+    INSERT INTO "sales_by_shop" ("shop_id", "sale_day", "order_lines", "items_sold", "revenue", "cash_revenue", "online_revenue")
+    SELECT "shop_id", "timestamp"::date, COUNT(*), SUM("qty"), SUM("total_amt"),
+           COALESCE(SUM("total_amt") FILTER (WHERE "mode_of_payment" = 'cash'), 0),
+           COALESCE(SUM("total_amt") FILTER (WHERE "mode_of_payment" = 'Online'), 0)
+    FROM "orderlist"
+    WHERE {SALE_LINE}
+    GROUP BY 1, 2;
+    """,
+    f"""
+    INSERT INTO "sales_by_item" ("shop_id", "item_name", "sale_day", "order_lines", "items_sold", "revenue")
+    SELECT "shop_id", "item_name", "timestamp"::date, COUNT(*), SUM("qty"), SUM("total_amt")
+    FROM "orderlist"
+    WHERE {SALE_LINE}
+    GROUP BY 1, 2, 3;
+    """,
+    f"""
+    INSERT INTO "sales_by_hour" ("shop_id", "sale_hour", "order_lines", "items_sold", "revenue")
+    SELECT "shop_id", date_trunc('hour', "timestamp"), COUNT(*), SUM("qty"), SUM("total_amt")
+    FROM "orderlist"
+    WHERE {SALE_LINE}
+    GROUP BY 1, 2;
+    """,
+]
+
+
+def fix_rollups(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('sales_by_shop');")
+        if cursor.fetchone()[0] is None:
+            return  # 0009 found no orderlist, so there is nothing to fix
+        cursor.execute(FUNCTION_SQL)
+        cursor.execute('LOCK TABLE "orderlist" IN SHARE MODE;')
+        for sql in BACKFILL_SQL:
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0011_payment_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(fix_rollups, migrations.RunPython.noop),
+    ]
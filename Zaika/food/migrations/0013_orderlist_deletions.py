@@ -0,0 +1,63 @@
+# Deletion tombstones for the stall bookings delta feed (food.views.bookings_changes).
+#
+# Deleted orderlist rows leave nothing for `change_xid >= cursor` to find, so
+# a statement-level trigger records each deleted line's order_id and shop_id
+# under the deleting transaction's id. The report worker prunes tombstones
+# older than BOOKINGS_DELETIONS_RETENTION_HOURS (food.orders.prune_deletions).
+
+from django.db import migrations
+
+DELETIONS_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS "orderlist_deletions" (
+        "order_id" INTEGER NOT NULL,
+        "shop_id" INTEGER,
+        "change_xid" xid8 NOT NULL DEFAULT pg_current_xact_id(),
+        "deleted_at" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    'CREATE INDEX IF NOT EXISTS "idx_orderlist_deletions_shop_change_xid" ON "orderlist_deletions" ("shop_id", "change_xid");',
+    'CREATE INDEX IF NOT EXISTS "idx_orderlist_deletions_deleted_at" ON "orderlist_deletions" ("deleted_at");',
+    """
+    CREATE OR REPLACE FUNCTION orderlist_track_delete() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO "orderlist_deletions" ("order_id", "shop_id")
+        SELECT "order_id", "shop_id" FROM old_rows;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    'DROP TRIGGER IF EXISTS "orderlist_track_delete" ON "orderlist";',
+    """
+    CREATE TRIGGER "orderlist_track_delete"
+    AFTER DELETE ON "orderlist" REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION orderlist_track_delete();
+    """,
+]
+
+
+def add_deletions(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('orderlist');")
+        if cursor.fetchone()[0] is None:
+            return  # Tables not created yet; schema.sql defines all of this too
+        for sql in DELETIONS_SQL:
+            cursor.execute(sql)
+
+
+def remove_deletions(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP TRIGGER IF EXISTS "orderlist_track_delete" ON "orderlist";')
+        cursor.execute('DROP FUNCTION IF EXISTS orderlist_track_delete();')
+        cursor.execute('DROP TABLE IF EXISTS "orderlist_deletions";')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0012_sales_rollups_payment_mode'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_deletions, remove_deletions),
+    ]
@@ -0,0 +1,38 @@
+# The report cache watermark (food.reports.data_watermark) moved from
+# MAX("updated_at") to MAX("change_xid"): updated_at is the writing
+# transaction's start time, so a long transaction committing after a newer
+# one did not move it. Swap the index the watermark is read from.
+# Built CONCURRENTLY, so this migration cannot run inside a transaction.
+
+from django.db import migrations
+
+
+def swap_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('orderlist');")
+        if cursor.fetchone()[0] is None:
+            return  # Tables not created yet; schema.sql defines all of this too
+        cursor.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_orderlist_change_xid" ON "orderlist" ("change_xid");')
+        cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS "idx_orderlist_updated_at";')
+
+
+def restore_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('orderlist');")
+        if cursor.fetchone()[0] is None:
+            return
+        cursor.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_orderlist_updated_at" ON "orderlist" ("updated_at");')
+        cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS "idx_orderlist_change_xid";')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('food', '0013_orderlist_deletions'),
+    ]
+
+    operations = [
+        migrations.RunPython(swap_index, restore_index),
+    ]
@@ -0,0 +1,44 @@
+# Day each line's pickup token was issued on (food/tokens.py). Token numbers
+# restart every day, and a cash order's lines are stamped when placed but
+# tokened when approved, possibly after midnight, so stall token transitions
+# (food.orders.transition_order_lines) match on this day instead of the line
+# timestamp. Lines tokened before this column existed fall back to the date
+# of their timestamp, so there is no backfill. The index is built
+# CONCURRENTLY, so this migration cannot run inside a transaction.
+
+from django.db import migrations
+
+INDEXES = {
+    'idx_orderlist_shop_tokenid':
+        'ON "orderlist" ("shop_id", "tokenid") WHERE "tokenid" IS NOT NULL',
+}
+
+
+def add_token_day(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('orderlist');")
+        if cursor.fetchone()[0] is None:
+            return  # Tables not created yet; schema.sql defines all of this too
+        cursor.execute('ALTER TABLE "orderlist" ADD COLUMN IF NOT EXISTS "token_day" DATE;')
+        for name, definition in INDEXES.items():
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" {definition};')
+
+
+def remove_token_day(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for name in INDEXES:
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}";')
+        cursor.execute('ALTER TABLE IF EXISTS "orderlist" DROP COLUMN IF EXISTS "token_day";')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('food', '0014_orderlist_change_xid_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_token_day, remove_token_day),
+    ]
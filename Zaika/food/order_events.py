@@ -0,0 +1,108 @@
+"""
+In-process order status notifications.
+
+Views that change an order's status (`approve_order`, `remove_order`,
+`update_order_status`, ...) call `notify_order_change(email)`, which is
+published on the event bus so every worker process hears it.
+
+Each email has a change counter in each process. Two readers use it:
+
+* The waiting-page stream under ASGI (food/async_views.py) awaits
+  `await_order_change()`, which parks a future on its event loop until the
+  counter moves (or a timeout, so it can send heartbeats), and only then
+  re-runs its status queries.
+* The waiting-page poll (`check_order_status`) hands out
+  `order_change_stamp()` with a pending status. While the client sends back
+  the current stamp, nothing has changed for its email and the poll is
+  answered without a query.
+"""
+import asyncio
+import threading
+
+from . import event_bus
+
+_changes = {}  # email -> change counter
+_async_waiters = {}  # email -> futures of coroutines waiting on it
+_condition = threading.Condition()
+
+
+def order_change_version(email):
+    with _condition:
+        return _changes.get(email, 0)
+
+
+def order_change_stamp(email):
+    """
+    Opaque stamp of the changes this process has heard for `email`, or None
+    while its event bus listener is down (changes could be missed). Stamps
+    name the process and its LISTEN session, so a stamp from another worker,
+    or from before a reconnect, never matches.
+    """
+    listening = event_bus.listening_id()
+    if listening is None:
+        return None
+    return f'{listening}.{order_change_version(email)}'
+
+
+def notify_order_change(*emails):
+    """Wake everyone waiting on these emails, once the current transaction commits."""
+    emails = sorted({email for email in emails if email})
+    if emails:
+        event_bus.publish(event_bus.ORDER_STATUS_CHANGED, {'emails': emails})
+
+
+def _notify(payload):
+    with _condition:
+        for email in payload.get('emails', ()):
+            _changes[email] = _changes.get(email, 0) + 1
+            _wake_async(email)
+
+
+def _notify_everyone(payload):
+    # Changes may have been missed while the bus was down: make every waiter re-check
+    with _condition:
+        for email in set(_changes) | set(_async_waiters):
+            _changes[email] = _changes.get(email, 0) + 1
+            _wake_async(email)
+
+
+def _wake_async(email):
+    # Called with _condition held, from whichever thread delivered the event
+    for future in _async_waiters.get(email, ()):
+        future.get_loop().call_soon_threadsafe(_resolve, future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+event_bus.subscribe(event_bus.ORDER_STATUS_CHANGED, _notify)
+event_bus.subscribe(event_bus.BUS_RECONNECTED, _notify_everyone)
+
+
+async def await_order_change(email, seen_version, timeout):
+    """
+    Wait until the change counter for `email` moves past `seen_version`, or
+    `timeout` seconds pass. Returns (changed, current_version). Waiting costs
+    a future on the running event loop, not a thread.
+    """
+    future = asyncio.get_running_loop().create_future()
+    with _condition:
+        current = _changes.get(email, 0)
+        if current != seen_version:
+            return True, current
+        _async_waiters.setdefault(email, set()).add(future)
+    try:
+        await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        with _condition:
+            waiters = _async_waiters.get(email)
+            if waiters is not None:
+                waiters.discard(future)
+                if not waiters:
+                    del _async_waiters[email]
+    current = order_change_version(email)
+    return current != seen_version, current
@@ -0,0 +1,170 @@
+"""
+Paginated, cached past orders for the customer past-orders page.
+
+`past_orders` used to send every token an email ever had in one response,
+re-joined against `shops` on each visit, and the page asks again on a
+timer. Now:
+
+* `history_page()` returns one page of PAST_ORDERS_PAGE_SIZE tokens, newest
+  first, keyed on (latest line time, token) of the last token on the
+  previous page rather than OFFSET. Only the page's tokens are joined
+  against `shops` and shaped into JSON.
+* Finished pages are cached per email, in this process, together with the
+  time of the email's latest token. Each request first reads that time
+  from idx_orderlist_email_timestamp_tokenid and only serves the cached
+  page if it has not moved.
+* `notify_orders_written()` is called by every view that gives an email a
+  new token; it publishes ORDERS_WRITTEN on the event bus, and that and
+  ORDER_STATUS_CHANGED drop the email's pages in every worker process. A
+  status change does not move the latest time, so that check alone would
+  not catch it.
+
+The cache holds at most PAST_ORDERS_CACHE_USERS emails, least recently
+used first out.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from django.db import connection
+
+from . import event_bus
+from .sql_json import fetch_json_text
+
+PAST_ORDERS_PAGE_SIZE = 10
+PAST_ORDERS_CACHE_USERS = int(os.getenv('PAST_ORDERS_CACHE_USERS', '1000'))
+
+_pages = OrderedDict()  # email -> (latest token time, {cursor: response body})
+_generation = 0         # bumped by every invalidation
+_lock = threading.Lock()
+
+
+def notify_orders_written(*emails):
+    """Drop cached past orders for these emails, once the current transaction commits."""
+    emails = sorted({email for email in emails if email})
+    if emails:
+        event_bus.publish(event_bus.ORDERS_WRITTEN, {'emails': emails})
+
+
+def _invalidate(payload):
+    global _generation
+    with _lock:
+        _generation += 1
+        for email in payload.get('emails', ()):
+            _pages.pop(email, None)
+
+
+def _invalidate_everyone(payload):
+    # Writes may have been missed while the bus was down
+    global _generation
+    with _lock:
+        _generation += 1
+        _pages.clear()
+
+
+event_bus.subscribe(event_bus.ORDERS_WRITTEN, _invalidate)
+event_bus.subscribe(event_bus.ORDER_STATUS_CHANGED, _invalidate)
+event_bus.subscribe(event_bus.BUS_RECONNECTED, _invalidate_everyone)
+
+
+def parse_history_cursor(value):
+    # "<latest line time ISO>_<tokenid>" of the last token on the previous page
+    timestamp, _, tokenid = value.rpartition('_')
+    try:
+        return datetime.fromisoformat(timestamp), int(tokenid)
+    except ValueError:
+        return None
+
+
+def history_page(email, position=None):
+    """
+    The response body (JSON text) for one page of the email's tokens:
+    {"orders": [...], "next_cursor": "..." or null}. `position` is a parsed
+    cursor, or None for the first page.
+    """
+    cursor_key = None if position is None else f"{position[0].isoformat()}_{position[1]}"
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT MAX("timestamp") FROM "orderlist"
+            WHERE "email" = %s AND "tokenid" IS NOT NULL;
+        """, [email])
+        latest = cursor.fetchone()[0]
+
+        with _lock:
+            generation = _generation
+            cached = _pages.get(email)
+            if cached is not None and cached[0] == latest and cursor_key in cached[1]:
+                _pages.move_to_end(email)
+                return cached[1][cursor_key]
+
+        body = _build_page(cursor, email, position)
+
+    with _lock:
+        # A page built while an invalidation landed may already be stale
+        if _generation == generation:
+            cached = _pages.get(email)
+            if cached is None or cached[0] != latest:
+                cached = (latest, {})
+                _pages[email] = cached
+            cached[1][cursor_key] = body
+            _pages.move_to_end(email)
+            while len(_pages) > PAST_ORDERS_CACHE_USERS:
+                _pages.popitem(last=False)
+    return body
+
+
+def _build_page(cursor, email, position):
+    having = ''
+    args = [email]
+    if position is not None:
+        having = 'HAVING (MAX("timestamp"), "tokenid") < (%s, %s)'
+        args.extend(position)
+
+    # Token numbers restart every day, so a token is (tokenid, day)
+    cursor.execute(f"""
+        SELECT "tokenid", "timestamp"::date, MAX("timestamp")
+        FROM "orderlist"
+        WHERE "email" = %s AND "tokenid" IS NOT NULL AND "timestamp" IS NOT NULL
+        GROUP BY "tokenid", "timestamp"::date
+        {having}
+        ORDER BY MAX("timestamp") DESC, "tokenid" DESC
+        LIMIT %s;
+    """, args + [PAST_ORDERS_PAGE_SIZE + 1])
+    tokens = cursor.fetchall()
+
+    next_cursor = None
+    if len(tokens) > PAST_ORDERS_PAGE_SIZE:
+        tokens = tokens[:PAST_ORDERS_PAGE_SIZE]
+        next_cursor = f"{tokens[-1][2].isoformat()}_{tokens[-1][0]}"
+
+    orders = '[]'
+    if tokens:
+        # One JSON document per token on this page, built by Postgres
+        orders = fetch_json_text(cursor, """
+            SELECT json_build_object(
+                'token_id', t."tokenid",
+                'timestamp', to_char(t."last_at", 'DD FMMonth YYYY, HH12:MI AM'),
+                'mode_of_payment', (array_agg(o."mode_of_payment" ORDER BY o."timestamp" DESC))[1],
+                'items', json_agg(json_build_object(
+                    'shop_name', s."shop_name",
+                    'item_name', o."item_name",
+                    'quantity', o."qty",
+                    'total_amount', o."total_amt",
+                    'status', o."status"
+                ) ORDER BY o."timestamp" DESC, o."order_id"),
+                'grand_total', SUM(o."total_amt")
+            ) AS "doc"
+            FROM unnest(%s::integer[], %s::date[], %s::timestamp[]) AS t("tokenid", "day", "last_at")
+            JOIN "orderlist" o
+              ON o."email" = %s AND o."tokenid" = t."tokenid"
+             AND o."timestamp" >= t."day" AND o."timestamp" < t."day" + 1
+            JOIN "shops" s ON o."shop_id" = s."shop_id"
+            GROUP BY t."tokenid", t."day", t."last_at"
+            ORDER BY t."last_at" DESC, t."tokenid" DESC
+        """, [
+            [token[0] for token in tokens], [token[1] for token in tokens], [token[2] for token in tokens], email,
+        ])
+
+    return '{"orders": ' + orders + ', "next_cursor": ' + json.dumps(next_cursor) + '}'
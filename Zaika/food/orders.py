@@ -0,0 +1,287 @@
+"""
+Set-based order writing for Zaika.
+
+Turning a cart into `orderlist` rows used to cost one availability SELECT
+plus one INSERT per line item. The helpers here do it in two round trips
+per cart, whatever its size:
+
+* `validate_cart()` checks availability of every item with a single query
+  keyed on item ids (prices come from `food.pricing`, not from this query).
+* `insert_order_lines()` writes all lines with one multi-row
+  INSERT ... RETURNING.
+* `write_order_lines()` picks that INSERT for normal carts and switches to
+  COPY for large group orders where the ids are not needed.
+* `resolve_pending_orders()` approves or rejects many pending cash lines,
+  picked by order id or customer email, with one statement.
+* `transition_order_lines()` moves a stall's lines (a whole token, or any
+  set of order ids) to their next status with one conditional UPDATE.
+* `prune_deletions()` drops old `orderlist_deletions` tombstones in small
+  batches; the report worker runs it as housekeeping.
+
+All take an open cursor so callers keep control of the transaction: run
+them inside `transaction.atomic()` and any failure rolls back the whole cart.
+"""
+import csv
+import os
+from io import StringIO
+
+from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+ORDERLINE_COLUMNS = (
+    "email", "name", "contact_no", "shop_id", "item_name", "qty", "total_amt",
+    "status", "tokenid", "token_day", "timestamp", "mode_of_payment", "menu_version",
+)
+_COLUMN_LIST = ", ".join(f'"{column}"' for column in ORDERLINE_COLUMNS)
+# Columns a cart may leave NULL (a cash order has no token or payment mode yet)
+_NULLABLE_COLUMNS = ", ".join(f'"{column}"' for column in ("shop_id", "tokenid", "token_day", "mode_of_payment", "menu_version"))
+
+# Above this many lines COPY beats a multi-row INSERT (see benchmarks/payment_callback.py)
+COPY_THRESHOLD = 100
+
+# Deletion tombstones are kept this long; a board that has not polled for longer reloads
+BOOKINGS_DELETIONS_RETENTION_HOURS = int(os.getenv('BOOKINGS_DELETIONS_RETENTION_HOURS', '24'))
+PRUNE_BATCH_SIZE = 1000
+
+
+# Day a line's token was issued on; lines tokened before token_day was stored use their own date
+_TOKEN_DAY = 'COALESCE("token_day", "timestamp"::date)'
+
+
+# Stall status flow: target status -> the status a line must be in to move there
+TRANSITIONS = {
+    'Completed': 'Approved',
+    'Delivered': 'Completed',
+}
+_LATER_STATUSES = {
+    'Completed': ('Completed', 'Delivered'),
+    'Delivered': ('Delivered',),
+}
+
+# Per-line outcomes of transition_order_lines()
+APPLIED = 'applied'
+ALREADY_DONE = 'already_done'  # Someone (or an earlier replay) got there first
+CONFLICT = 'conflict'          # Line is in a status this transition cannot start from
+NOT_FOUND = 'not_found'        # No such line for this shop
+
+
+class CartUnavailable(Exception):
+    """Raised when a cart contains items that are missing or switched off."""
+
+    def __init__(self, message, item_ids):
+        super().__init__(message)
+        self.item_ids = item_ids
+
+
+def validate_cart(cursor, lines):
+    """
+    Check availability for the whole cart in one query.
+
+    Raises CartUnavailable naming every item that is unknown, belongs to
+    another shop, or is switched off.
+    """
+    if not lines:
+        raise CartUnavailable("The cart is empty.", [])
+
+    cursor.execute("""
+        SELECT "id", "shop_id", "name", "availability"
+        FROM "menuitems"
+        WHERE "id" = ANY(%s);
+    """, [[line.item_id for line in lines]])
+    rows = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    not_found = []
+    unavailable = {}
+    for line in lines:
+        row = rows.get(line.item_id)
+        if row is None or row[0] != line.shop_id:
+            not_found.append(line.item_id)
+            continue
+        shop_id, name, availability = row
+        if availability != 1:
+            unavailable[line.item_id] = name
+
+    if not_found or unavailable:
+        parts = []
+        if unavailable:
+            parts.append("unavailable: " + ", ".join(unavailable.values()))
+        if not_found:
+            parts.append("not found in the menu: item " + ", ".join(str(i) for i in not_found))
+        raise CartUnavailable(
+            "Some items cannot be ordered (" + "; ".join(parts) + ").",
+            not_found + list(unavailable),
+        )
+
+
+def insert_order_lines(cursor, items, *, email, name, contact_no, status, timestamp,
+                       tokenid=None, token_day=None, mode_of_payment=None, menu_version=None):
+    """
+    Write every cart item as an `orderlist` row with one multi-row INSERT.
+    `timestamp` is required because an explicit NULL would bypass the column
+    default. Returns the new order_ids in cart order.
+    """
+    if not items:
+        return []
+
+    placeholders = "(" + ", ".join(["%s"] * len(ORDERLINE_COLUMNS)) + ")"
+    params = []
+    for row in _order_rows(items, email, name, contact_no, status, timestamp, tokenid, token_day, mode_of_payment, menu_version):
+        params.extend(row)
+
+    cursor.execute(
+        f'INSERT INTO "orderlist" ({_COLUMN_LIST}) VALUES '
+        + ", ".join([placeholders] * len(items))
+        + ' RETURNING "order_id";',
+        params,
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def copy_order_lines(cursor, items, *, email, name, contact_no, status, timestamp,
+                     tokenid=None, token_day=None, mode_of_payment=None, menu_version=None):
+    """
+    Stream every cart item into `orderlist` with COPY. Cheapest for very
+    large carts, but returns no order_ids. Returns the number of rows written.
+    """
+    if not items:
+        return 0
+
+    rows = _order_rows(items, email, name, contact_no, status, timestamp, tokenid, token_day, mode_of_payment, menu_version)
+    sql = f'COPY "orderlist" ({_COLUMN_LIST}) FROM STDIN'
+    if is_psycopg3:
+        with cursor.copy(sql) as copy:
+            for row in rows:
+                copy.write_row(row)
+    else:
+        # psycopg2: CSV with every non-numeric field quoted, None included (it is
+        # written as ""). A quoted "" is an empty string to COPY, so FORCE_NULL
+        # turns it back into NULL in the columns that can be NULL.
+        buffer = StringIO()
+        csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(sql + f" WITH (FORMAT csv, FORCE_NULL ({_NULLABLE_COLUMNS}))", buffer)
+    return len(items)
+
+
+def write_order_lines(cursor, items, **fields):
+    """
+    Write a cart whose order_ids the caller does not need, picking the
+    cheapest statement for its size. Returns the number of rows written.
+    """
+    if len(items) > COPY_THRESHOLD:
+        return copy_order_lines(cursor, items, **fields)
+    return len(insert_order_lines(cursor, items, **fields))
+
+
+def resolve_pending_orders(cursor, approve, *, order_ids=(), emails=()):
+    """
+    Approve (or, with approve=False, delete) every Pending line whose
+    order_id is in `order_ids` or whose customer is in `emails`. Lines that
+    are no longer Pending are left alone, so a repeated request is a no-op.
+    Returns [(order_id, email)] of the lines that were changed.
+    """
+    order_ids = [int(order_id) for order_id in order_ids]
+    emails = list(emails)
+    if not order_ids and not emails:
+        return []
+
+    if approve:
+        sql = """UPDATE "orderlist" SET "status" = 'Approved'"""
+    else:
+        sql = 'DELETE FROM "orderlist"'
+    cursor.execute(sql + """
+        WHERE "status" = 'Pending'
+          AND ("order_id" = ANY(%s::integer[]) OR "email" = ANY(%s::varchar[]))
+        RETURNING "order_id", "email";
+    """, [order_ids, emails])
+    return cursor.fetchall()
+
+
+def transition_order_lines(cursor, shop_id, to_status, *, order_ids=(), tokenid=None, token_day=None):
+    """
+    Move the shop's lines named by `order_ids` and/or every line of `tokenid`
+    issued on `token_day` (tokens restart each day; None means the latest day
+    the shop has that token) to `to_status`, but only those still in the
+    status the transition starts from. The day is the one the token was
+    issued on, stored with it, not the day the lines were placed: a cash
+    order placed before midnight can be approved after it.
+
+    One statement locks the named lines, updates the movable ones and reports
+    every line, so concurrent operators and replays of the same request are
+    safe. Returns (results, emails): results is a list of
+    {'order_id', 'result', 'status'} with `status` the line's status after
+    the call; emails are the customers whose lines moved.
+    """
+    from_status = TRANSITIONS[to_status]
+    order_ids = [int(order_id) for order_id in order_ids]
+
+    cursor.execute(f"""
+        WITH "targets" AS (
+            SELECT "order_id", "status"
+            FROM "orderlist"
+            WHERE "shop_id" = %s
+              AND ("order_id" = ANY(%s::integer[]) OR ("tokenid" = %s AND {_TOKEN_DAY} = COALESCE(%s::date, (
+                      SELECT MAX({_TOKEN_DAY}) FROM "orderlist" WHERE "shop_id" = %s AND "tokenid" = %s
+                  ))))
+            ORDER BY "order_id"
+            FOR UPDATE
+        ), "moved" AS (
+            UPDATE "orderlist" o
+            SET "status" = %s
+            FROM "targets" t
+            WHERE o."order_id" = t."order_id" AND t."status" = %s
+            RETURNING o."order_id", o."email"
+        )
+        SELECT t."order_id", t."status", m."email"
+        FROM "targets" t
+        LEFT JOIN "moved" m ON m."order_id" = t."order_id"
+        ORDER BY t."order_id";
+    """, [shop_id, order_ids, tokenid, token_day, shop_id, tokenid, to_status, from_status])
+
+    results = []
+    emails = set()
+    seen = set()
+    for order_id, status, email in cursor.fetchall():
+        seen.add(order_id)
+        if email is not None:
+            results.append({'order_id': order_id, 'result': APPLIED, 'status': to_status})
+            emails.add(email)
+        elif status in _LATER_STATUSES[to_status]:
+            results.append({'order_id': order_id, 'result': ALREADY_DONE, 'status': status})
+        else:
+            results.append({'order_id': order_id, 'result': CONFLICT, 'status': status})
+    for order_id in order_ids:
+        if order_id not in seen:
+            results.append({'order_id': order_id, 'result': NOT_FOUND, 'status': None})
+            seen.add(order_id)
+    return results, sorted(emails)
+
+
+def _order_rows(items, email, name, contact_no, status, timestamp, tokenid, token_day, mode_of_payment, menu_version):
+    return [
+        (email, name, contact_no, item.shop_id, item.item_name, item.qty, item.total_price,
+         status, tokenid, token_day, timestamp, mode_of_payment, menu_version)
+        for item in items
+    ]
+
+
+def prune_deletions(cursor, batch_size=PRUNE_BATCH_SIZE):
+    """
+    Delete tombstones older than BOOKINGS_DELETIONS_RETENTION_HOURS,
+    `batch_size` rows per statement so the delete triggers of concurrent
+    order writes never wait behind one large DELETE. Returns the number of
+    rows deleted.
+    """
+    deleted = 0
+    while True:
+        cursor.execute("""
+            DELETE FROM "orderlist_deletions"
+            WHERE "ctid" IN (
+                SELECT "ctid" FROM "orderlist_deletions"
+                WHERE "deleted_at" < CURRENT_TIMESTAMP - make_interval(hours => %s)
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            );
+        """, [BOOKINGS_DELETIONS_RETENTION_HOURS, batch_size])
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return deleted
@@ -0,0 +1,276 @@
+"""
+Process-wide HTTP client for the Express payment backend (BACKEND_URL).
+
+`create_order` used to `requests.post()` with a 30 second timeout, opening
+a new connection per payment and pinning a waitress thread for as long as
+the backend stalled. `express_gateway()` returns one shared client per
+process instead:
+
+* a pooled keep-alive `requests.Session`, with up to PAYMENT_POOL_SIZE
+  connections (one per waitress thread by default);
+* separate connect and read timeouts (PAYMENT_CONNECT_TIMEOUT,
+  PAYMENT_READ_TIMEOUT);
+* up to PAYMENT_RETRIES retries with backoff. Idempotent methods are
+  retried on connection errors, read errors and 502/503/504; a POST is
+  only retried when the connection could not be opened, since the backend
+  never saw it;
+* a circuit breaker: after PAYMENT_BREAKER_FAILURES consecutive failures
+  (connection errors, timeouts, 5xx) calls raise GatewayUnavailable at
+  once for PAYMENT_BREAKER_RESET seconds. Then a single trial call is let
+  through; it closes the breaker if it succeeds and re-opens it if not.
+
+A child process made by fork() builds its own client rather than sharing
+the parent's sockets.
+
+`async_express_gateway()` is the same client for the async views under
+ASGI (food/async_views.py), on httpx, so a call in flight costs a
+coroutine rather than a thread. It shares the breaker with the sync client
+and keeps up to PAYMENT_ASYNC_POOL_SIZE connections. httpx is only
+imported when it is first used, so WSGI deployments do not need it.
+"""
+import asyncio
+import os
+import threading
+import time
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BACKEND_URL = os.environ.get("BACKEND_URL", "http://localhost:8000")
+PAYMENT_POOL_SIZE = int(os.getenv('PAYMENT_POOL_SIZE', os.getenv('WAITRESS_THREADS', '8')))
+PAYMENT_CONNECT_TIMEOUT = float(os.getenv('PAYMENT_CONNECT_TIMEOUT', '3.05'))
+PAYMENT_READ_TIMEOUT = float(os.getenv('PAYMENT_READ_TIMEOUT', '10'))
+PAYMENT_RETRIES = int(os.getenv('PAYMENT_RETRIES', '2'))
+PAYMENT_BREAKER_FAILURES = int(os.getenv('PAYMENT_BREAKER_FAILURES', '5'))
+PAYMENT_BREAKER_RESET = float(os.getenv('PAYMENT_BREAKER_RESET', '30'))
+PAYMENT_ASYNC_POOL_SIZE = int(os.getenv('PAYMENT_ASYNC_POOL_SIZE', '100'))
+
+
+class PaymentGatewayError(Exception):
+    """Raised when the payment backend cannot be reached or keeps failing."""
+
+
+class GatewayUnavailable(PaymentGatewayError):
+    """Raised without calling the backend while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold=PAYMENT_BREAKER_FAILURES, reset_after=PAYMENT_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None   # monotonic time the breaker opened, None while closed
+        self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if self._trial_running or time.monotonic() - self._opened_at >= self.reset_after:
+                return 'half-open'
+            return 'open'
+
+    def before_call(self):
+        """Raise GatewayUnavailable unless a call may go through now."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._trial_running or time.monotonic() - self._opened_at < self.reset_after:
+                raise GatewayUnavailable("Payment server is unavailable")
+            self._trial_running = True  # This call is the trial
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def abandon(self):
+        """A call ended without a verdict; let the next one be the trial if it was one."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class PaymentGateway:
+
+    def __init__(self, base_url=BACKEND_URL, *, pool_size=PAYMENT_POOL_SIZE, retries=PAYMENT_RETRIES,
+                 timeout=(PAYMENT_CONNECT_TIMEOUT, PAYMENT_READ_TIMEOUT), breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.pid = os.getpid()
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            other=0,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,  # Not POST; see the module docstring
+            status_forcelist=(502, 503, 504),
+            backoff_factor=0.2,
+            raise_on_status=False,  # Hand the last 5xx back rather than raising
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        # Shared by every user's request, so never carry cookies from one call to the next
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, **kwargs):
+        """
+        Send a request to the backend and return the `requests.Response`,
+        whatever its status. Raises GatewayUnavailable while the breaker is
+        open and PaymentGatewayError when the backend cannot be reached.
+        """
+        self.breaker.before_call()
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            response = self.session.request(method, self.url(path), **kwargs)
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            raise PaymentGatewayError(f"Payment server request failed: {e}") from e
+        except Exception:
+            self.breaker.record_failure()  # Never leave a trial call unresolved
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncPaymentGateway:
+    """PaymentGateway for coroutines; same retry rules, same breaker semantics."""
+
+    RETRY_STATUSES = (502, 503, 504)
+
+    def __init__(self, base_url=BACKEND_URL, *, pool_size=PAYMENT_ASYNC_POOL_SIZE, retries=PAYMENT_RETRIES,
+                 timeout=(PAYMENT_CONNECT_TIMEOUT, PAYMENT_READ_TIMEOUT), breaker=None):
+        import httpx
+
+        self.base_url = base_url.rstrip('/')
+        self.retries = retries
+        self.breaker = breaker or CircuitBreaker()
+        self.pid = os.getpid()
+        self.loop = asyncio.get_running_loop()
+        self._transport_errors = (httpx.ReadError, httpx.ReadTimeout, httpx.RemoteProtocolError)
+        self._request_error = httpx.HTTPError
+        connect_timeout, read_timeout = timeout
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            # The transport retries only failed connects, which is safe for any method
+            transport=httpx.AsyncHTTPTransport(
+                retries=retries,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            ),
+            # Shared by every user's request, so never carry cookies from one call to the next
+            cookies=httpx.Cookies(CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))),
+        )
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    async def request(self, method, path, **kwargs):
+        """
+        Send a request to the backend and return the `httpx.Response`,
+        whatever its status. Raises GatewayUnavailable while the breaker is
+        open and PaymentGatewayError when the backend cannot be reached.
+        """
+        self.breaker.before_call()
+        idempotent = method.upper() in Retry.DEFAULT_ALLOWED_METHODS
+        try:
+            for attempt in range(self.retries + 1):
+                last_attempt = not idempotent or attempt == self.retries
+                try:
+                    response = await self.client.request(method, '/' + path.lstrip('/'), **kwargs)
+                except self._transport_errors:
+                    if last_attempt:
+                        raise
+                else:
+                    if response.status_code not in self.RETRY_STATUSES or last_attempt:
+                        break
+                await asyncio.sleep(0.2 * 2 ** attempt)
+        except self._request_error as e:
+            self.breaker.record_failure()
+            raise PaymentGatewayError(f"Payment server request failed: {e}") from e
+        except BaseException:
+            # Cancelled (the browser went away) or a bug here: says nothing about the backend
+            self.breaker.abandon()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+_gateway = None
+_async_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def express_gateway():
+    """The shared client for the Express backend, created on first use in each process."""
+    global _gateway
+    gateway = _gateway
+    if gateway is not None and gateway.pid == os.getpid():
+        return gateway
+    with _gateway_lock:
+        # A client inherited through fork() shares its sockets with the parent
+        if _gateway is None or _gateway.pid != os.getpid():
+            _gateway = PaymentGateway()
+        return _gateway
+
+
+def async_express_gateway():
+    """
+    The shared async client for the Express backend, created on first use
+    in each process and event loop. Must be called from a coroutine.
+    """
+    global _async_gateway
+    gateway = _async_gateway
+    if gateway is not None and gateway.pid == os.getpid() and gateway.loop is asyncio.get_running_loop():
+        return gateway
+    breaker = express_gateway().breaker  # One breaker per process for both clients
+    with _gateway_lock:
+        if _async_gateway is None or _async_gateway.pid != os.getpid() or _async_gateway.loop is not asyncio.get_running_loop():
+            _async_gateway = AsyncPaymentGateway(breaker=breaker)
+        return _async_gateway
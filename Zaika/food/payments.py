@@ -0,0 +1,165 @@
+"""
+Idempotent recording of BillDesk payments.
+
+`payment_success_billdesk` used to trust the redirect and write the session
+cart as a new token every time it was hit, so a refresh, the back button or
+a retried redirect produced duplicate orders. Payments now go through a
+ledger:
+
+* `save_payment_intent()` keeps the customer and the cart (ids only) under
+  the order id when `create_order` hands the payment to Express, so a
+  payment can be recorded without the customer's session.
+* `record_payment()` records one (order_id, txn_id) exactly once. A repeat
+  is answered with the original token from one lookup on the ledger's
+  unique index. A first call claims the ledger row with INSERT ... ON
+  CONFLICT DO NOTHING and writes the order lines in the same transaction,
+  so a concurrent repeat waits on the claim and then reads its token.
+* The browser redirect and the server-to-server confirmation from Express
+  (`payment_confirm_billdesk`, signed with PAYMENT_WEBHOOK_SECRET) both
+  call `record_payment()`, so whichever arrives second is a no-op.
+
+A second successful txn_id for an order that is already paid does not
+write another order: it is kept in the ledger as 'duplicate', pointing at
+the original token, for a refund.
+"""
+import hashlib
+import hmac
+import json
+import os
+from datetime import datetime
+
+from django.db import connection, transaction
+
+from .cart import parse_cart
+from .order_history import notify_orders_written
+from .orders import write_order_lines
+from .pricing import price_cart
+from .tokens import allocate_dated_token
+
+PAYMENT_WEBHOOK_SECRET = os.getenv('PAYMENT_WEBHOOK_SECRET', '')
+SIGNATURE_HEADER = 'HTTP_X_ZAIKA_SIGNATURE'  # X-Zaika-Signature: sha256=<hex HMAC of the body>
+
+
+class UnknownPayment(Exception):
+    """Raised when there is nothing on record to turn a payment into an order."""
+
+
+def save_payment_intent(order_id, name, email, phone, cart):
+    """Remember who is paying for which cart under this order id (until it is paid)."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO "payment_intents" ("order_id", "email", "name", "contact_no", "cart")
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT ("order_id") DO UPDATE SET
+                "email" = EXCLUDED."email", "name" = EXCLUDED."name",
+                "contact_no" = EXCLUDED."contact_no", "cart" = EXCLUDED."cart",
+                "created_at" = CURRENT_TIMESTAMP
+            WHERE NOT EXISTS (
+                SELECT 1 FROM "payment_ledger" WHERE "order_id" = EXCLUDED."order_id"
+            );
+        """, [order_id, email, name, phone, json.dumps([list(line) for line in cart])])
+
+
+def verify_signature(body, header):
+    """True if `header` is the sha256 HMAC of `body` under PAYMENT_WEBHOOK_SECRET."""
+    if not PAYMENT_WEBHOOK_SECRET or not header:
+        return False
+    expected = hmac.new(PAYMENT_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(header.removeprefix('sha256='), expected)
+
+
+def recorded_token(order_id, txn_id):
+    """The token a payment was already recorded under, or None."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT "tokenid" FROM "payment_ledger" WHERE "order_id" = %s AND "txn_id" = %s;
+        """, [order_id, txn_id])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def record_payment(order_id, txn_id, *, source, fallback=None):
+    """
+    Turn a successful payment into Approved order lines under a new token,
+    once. Returns (token_id, created); `created` is False for a repeat.
+
+    The customer and cart come from the payment intent. `fallback`, an
+    (email, name, phone, cart) tuple from the session, is used for orders
+    started before intents were kept. Raises UnknownPayment if neither
+    exists.
+    """
+    token_id = recorded_token(order_id, txn_id)
+    if token_id is not None:
+        return token_id, False
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # Locking the intent serialises different txn_ids for the same order
+            cursor.execute("""
+                SELECT "email", "name", "contact_no", "cart" FROM "payment_intents"
+                WHERE "order_id" = %s FOR UPDATE;
+            """, [order_id])
+            intent = cursor.fetchone()
+
+            cursor.execute("""
+                INSERT INTO "payment_ledger" ("order_id", "txn_id", "source")
+                VALUES (%s, %s, %s)
+                ON CONFLICT ("order_id", "txn_id") DO NOTHING
+                RETURNING "ledger_id";
+            """, [order_id, txn_id, source])
+            claim = cursor.fetchone()
+            if claim is None:
+                # Claimed by a concurrent call; the INSERT waited for it to commit
+                cursor.execute("""
+                    SELECT "tokenid" FROM "payment_ledger" WHERE "order_id" = %s AND "txn_id" = %s;
+                """, [order_id, txn_id])
+                return cursor.fetchone()[0], False
+            ledger_id = claim[0]
+
+            cursor.execute("""
+                SELECT "txn_id", "tokenid" FROM "payment_ledger"
+                WHERE "order_id" = %s AND "status" = 'recorded' AND "ledger_id" <> %s
+                LIMIT 1;
+            """, [order_id, ledger_id])
+            paid = cursor.fetchone()
+            if paid is not None:
+                print(f"Order {order_id} paid twice: txn {txn_id} after txn {paid[0]}, token {paid[1]}; needs a refund")
+                cursor.execute("""
+                    UPDATE "payment_ledger" SET "status" = 'duplicate', "tokenid" = %s WHERE "ledger_id" = %s;
+                """, [paid[1], ledger_id])
+                return paid[1], False
+
+            if intent is not None:
+                email, name, phone, cart = intent[0], intent[1], intent[2], parse_cart(intent[3])
+            elif fallback is not None:
+                email, name, phone, cart = fallback
+            else:
+                raise UnknownPayment(f"No payment intent for order {order_id}")
+
+            # Insert user if not exists
+            cursor.execute("""
+                SELECT "user_id" FROM "users" WHERE "mobile" = %s OR "email" = %s;
+            """, [phone, email])
+            if cursor.fetchone() is None:
+                cursor.execute("""
+                    INSERT INTO "users" ("name", "email", "mobile") VALUES (%s, %s, %s);
+                """, [name, email, phone])
+
+            # Generate token ID (unique for today)
+            token_id, token_day = allocate_dated_token()
+
+            # Paid for, so keep items switched off since the user picked them
+            priced = price_cart(cart, include_unavailable=True)
+            write_order_lines(
+                cursor, priced.items,
+                email=email, name=name, contact_no=phone,
+                status='Approved', timestamp=datetime.now(), tokenid=token_id, token_day=token_day, mode_of_payment='Online',
+                menu_version=priced.menu_version,
+            )
+            cursor.execute("""
+                UPDATE "payment_ledger" SET "email" = %s, "tokenid" = %s WHERE "ledger_id" = %s;
+            """, [email, token_id, ledger_id])
+        notify_orders_written(email)
+
+    print(f"Orders created successfully. Token ID: {token_id}")
+    return token_id, True
@@ -0,0 +1,46 @@
+"""
+Server-side pricing for Zaika carts.
+
+Line and order totals are computed from the price table in the cached menu
+snapshot (`food.menu_cache`), never from prices posted by the browser. The
+table is rebuilt whenever the menu version is bumped, so pricing a cart
+costs no queries on the payment path.
+
+Every priced order is stamped with the snapshot's `price_version`, which is
+stored on the `orderlist` rows it produces.
+"""
+from decimal import Decimal
+from typing import NamedTuple
+
+from .cart import CartItem
+from .menu_cache import get_menu_snapshot
+
+
+class PricedOrder(NamedTuple):
+    items: list          # CartItem per priceable line, in cart order
+    total: Decimal
+    menu_version: str    # price_version of the snapshot used
+    missing: list        # CartLine that could not be priced
+
+
+def price_cart(lines, include_unavailable=False):
+    """
+    Price cart lines from the menu snapshot.
+
+    A line cannot be priced if its item no longer exists, belongs to a
+    different shop than the one posted, or (unless `include_unavailable`) is
+    switched off; such lines are returned in `missing`. The payment callbacks
+    pass `include_unavailable` because the user has already paid for items
+    that were switched off after they were picked.
+    """
+    menu = get_menu_snapshot()
+    items = []
+    missing = []
+    for line in lines:
+        entry = menu.price_table.get(line.item_id)
+        if entry is None or entry.shop_id != line.shop_id or not (entry.available or include_unavailable):
+            missing.append(line)
+            continue
+        items.append(CartItem(line.item_id, line.shop_id, line.qty, entry.item_name, entry.price, entry.price * line.qty))
+    total = sum((item.total_price for item in items), Decimal('0'))
+    return PricedOrder(items, total, menu.price_version, missing)
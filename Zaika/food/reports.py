@@ -0,0 +1,355 @@
+"""
+Background admin reports with cached artifacts.
+
+Heavy reports (the full order export, per-shop sales) no longer run inside
+a request. An admin enqueues one with `enqueue_report()`, which adds a row
+to `report_jobs`; `manage.py run_report_worker` (started by run_waitress.py)
+claims queued rows with FOR UPDATE SKIP LOCKED, writes the artifact to
+REPORTS_DIR and records progress on the row so the admin page can poll it.
+Every few minutes the worker also does housekeeping: it removes expired
+artifacts and old bookings deletion tombstones.
+
+Each job carries a cache key: a hash of the report kind, its normalised
+parameters and a watermark of the orderlist data (see `data_watermark()`),
+which moves with every committed insert, update or delete. Enqueueing a
+report whose key already has a finished artifact, or a job in flight,
+returns that job instead of running it again, so repeated requests are
+free until orders change.
+"""
+import csv
+import hashlib
+import json
+import os
+import socket
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from openpyxl import Workbook
+
+from .exports import EXPORT_COLUMNS, EXPORT_CHUNK_SIZE, order_filters, export_rows, csv_export
+from .orders import prune_deletions
+
+REPORTS_DIR = Path(os.getenv('REPORTS_DIR', settings.BASE_DIR / 'reports'))
+REPORT_RETENTION_HOURS = int(os.getenv('REPORT_RETENTION_HOURS', '24'))
+STALE_AFTER_SECONDS = 300  # A running job without a heartbeat for this long is re-queued
+HOUSEKEEPING_INTERVAL = 300  # Seconds between housekeeping runs of one worker
+MAX_ATTEMPTS = 3
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+_JOB_COLUMNS = '"job_id", "kind", "params", "status", "progress", "artifact", "error", "created_at", "finished_at"'
+
+
+class ReportError(Exception):
+    """Raised for report requests that cannot be run (unknown kind, bad parameters)."""
+
+
+# ---------------------------------------------------------------- report kinds
+
+def _orders_export(cursor, params, path, progress):
+    clauses, args, _ = order_filters(params)
+    cursor.execute(
+        'SELECT COUNT(*) FROM "orderlist"' + (' WHERE ' + ' AND '.join(clauses) if clauses else '') + ';',
+        args,
+    )
+    total = cursor.fetchone()[0] or 1
+
+    if params.get('format') == 'csv':
+        with open(path, 'w', newline='', encoding='utf-8') as output:
+            for written, line in enumerate(csv_export(clauses, args)):
+                output.write(line)
+                if written and written % EXPORT_CHUNK_SIZE == 0:
+                    progress(written * 100 // total)
+        return
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Orders")
+    sheet.append(EXPORT_COLUMNS)
+    for written, row in enumerate(export_rows(clauses, args), 1):
+        sheet.append(row)
+        if written % EXPORT_CHUNK_SIZE == 0:
+            progress(written * 100 // total)
+    workbook.save(path)
+
+
+def _shop_sales(cursor, params, path, progress):
+    clauses, args, filters = order_filters(params)
+    if 'status' not in filters:
+        clauses.append('"status" <> \'Pending\'')  # Unpaid cash orders are not sales yet
+    cursor.execute(f"""
+        SELECT s."shop_id", s."shop_name",
+               COUNT(o."order_id"),
+               COALESCE(SUM(o."qty"), 0),
+               COALESCE(SUM(o."total_amt"), 0),
+               COALESCE(SUM(o."total_amt") FILTER (WHERE o."mode_of_payment" = 'cash'), 0),
+               COALESCE(SUM(o."total_amt") FILTER (WHERE o."mode_of_payment" = 'Online'), 0)
+        FROM "shops" s
+        LEFT JOIN (
+            SELECT "order_id", "shop_id", "qty", "total_amt", "mode_of_payment"
+            FROM "orderlist"
+            {"WHERE " + " AND ".join(clauses) if clauses else ""}
+        ) o ON o."shop_id" = s."shop_id"
+        GROUP BY s."shop_id", s."shop_name"
+        ORDER BY s."shop_id";
+    """, args)
+    rows = cursor.fetchall()
+    progress(90)
+
+    with open(path, 'w', newline='', encoding='utf-8') as output:
+        writer = csv.writer(output)
+        writer.writerow(("shop_id", "shop_name", "order_lines", "items_sold", "revenue", "cash_revenue", "online_revenue"))
+        writer.writerows(rows)
+
+
+# kind -> (runner, accepted parameters)
+REPORT_KINDS = {
+    'orders_export': (_orders_export, ('shop', 'status', 'mode', 'from', 'to', 'format')),
+    'shop_sales': (_shop_sales, ('shop', 'mode', 'from', 'to')),
+}
+
+
+def _extension(kind, params):
+    if kind == 'orders_export' and params.get('format') != 'csv':
+        return 'xlsx'
+    return 'csv'
+
+
+def normalize_params(kind, raw):
+    """Validated report parameters as a dict of strings, so equal requests hash equally."""
+    if kind not in REPORT_KINDS:
+        raise ReportError(f"Unknown report: {kind!r}")
+    raw = {key: str(value) for key, value in (raw or {}).items() if value not in (None, '')}
+    _, _, params = order_filters(raw)  # Drops anything that is not a valid filter
+    allowed = REPORT_KINDS[kind][1]
+    params = {key: value for key, value in params.items() if key in allowed}
+    if 'format' in allowed:
+        params['format'] = 'csv' if raw.get('format') == 'csv' else 'xlsx'
+    return params
+
+
+# ---------------------------------------------------------------- admin side
+
+def data_watermark(cursor):
+    """
+    Changes whenever a write to orderlist commits.
+
+    Built from the latest transaction id that wrote a line (change_xid) or
+    deleted one (the orderlist_deletions tombstones). Transaction ids are
+    handed out at the first write, not at commit, so an older transaction
+    still in flight may commit later without raising that maximum. While
+    any is, the oldest running transaction id (the snapshot's xmin) is part
+    of the watermark too, and it moves when they finish.
+    """
+    cursor.execute("""
+        SELECT GREATEST(
+                   (SELECT MAX("change_xid") FROM "orderlist"),
+                   (SELECT MAX("change_xid") FROM "orderlist_deletions")
+               )::text,
+               pg_snapshot_xmin(pg_current_snapshot())::text;
+    """)
+    latest, xmin = cursor.fetchone()
+    latest = int(latest or 0)
+    if int(xmin) > latest:
+        return str(latest)
+    return f"{latest}:{xmin}"
+
+
+def enqueue_report(kind, raw_params):
+    """
+    Queue a report, or return the existing job for the same report over the
+    same data (finished with its artifact still on disk, or still in flight).
+    """
+    params = normalize_params(kind, raw_params)
+    params_json = json.dumps(params, sort_keys=True)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        watermark = data_watermark(cursor)
+        cache_key = hashlib.sha1(f"{kind}|{params_json}|{watermark}".encode()).hexdigest()
+        # Serialise concurrent requests for the same report
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", [cache_key])
+
+        cursor.execute(f"""
+            SELECT {_JOB_COLUMNS}
+            FROM "report_jobs"
+            WHERE "cache_key" = %s AND "status" <> 'failed'
+            ORDER BY "job_id" DESC
+            LIMIT 1;
+        """, [cache_key])
+        row = cursor.fetchone()
+        if row:
+            job = _job_dict(row)
+            if job['status'] != DONE or artifact_path(job):
+                return job
+
+        cursor.execute(f"""
+            INSERT INTO "report_jobs" ("kind", "params", "cache_key")
+            VALUES (%s, %s, %s)
+            RETURNING {_JOB_COLUMNS};
+        """, [kind, params_json, cache_key])
+        return _job_dict(cursor.fetchone())
+
+
+def get_job(job_id):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {_JOB_COLUMNS} FROM "report_jobs" WHERE "job_id" = %s;', [job_id])
+        row = cursor.fetchone()
+    return _job_dict(row) if row else None
+
+
+def artifact_path(job):
+    """Path of a finished job's artifact, or None if it is not (or no longer) on disk."""
+    if job['status'] != DONE or not job['artifact']:
+        return None
+    path = REPORTS_DIR / job['artifact']
+    return path if path.is_file() else None
+
+
+def _job_dict(row):
+    job_id, kind, params, status, progress, artifact, error, created_at, finished_at = row
+    return {
+        'job_id': job_id,
+        'kind': kind,
+        'params': json.loads(params),
+        'status': status,
+        'progress': progress,
+        'artifact': artifact,
+        'error': error,
+        'created_at': created_at.isoformat() if created_at else None,
+        'finished_at': finished_at.isoformat() if finished_at else None,
+    }
+
+
+# ---------------------------------------------------------------- worker side
+
+class ReportWorker:
+    """
+    Claims and runs jobs one at a time. Job bookkeeping (claim, progress,
+    result) goes through a private autocommit connection so admins can see
+    progress while the report itself reads on the default connection.
+    """
+
+    def __init__(self, name=None):
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self._db = None
+        self._housekept_at = None
+
+    def run_next(self):
+        """Run one job if any is waiting. Returns the job id, or None if the queue was empty."""
+        self.housekeeping()
+        job = self._claim()
+        if job is None:
+            return None
+        job_id, kind, params_json, cache_key = job
+        print(f"Report job {job_id} ({kind}) started by {self.name}")
+        try:
+            self._run(job_id, kind, json.loads(params_json), cache_key)
+        except Exception as e:
+            self._finish(job_id, FAILED, error=str(e))
+            print(f"Report job {job_id} failed: {e}")
+        else:
+            print(f"Report job {job_id} done")
+        return job_id
+
+    def _run(self, job_id, kind, params, cache_key):
+        runner = REPORT_KINDS[kind][0]
+        REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+        artifact = f"{kind}-{cache_key[:16]}.{_extension(kind, params)}"
+
+        last_update = [0.0]
+
+        def progress(percent):
+            now = time.monotonic()
+            if now - last_update[0] >= 1:  # At most one UPDATE per second
+                last_update[0] = now
+                self._execute("""
+                    UPDATE "report_jobs" SET "progress" = %s, "heartbeat_at" = CURRENT_TIMESTAMP
+                    WHERE "job_id" = %s;
+                """, [min(int(percent), 99), job_id])
+
+        # Write next to the final file and rename, so a half-written artifact is never served
+        fd, temp_path = tempfile.mkstemp(dir=REPORTS_DIR, suffix='.part')
+        os.close(fd)
+        try:
+            # One transaction: a consistent snapshot, and the export's
+            # server-side cursor does not have to be materialised WITH HOLD
+            with transaction.atomic(), connection.cursor() as cursor:
+                runner(cursor, params, temp_path, progress)
+            os.replace(temp_path, REPORTS_DIR / artifact)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self._finish(job_id, DONE, artifact=artifact)
+
+    def _claim(self):
+        # Give up on jobs that keep losing their worker
+        self._execute("""
+            UPDATE "report_jobs"
+            SET "status" = 'failed', "error" = 'Worker stopped responding', "finished_at" = CURRENT_TIMESTAMP
+            WHERE "status" = 'running' AND "attempts" >= %s
+              AND "heartbeat_at" < CURRENT_TIMESTAMP - make_interval(secs => %s);
+        """, [MAX_ATTEMPTS, STALE_AFTER_SECONDS])
+        return self._execute("""
+            UPDATE "report_jobs"
+            SET "status" = 'running', "worker" = %s, "attempts" = "attempts" + 1,
+                "progress" = 0, "heartbeat_at" = CURRENT_TIMESTAMP
+            WHERE "job_id" = (
+                SELECT "job_id" FROM "report_jobs"
+                WHERE "status" = 'queued'
+                   OR ("status" = 'running' AND "heartbeat_at" < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                ORDER BY "job_id"
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING "job_id", "kind", "params", "cache_key";
+        """, [self.name, STALE_AFTER_SECONDS], fetch=True)
+
+    def _finish(self, job_id, status, artifact=None, error=None):
+        self._execute("""
+            UPDATE "report_jobs"
+            SET "status" = %s, "progress" = CASE WHEN %s = 'done' THEN 100 ELSE "progress" END,
+                "artifact" = %s, "error" = %s, "finished_at" = CURRENT_TIMESTAMP
+            WHERE "job_id" = %s;
+        """, [status, status, artifact, error, job_id])
+
+    def _execute(self, sql, params, fetch=False):
+        with self._cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone() if fetch else None
+
+    def _cursor(self):
+        if self._db is None:
+            self._db = connections['default'].copy()
+        self._db.close_if_unusable_or_obsolete()
+        return self._db.cursor()
+
+    def housekeeping(self):
+        """Remove expired artifacts and deletion tombstones, at most once per HOUSEKEEPING_INTERVAL."""
+        now = time.monotonic()
+        if self._housekept_at is not None and now - self._housekept_at < HOUSEKEEPING_INTERVAL:
+            return
+        self._housekept_at = now
+        self.remove_expired_artifacts()
+        with self._cursor() as cursor:
+            pruned = prune_deletions(cursor)
+        if pruned:
+            print(f"Pruned {pruned} bookings deletion tombstone(s)")
+
+    def remove_expired_artifacts(self):
+        """Delete artifacts older than REPORT_RETENTION_HOURS; their jobs then count as cache misses."""
+        if not REPORTS_DIR.is_dir():
+            return
+        cutoff = time.time() - REPORT_RETENTION_HOURS * 3600
+        for path in REPORTS_DIR.iterdir():
+            try:
+                if path.is_file() and path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
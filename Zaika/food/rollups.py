@@ -0,0 +1,107 @@
+"""
+Sales rollups for the admin dashboard.
+
+`sales_by_shop`, `sales_by_item` (per day) and `sales_by_hour` are kept
+current by triggers on orderlist (installed by migration 0009, fixed by
+0012), inside the same transaction as each order write, so
+reading "how is each stall doing" touches a few hundred pre-aggregated
+rows instead of every order line.
+A line counts as a sale once it is no longer Pending.
+
+`rebuild_rollups()` recomputes everything from orderlist, for repairs after
+manual data fixes (`manage.py rebuild_sales_rollups`).
+"""
+from datetime import timedelta
+
+from django.db import connection, transaction
+
+# An order line that counts as a sale
+SALE_LINE = '''COALESCE("status", 'Pending') <> 'Pending' AND "timestamp" IS NOT NULL AND "shop_id" IS NOT NULL'''
+
+TOP_ITEMS = 20
+
+# Recompute every rollup from orderlist; run with orderlist locked against writes
+BACKFILL_SQL = [
+    'TRUNCATE "sales_by_shop", "sales_by_item", "sales_by_hour";',
+    f"""
+    INSERT INTO "sales_by_shop" ("shop_id", "sale_day", "order_lines", "items_sold", "revenue", "cash_revenue", "online_revenue")
+    SELECT "shop_id", "timestamp"::date, COUNT(*), SUM("qty"), SUM("total_amt"),
+           COALESCE(SUM("total_amt") FILTER (WHERE "mode_of_payment" = 'cash'), 0),
+           COALESCE(SUM("total_amt") FILTER (WHERE "mode_of_payment" = 'Online'), 0)
+    FROM "orderlist"
+    WHERE {SALE_LINE}
+    GROUP BY 1, 2;
+    """,
+    f"""
+    INSERT INTO "sales_by_item" ("shop_id", "item_name", "sale_day", "order_lines", "items_sold", "revenue")
+    SELECT "shop_id", "item_name", "timestamp"::date, COUNT(*), SUM("qty"), SUM("total_amt")
+    FROM "orderlist"
+    WHERE {SALE_LINE}
+    GROUP BY 1, 2, 3;
+    """,
+    f"""
+    INSERT INTO "sales_by_hour" ("shop_id", "sale_hour", "order_lines", "items_sold", "revenue")
+    SELECT "shop_id", date_trunc('hour', "timestamp"), COUNT(*), SUM("qty"), SUM("total_amt")
+    FROM "orderlist"
+    WHERE {SALE_LINE}
+    GROUP BY 1, 2;
+    """,
+]
+
+
+def rebuild_rollups():
+    """Recompute every rollup table from orderlist. Blocks order writes while it runs."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('LOCK TABLE "orderlist" IN SHARE MODE;')
+        for sql in BACKFILL_SQL:
+            cursor.execute(sql)
+
+
+def sales_dashboard(first_day, last_day, shop_id=None):
+    """
+    Sales between two days (inclusive), optionally for one shop: totals per
+    shop, the TOP_ITEMS best sellers and an hourly series. Reads only the
+    rollup tables.
+    """
+    shop_clause = ' AND r."shop_id" = %s' if shop_id is not None else ''
+    shop_args = [shop_id] if shop_id is not None else []
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT r."shop_id", s."shop_name", SUM(r."order_lines"), SUM(r."items_sold"),
+                   SUM(r."revenue"), SUM(r."cash_revenue"), SUM(r."online_revenue")
+            FROM "sales_by_shop" r
+            LEFT JOIN "shops" s ON s."shop_id" = r."shop_id"
+            WHERE r."sale_day" BETWEEN %s AND %s{shop_clause}
+            GROUP BY r."shop_id", s."shop_name"
+            ORDER BY SUM(r."revenue") DESC;
+        """, [first_day, last_day] + shop_args)
+        shops = [{
+            'shop_id': shop, 'shop_name': name, 'order_lines': lines, 'items_sold': items,
+            'revenue': revenue, 'cash_revenue': cash, 'online_revenue': online,
+        } for shop, name, lines, items, revenue, cash, online in cursor.fetchall()]
+
+        cursor.execute(f"""
+            SELECT r."shop_id", r."item_name", SUM(r."items_sold"), SUM(r."revenue")
+            FROM "sales_by_item" r
+            WHERE r."sale_day" BETWEEN %s AND %s{shop_clause}
+            GROUP BY r."shop_id", r."item_name"
+            ORDER BY SUM(r."items_sold") DESC, SUM(r."revenue") DESC
+            LIMIT %s;
+        """, [first_day, last_day] + shop_args + [TOP_ITEMS])
+        top_items = [{
+            'shop_id': shop, 'item_name': name, 'items_sold': items, 'revenue': revenue,
+        } for shop, name, items, revenue in cursor.fetchall()]
+
+        cursor.execute(f"""
+            SELECT r."sale_hour", SUM(r."order_lines"), SUM(r."items_sold"), SUM(r."revenue")
+            FROM "sales_by_hour" r
+            WHERE r."sale_hour" >= %s AND r."sale_hour" < %s{shop_clause}
+            GROUP BY r."sale_hour"
+            ORDER BY r."sale_hour";
+        """, [first_day, last_day + timedelta(days=1)] + shop_args)
+        hourly = [{
+            'hour': hour.isoformat(), 'order_lines': lines, 'items_sold': items, 'revenue': revenue,
+        } for hour, lines, items, revenue in cursor.fetchall()]
+
+    return {'shops': shops, 'top_items': top_items, 'hourly': hourly}
@@ -0,0 +1,188 @@
+"""
+Low-write session store for Zaika (SESSION_ENGINE = 'food.sessions').
+
+With SESSION_SAVE_EVERY_REQUEST the stock database store UPDATEs
+`django_session` on every request, status polls included, only to push the
+expiry forward. This store keeps the same table and encoding, so it can be
+switched on and off without logging anyone out, but:
+
+* `save()` only writes when the session data changed, or when the new
+  expiry is more than SESSION_REFRESH_SECONDS past the stored one. A
+  session can therefore end up to that long before its cookie does.
+* Reads are served from a process-local cache of the stored rows (at most
+  SESSION_CACHE_SIZE, least recently used first out). Every write and
+  delete publishes SESSION_CHANGED on the event bus, so the other worker
+  processes drop their copy; BUS_RECONNECTED drops them all.
+
+Expired rows are removed in small batches by `manage.py sweep_sessions`
+(or Django's `clearsessions`, which calls `clear_expired()`).
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.db import connection
+from django.utils import timezone
+
+from . import event_bus
+
+SESSION_REFRESH_SECONDS = getattr(settings, 'SESSION_REFRESH_SECONDS', 3600)
+SESSION_CACHE_SIZE = getattr(settings, 'SESSION_CACHE_SIZE', 10000)
+SWEEP_BATCH_SIZE = 1000
+
+_rows = OrderedDict()  # digest of session key -> (session_data, expire_date)
+_generation = 0        # bumped by every invalidation
+_lock = threading.Lock()
+
+
+def _digest(session_key):
+    # Session keys are credentials; keep them out of NOTIFY payloads
+    return hashlib.sha1(session_key.encode()).hexdigest()
+
+
+def _forget(payload):
+    global _generation
+    with _lock:
+        _generation += 1
+        for digest in payload.get('sessions', ()):
+            _rows.pop(digest, None)
+
+
+def _forget_everyone(payload):
+    # Writes may have been missed while the bus was down
+    global _generation
+    with _lock:
+        _generation += 1
+        _rows.clear()
+
+
+event_bus.subscribe(event_bus.SESSION_CHANGED, _forget)
+event_bus.subscribe(event_bus.BUS_RECONNECTED, _forget_everyone)
+
+
+def _remember(digest, row, generation=None):
+    with _lock:
+        # A row read while an invalidation landed may already be stale
+        if generation is not None and generation != _generation:
+            return
+        _rows[digest] = row
+        _rows.move_to_end(digest)
+        while len(_rows) > SESSION_CACHE_SIZE:
+            _rows.popitem(last=False)
+
+
+class SessionStore(DBStore):
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._stored = None   # (session_data, expire_date) as last read or written
+        self._written = None  # row built by the save in progress
+
+    def _get_session_from_db(self):
+        if self.session_key is None:
+            return super()._get_session_from_db()
+        digest, generation, s = self._get_cached_session()
+        if s is None:
+            s = super()._get_session_from_db()
+            self._loaded(digest, generation, s)
+        return s
+
+    async def _aget_session_from_db(self):
+        # Used by the async views (request.session.aget() and friends)
+        if self.session_key is None:
+            return await super()._aget_session_from_db()
+        digest, generation, s = self._get_cached_session()
+        if s is None:
+            s = await super()._aget_session_from_db()
+            self._loaded(digest, generation, s)
+        return s
+
+    def _get_cached_session(self):
+        digest = _digest(self.session_key)
+        with _lock:
+            generation = _generation
+            row = _rows.get(digest)
+            if row is not None:
+                _rows.move_to_end(digest)
+        if row is not None and row[1] > timezone.now():
+            self._stored = row
+            return digest, generation, self.model(session_key=self.session_key, session_data=row[0], expire_date=row[1])
+        return digest, generation, None
+
+    def _loaded(self, digest, generation, s):
+        if s is not None:
+            self._stored = (s.session_data, s.expire_date)
+            _remember(digest, self._stored, generation)
+
+    def create_model_instance(self, data):
+        obj = super().create_model_instance(data)
+        self._written = (obj.session_data, obj.expire_date)
+        return obj
+
+    def save(self, must_create=False):
+        if self.session_key is not None and not must_create:
+            data = self._get_session()  # Loads the stored row if nothing has yet
+            if self._stored is not None:
+                stored_data, stored_expiry = self._stored
+                # The encoding is signed with a timestamp, so compare the decoded data
+                refresh = timedelta(seconds=SESSION_REFRESH_SECONDS)
+                if self.get_expiry_date() - stored_expiry < refresh and self.decode(stored_data) == data:
+                    return
+
+        self._written = None
+        super().save(must_create=must_create)
+        if self._written is None:
+            return  # create() saved it through a nested save()
+        self._stored, self._written = self._written, None
+        event_bus.publish(event_bus.SESSION_CHANGED, {'sessions': [_digest(self.session_key)]})
+        _remember(_digest(self.session_key), self._stored)
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        super().delete(session_key)
+        if session_key == self.session_key:
+            self._stored = None
+        event_bus.publish(event_bus.SESSION_CHANGED, {'sessions': [_digest(session_key)]})
+
+    @classmethod
+    def clear_expired(cls):
+        sweep_expired_sessions()
+
+
+def sweep_expired_sessions(batch_size=SWEEP_BATCH_SIZE, pause=0.0, max_batches=None):
+    """
+    Delete expired sessions `batch_size` rows at a time, oldest first, each
+    batch in its own short statement so logins and saves are never held up
+    behind one huge DELETE. Rows being written right now are skipped.
+    Returns the number of rows deleted.
+    """
+    table = DBStore.get_model_class()._meta.db_table
+    deleted = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                DELETE FROM "{table}"
+                WHERE "session_key" IN (
+                    SELECT "session_key" FROM "{table}"
+                    WHERE "expire_date" < %s
+                    ORDER BY "expire_date"
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                );
+            """, [timezone.now(), batch_size])
+            count = cursor.rowcount
+        deleted += count
+        batches += 1
+        if count < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return deleted
@@ -0,0 +1,31 @@
+"""
+Let Postgres shape query results into JSON.
+
+Views that turn flat JOIN rows into nested dicts in Python (one dict per
+shop with its items, one per token with its lines) can instead write a
+query that returns one `jsonb_build_object(...)` document per row, using
+`json_agg` for the nested lists, and pass it to one of these helpers:
+
+    fetch_json_text(cursor, sql, params)  # '[{...}, ...]' ready for an HttpResponse
+    fetch_json(cursor, sql, params)       # the same, parsed for a template
+
+The query must return a single column named "doc" and is wrapped as
+`SELECT json_agg("doc") FROM (<sql>)`, so documents keep the query's ORDER BY.
+"""
+import json
+from decimal import Decimal
+
+
+def _wrap(sql):
+    return f'SELECT COALESCE(json_agg("docs"."doc"), \'[]\'::json)::text FROM ({sql.rstrip().rstrip(";")}) AS "docs";'
+
+
+def fetch_json_text(cursor, sql, params=()):
+    """The documents as a JSON array string; Python never touches the rows."""
+    cursor.execute(_wrap(sql), list(params))
+    return cursor.fetchone()[0]
+
+
+def fetch_json(cursor, sql, params=()):
+    """The documents as Python objects. Numbers stay exact (Decimal) so prices render as stored."""
+    return json.loads(fetch_json_text(cursor, sql, params), parse_float=Decimal)
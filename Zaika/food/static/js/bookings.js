@@ -0,0 +1,238 @@
+// Stall bookings board: keeps the two tables current by applying only the
+// orders that changed since the last poll, instead of reloading the page.
+// Deleted orders come back as tombstone ids; a board that has not synced for
+// longer than half the server's tombstone retention reloads instead.
+// Status clicks are queued and sent as batches to the transitions API; the
+// queue survives a reload, so a tablet that drops offline sends it later.
+
+document.addEventListener("DOMContentLoaded", () => {
+  const board = document.getElementById("bookings");
+  if (!board) return;
+
+  const POLL_INTERVAL = 5000;
+  const STALE_AFTER = (Number(board.dataset.deletionsRetentionHours) || 24) * 1800 * 1000;
+  const QUEUE_KEY = "zaika_stall_transitions";
+  const changesUrl = board.dataset.changesUrl;
+  const transitionsUrl = board.dataset.transitionsUrl;
+  const csrfToken = board.dataset.csrfToken;
+  let cursor = board.dataset.cursor;
+  let sending = false;
+  let pollsStarted = 0;
+  let latestApplied = 0;
+  let lastSynced = Date.now();
+
+  const tables = {
+    Approved: {
+      body: document.getElementById("approved-orders"),
+      actionUrl: board.dataset.completeUrl,
+      actionLabel: "Mark as Completed",
+      nextStatus: "completed",
+    },
+    Completed: {
+      body: document.getElementById("completed-orders"),
+      actionUrl: board.dataset.deliverUrl,
+      actionLabel: "Mark as Delivered",
+      nextStatus: "delivered",
+    },
+  };
+
+  function cell(text) {
+    const td = document.createElement("td");
+    td.textContent = text === null || text === undefined ? "" : text;
+    return td;
+  }
+
+  function buildRow(order) {
+    const table = tables[order.status];
+    const row = document.createElement("tr");
+    row.dataset.orderId = order.order_id;
+    row.dataset.tokenid = order.tokenid === null ? "" : order.tokenid;
+    row.dataset.tokenDay = order.token_day || "";
+    row.dataset.timestamp = order.timestamp || "";
+
+    row.appendChild(cell(order.tokenid));
+    row.appendChild(cell(order.item_name));
+    row.appendChild(cell(order.qty));
+    row.appendChild(cell(order.name));
+    row.appendChild(cell(order.display_time));
+
+    const actions = document.createElement("td");
+    const link = document.createElement("a");
+    link.className = "status-link";
+    // The URL was rendered for order 0; swap in this order's id
+    link.href = table.actionUrl.replace("/0/", `/${order.order_id}/`);
+    link.textContent = table.actionLabel;
+    link.dataset.status = table.nextStatus;
+    actions.appendChild(link);
+    if (order.tokenid !== null) {
+      const tokenLink = document.createElement("a");
+      tokenLink.className = "status-link";
+      tokenLink.href = "#";
+      tokenLink.textContent = "Whole Token";
+      tokenLink.dataset.status = table.nextStatus;
+      tokenLink.dataset.wholeToken = "1";
+      actions.appendChild(document.createTextNode(" "));
+      actions.appendChild(tokenLink);
+    }
+    row.appendChild(actions);
+    return row;
+  }
+
+  function refreshPlaceholder(body) {
+    const hasOrders = body.querySelector("tr[data-order-id]") !== null;
+    const placeholder = body.querySelector("tr.empty-row");
+    if (hasOrders && placeholder) {
+      placeholder.remove();
+    } else if (!hasOrders && !placeholder) {
+      const row = document.createElement("tr");
+      row.className = "empty-row";
+      const td = cell(body.dataset.empty);
+      td.colSpan = 6;
+      row.appendChild(td);
+      body.appendChild(row);
+    }
+  }
+
+  function insertSorted(body, row) {
+    // Both tables are ordered oldest first
+    const later = Array.from(body.querySelectorAll("tr[data-order-id]")).find(
+      (existing) => existing.dataset.timestamp > row.dataset.timestamp
+    );
+    body.insertBefore(row, later || null);
+  }
+
+  function removeOrder(orderId) {
+    const existing = board.querySelector(`tr[data-order-id="${orderId}"]`);
+    if (existing) {
+      const body = existing.parentNode;
+      existing.remove();
+      refreshPlaceholder(body);
+    }
+  }
+
+  function applyChange(order) {
+    removeOrder(order.order_id);
+    if (order.on_board && tables[order.status]) {
+      const body = tables[order.status].body;
+      insertSorted(body, buildRow(order));
+      refreshPlaceholder(body);
+    }
+  }
+
+  function loadQueue() {
+    try {
+      return JSON.parse(localStorage.getItem(QUEUE_KEY)) || [];
+    } catch (error) {
+      return [];
+    }
+  }
+
+  function saveQueue(queue) {
+    localStorage.setItem(QUEUE_KEY, JSON.stringify(queue));
+  }
+
+  function sendQueue() {
+    const queue = loadQueue();
+    if (sending || queue.length === 0) return;
+    sending = true;
+    fetch(transitionsUrl, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "X-CSRFToken": csrfToken,
+      },
+      body: JSON.stringify({ transitions: queue }),
+    })
+      .then((response) => {
+        if (response.status >= 500) {
+          throw new Error(`HTTP error! Status: ${response.status}`);
+        }
+        return response.json();
+      })
+      .then((data) => {
+        // Applied or rejected, these are done; keep anything queued meanwhile
+        const sent = new Set(queue.map((transition) => transition.id));
+        saveQueue(loadQueue().filter((transition) => !sent.has(transition.id)));
+        if (data.status !== "success") {
+          console.log("Transitions rejected:", data.message);
+          return;
+        }
+        data.results.forEach((result) =>
+          result.lines
+            .filter((line) => line.result === "conflict" || line.result === "not_found")
+            .forEach((line) => console.log(`Order ${line.order_id} not moved:`, line.result, line.status))
+        );
+        poll(false);
+      })
+      .catch((error) => console.log("Transitions will be retried:", error))
+      .finally(() => {
+        sending = false;
+      });
+  }
+
+  function queueTransition(link) {
+    const row = link.closest("tr");
+    const transition = {
+      id: `${Date.now()}-${Math.random().toString(36).slice(2, 10)}`,
+      status: link.dataset.status,
+    };
+    if (link.dataset.wholeToken) {
+      transition.tokenid = Number(row.dataset.tokenid);
+      transition.token_day = row.dataset.tokenDay || null; // Token numbers restart every day
+    } else {
+      transition.order_ids = [Number(row.dataset.orderId)];
+    }
+    const queue = loadQueue();
+    queue.push(transition);
+    saveQueue(queue);
+    row.style.opacity = "0.5"; // Until the next delta moves it
+    sendQueue();
+  }
+
+  board.addEventListener("click", (event) => {
+    const link = event.target.closest("a.status-link[data-status]");
+    if (!link) return;
+    event.preventDefault();
+    queueTransition(link);
+  });
+
+  function poll(reschedule = true) {
+    const pollNumber = ++pollsStarted;
+    fetch(`${changesUrl}?since=${encodeURIComponent(cursor)}`, {
+      headers: { Accept: "application/json" },
+    })
+      .then((response) => {
+        if (response.status === 401) {
+          window.location.reload(); // Session expired; the page redirects to login
+          return null;
+        }
+        if (!response.ok) {
+          throw new Error(`HTTP error! Status: ${response.status}`);
+        }
+        return response.json();
+      })
+      .then((data) => {
+        // An older poll finishing late must not undo a newer one
+        if (!data || data.status !== "success" || pollNumber < latestApplied) return;
+        latestApplied = pollNumber;
+        if (Date.now() - lastSynced > STALE_AFTER) {
+          window.location.reload(); // Back online after long enough that deletions may have been pruned
+          return;
+        }
+        data.orders.forEach(applyChange);
+        (data.deleted || []).forEach(removeOrder);
+        cursor = data.cursor;
+        lastSynced = Date.now();
+      })
+      .catch((error) => console.log("Bookings poll failed:", error))
+      .finally(() => {
+        if (reschedule) {
+          sendQueue(); // Retry anything queued while offline
+          setTimeout(poll, POLL_INTERVAL);
+        }
+      });
+  }
+
+  sendQueue();
+  setTimeout(poll, POLL_INTERVAL);
+});
@@ -20,6 +20,48 @@ if (!email || email.trim() === "") {
   debugLog("Email and CSRF token found:", { email, csrfToken });
 
   let pollingInterval = null;
+  let stream = null;
+  let stamp = null; // Sent back so an unchanged pending order is answered without a query
+
+  function handleStatus(data) {
+    debugLog("Server Response:", data);
+    stamp = data.stamp || null;
+
+    const statusElement = document.getElementById("status");
+    if (!statusElement) {
+      debugLog("Status element not found in DOM");
+      alert("Status element is missing on the page.");
+      return;
+    }
+
+    const status = data.status || "unknown"; // Default to "unknown" if undefined
+
+    // Ensure `status` is a valid string before using `charAt`
+    if (typeof status === "string" && status.length > 0) {
+      statusElement.textContent = `Status: ${
+        status.charAt(0).toUpperCase() + status.slice(1)
+      }`;
+    } else {
+      statusElement.textContent = "Status: Unknown";
+      debugLog("Invalid status received:", status);
+    }
+
+    if (status === "success") {
+      debugLog("Order approved! Redirecting...");
+      clearInterval(pollingInterval);
+      if (stream) stream.close();
+      window.location.href = `/zaikaa/success/${data.token_id}/`;
+    } else if (status === "error") {
+      debugLog("Error:", data.message);
+      alert(data.message || "An error occurred. Please try again.");
+    } else if (status === "pending") {
+      debugLog("Order is still pending...");
+    } else if (status === "failed" && stream) {
+      stream.close(); // Nothing left to wait for
+    } else {
+      debugLog("Unexpected status:", status);
+    }
+  }
 
   function checkStatus() {
     debugLog("Checking order status...");
@@ -30,7 +72,7 @@ if (!email || email.trim() === "") {
         "Content-Type": "application/json",
         "X-CSRFToken": csrfToken,
       },
-      body: JSON.stringify({ email: email }),
+      body: JSON.stringify({ email: email, stamp: stamp }),
     })
       .then((response) => {
         if (!response.ok) {
@@ -38,48 +80,35 @@ if (!email || email.trim() === "") {
         }
         return response.json();
       })
-      .then((data) => {
-        debugLog("Server Response:", data);
-
-        const statusElement = document.getElementById("status");
-        if (!statusElement) {
-          debugLog("Status element not found in DOM");
-          alert("Status element is missing on the page.");
-          return;
-        }
-
-        const status = data.status || "unknown"; // Default to "unknown" if undefined
-
-        // Ensure `status` is a valid string before using `charAt`
-        if (typeof status === "string" && status.length > 0) {
-          statusElement.textContent = `Status: ${
-            status.charAt(0).toUpperCase() + status.slice(1)
-          }`;
-        } else {
-          statusElement.textContent = "Status: Unknown";
-          debugLog("Invalid status received:", status);
-        }
-
-        if (status === "success") {
-          debugLog("Order approved! Redirecting...");
-          clearInterval(pollingInterval);
-          window.location.href = `/zaikaa/success/${data.token_id}/`;
-        } else if (status === "error") {
-          debugLog("Error:", data.message);
-          alert(data.message || "An error occurred. Please try again.");
-        } else if (status === "pending") {
-          debugLog("Order is still pending...");
-        } else {
-          debugLog("Unexpected status:", status);
-        }
-      })
+      .then(handleStatus)
       .catch((error) => {
         debugLog("Fetch error:", error);
         alert("Failed to fetch order status. Please check your internet connection.");
       });
   }
 
-  debugLog("Starting polling every 10 seconds...");
-  pollingInterval = setInterval(checkStatus, 10000);
-  checkStatus(); // Initial call
+  function startPolling() {
+    debugLog("Starting polling every 10 seconds...");
+    pollingInterval = setInterval(checkStatus, 10000);
+    checkStatus(); // Initial call
+  }
+
+  // The page sets data-order-stream only when the stream is served by the async view
+  if (window.EventSource && document.body.dataset.orderStream === "true") {
+    // The server pushes a status event whenever the order changes;
+    // EventSource reconnects by itself when the stream is closed.
+    debugLog("Listening for order status events...");
+    stream = new EventSource("/zaikaa/order_status/stream/");
+    stream.addEventListener("status", (event) => handleStatus(JSON.parse(event.data)));
+    stream.addEventListener("error", () => {
+      // Refused (e.g. 503: too many streams) rather than closed: EventSource gives up, so poll
+      if (stream.readyState === EventSource.CLOSED && pollingInterval === null) {
+        debugLog("Status stream refused, falling back to polling");
+        stream = null;
+        startPolling();
+      }
+    });
+  } else {
+    startPolling();
+  }
 }
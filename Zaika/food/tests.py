@@ -1,3 +1,194 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from importlib import import_module
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.db import connection
 from django.test import TestCase
+from django.urls import reverse
+
+from .cart import CartItem
+from .menu_cache import get_menu_snapshot
+from .order_events import notify_order_change
+from .orders import APPLIED, COPY_THRESHOLD, prune_deletions, transition_order_lines, write_order_lines
+from .rollups import rebuild_rollups
+
+# The rollup triggers come from migrations, not schema.sql
+ROLLUPS = import_module('food.migrations.0009_sales_rollups')
+ROLLUPS_FIX = import_module('food.migrations.0012_sales_rollups_payment_mode')
+
+
+class RawSchemaTestCase(TestCase):
+    """
+    The order tables are raw SQL, not Django models, so the test database
+    gets them from schema.sql (plus the rollup triggers the migrations add).
+    Needs PostgreSQL.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        with connection.cursor() as cursor:
+            cursor.execute((Path(settings.BASE_DIR) / 'schema.sql').read_text())
+            for sql in ROLLUPS.CREATE_SQL + [ROLLUPS_FIX.FUNCTION_SQL]:
+                cursor.execute(sql)
+            cursor.execute("""
+                INSERT INTO "shops" ("shop_name", "passkey") VALUES ('Chaat Corner', 'x') RETURNING "shop_id";
+            """)
+            cls.shop_id = cursor.fetchone()[0]
+
+    def add_line(self, cursor, **fields):
+        line = dict(email='a@example.com', name='A', contact_no='9999999999', shop_id=self.shop_id,
+                    item_name='Pani Puri', qty=2, total_amt=Decimal('60.00'), status='Pending',
+                    timestamp=datetime(2025, 2, 1, 12, 30), mode_of_payment=None)
+        line.update(fields)
+        columns = ', '.join(f'"{column}"' for column in line)
+        cursor.execute(f"""
+            INSERT INTO "orderlist" ({columns}) VALUES ({', '.join(['%s'] * len(line))}) RETURNING "order_id";
+        """, list(line.values()))
+        return cursor.fetchone()[0]
+
+
+class SalesRollupTests(RawSchemaTestCase):
+
+    def shop_rollup(self, cursor):
+        cursor.execute("""
+            SELECT "order_lines", "items_sold", "revenue", "cash_revenue", "online_revenue"
+            FROM "sales_by_shop" WHERE "shop_id" = %s ORDER BY "sale_day";
+        """, [self.shop_id])
+        return cursor.fetchall()
+
+    def test_payment_mode_set_after_approval(self):
+        # _order_status approves a cash line first and sets mode_of_payment = 'cash' later
+        with connection.cursor() as cursor:
+            order_id = self.add_line(cursor)
+            cursor.execute('UPDATE "orderlist" SET "status" = \'Approved\' WHERE "order_id" = %s;', [order_id])
+            cursor.execute('UPDATE "orderlist" SET "mode_of_payment" = \'cash\' WHERE "order_id" = %s;', [order_id])
+            self.assertEqual(self.shop_rollup(cursor), [(1, 2, Decimal('60.00'), Decimal('60.00'), Decimal('0.00'))])
+
+            cursor.execute('UPDATE "orderlist" SET "mode_of_payment" = \'Online\' WHERE "order_id" = %s;', [order_id])
+            incremental = self.shop_rollup(cursor)
+            self.assertEqual(incremental, [(1, 2, Decimal('60.00'), Decimal('0.00'), Decimal('60.00'))])
+
+        rebuild_rollups()
+        with connection.cursor() as cursor:
+            self.assertEqual(self.shop_rollup(cursor), incremental)
+
+
+class OrderLineCopyTests(RawSchemaTestCase):
+
+    def test_large_cash_cart_keeps_nulls(self):
+        # Above COPY_THRESHOLD the lines go through COPY; a cash order has no token or payment mode yet
+        items = [CartItem(n, self.shop_id, 1, f'Item {n}', Decimal('10.00'), Decimal('10.00'))
+                 for n in range(COPY_THRESHOLD + 1)]
+        with connection.cursor() as cursor:
+            written = write_order_lines(
+                cursor, items, email='b@example.com', name='B', contact_no='8888888888',
+                status='Pending', timestamp=datetime(2025, 2, 1, 12, 30),
+            )
+            self.assertEqual(written, COPY_THRESHOLD + 1)
+            cursor.execute("""
+                SELECT COUNT(*) FROM "orderlist"
+                WHERE "email" = 'b@example.com'
+                  AND "tokenid" IS NULL AND "mode_of_payment" IS NULL AND "menu_version" IS NULL;
+            """)
+            self.assertEqual(cursor.fetchone()[0], COPY_THRESHOLD + 1)
+
+
+class MenuApiTests(RawSchemaTestCase):
+
+    def test_revalidation_does_not_load_the_session(self):
+        etag = get_menu_snapshot().etag
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('menu_api'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+
+    def test_menu_needs_login(self):
+        response = self.client.get(reverse('menu_api'))
+        self.assertEqual(response.status_code, 401)
+
+
+class BookingsChangesTests(RawSchemaTestCase):
+
+    def test_deleted_lines_are_reported(self):
+        with connection.cursor() as cursor:
+            order_id = self.add_line(cursor, status='Approved')
+            kept_id = self.add_line(cursor, status='Approved')
+        session = self.client.session
+        session['shop_id'] = self.shop_id
+        session.save()
+        since = self.client.get(reverse('bookings_changes'), {'since': '1'}).json()['cursor']
+
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM "orderlist" WHERE "order_id" = %s;', [order_id])
+        data = self.client.get(reverse('bookings_changes'), {'since': since}).json()
+        self.assertEqual(data['deleted'], [order_id])
+        self.assertNotIn(kept_id, data['deleted'])
+
+    def test_only_expired_tombstones_are_pruned(self):
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO "orderlist_deletions" ("order_id", "shop_id", "deleted_at")
+                VALUES (1, %s, CURRENT_TIMESTAMP - INTERVAL '48 hours'), (2, %s, CURRENT_TIMESTAMP);
+            """, [self.shop_id, self.shop_id])
+            self.assertEqual(prune_deletions(cursor, batch_size=1), 1)
+            cursor.execute('SELECT "order_id" FROM "orderlist_deletions";')
+            self.assertEqual(cursor.fetchall(), [(2,)])
+
+
+class OrderStatusPollTests(RawSchemaTestCase):
+
+    def poll(self, **body):
+        return self.client.post(reverse('check_order_status'), json.dumps(body), content_type='application/json').json()
+
+    @mock.patch('food.event_bus.listening_id', return_value='test-listener')
+    def test_unchanged_pending_order_is_answered_from_memory(self, listening_id):
+        with connection.cursor() as cursor:
+            self.add_line(cursor, email='c@example.com')
+        first = self.poll(email='c@example.com')
+        self.assertEqual(first['status'], 'pending')
+
+        with self.assertNumQueries(0):
+            again = self.poll(email='c@example.com', stamp=first['stamp'])
+        self.assertEqual(again['status'], 'pending')
+        self.assertTrue(again['unchanged'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            notify_order_change('c@example.com')
+        changed = self.poll(email='c@example.com', stamp=first['stamp'])
+        self.assertNotIn('unchanged', changed)
+        self.assertNotEqual(changed['stamp'], first['stamp'])
+
+    @mock.patch('food.event_bus.listening_id', return_value=None)
+    def test_no_stamp_while_the_listener_is_down(self, listening_id):
+        with connection.cursor() as cursor:
+            self.add_line(cursor, email='d@example.com')
+        self.assertNotIn('stamp', self.poll(email='d@example.com'))
+
+
+class TokenTransitionTests(RawSchemaTestCase):
+
+    def test_token_approved_after_midnight(self):
+        # Placed on Feb 1st, approved (and tokened by the allocator) on Feb 2nd
+        with connection.cursor() as cursor:
+            first = self.add_line(cursor, status='Approved', tokenid=1001, token_day=date(2025, 2, 2),
+                                  timestamp=datetime(2025, 2, 1, 23, 55))
+            second = self.add_line(cursor, status='Approved', tokenid=1001, token_day=date(2025, 2, 2),
+                                   timestamp=datetime(2025, 2, 1, 23, 56))
+            # Yesterday's token with the same number stays put
+            other = self.add_line(cursor, status='Approved', tokenid=1001, token_day=date(2025, 2, 1),
+                                  timestamp=datetime(2025, 2, 1, 9, 0))
+
+            results, _ = transition_order_lines(cursor, self.shop_id, 'Completed', tokenid=1001, token_day=date(2025, 2, 2))
+            self.assertEqual([(line['order_id'], line['result']) for line in results],
+                             [(first, APPLIED), (second, APPLIED)])
 
-# Create your tests here.
+            # Moved on a later day: without a day the latest token of that number is meant
+            results, _ = transition_order_lines(cursor, self.shop_id, 'Delivered', tokenid=1001)
+            self.assertEqual([line['order_id'] for line in results], [first, second])
+            cursor.execute('SELECT "status" FROM "orderlist" WHERE "order_id" = %s;', [other])
+            self.assertEqual(cursor.fetchone()[0], 'Approved')
@@ -1,6 +1,11 @@
 from django.urls import path
-from .views import  home , confirm_order, settinguporder, check_order_status, success, waiting, adminapproval, allorders, approve_order, payment_success_view, past_orders_page, past_orders, stall_login, bookings, update_order_status, admin_login, admin_panel , admin_logout, add_shop, delete_shop, shop_listing, toggle_availability, generate_order_id, ulogin, usignup, urnp, ulogout, toggle_menu, remove_order, stall_history, export_orders_to_excel, create_order, payment_success_billdesk, payment_failed_billdesk
+from .views import  home , confirm_order, settinguporder, check_order_status, success, waiting, adminapproval, allorders, approve_order, payment_success_view, past_orders_page, past_orders, stall_login, bookings, update_order_status, admin_login, admin_panel , admin_logout, add_shop, delete_shop, shop_listing, toggle_availability, generate_order_id, ulogin, usignup, urnp, ulogout, toggle_menu, remove_order, stall_history, export_orders_to_excel, create_order, payment_success_billdesk, payment_failed_billdesk, payment_confirm_billdesk, menu_api, token_metrics, bookings_changes, stall_order_transitions, bulk_resolve_orders, report_jobs, report_job_status, report_job_download, sales_dashboard_api
+from django.conf import settings
 from django.conf.urls import handler404, handler500, handler403, handler400
+
+if settings.ASYNC_VIEWS:
+    # Served over ASGI (run_uvicorn.py): the I/O-bound views wait as coroutines
+    from .async_views import create_order, check_order_status, order_status_stream, payment_success_billdesk
 from .views import custom_404, custom_500, custom_403, custom_400  # Import custom error views
 # Custom error handlers
 handler404 = 'food.views.custom_404'
@@ -11,6 +16,7 @@ handler400 = 'food.views.custom_400'
 urlpatterns = [
 
     path('', home, name='home'),
+    path('api/menu/', menu_api, name='menu_api'),
     path('confirm-order/', confirm_order, name='confirm_order'),
     path('settinguporder/', settinguporder, name='settinguporder'),  # For order setup
     path('check_order_status/', check_order_status, name='check_order_status'),
@@ -18,15 +24,19 @@ urlpatterns = [
     path('waiting/',waiting, name='waiting'),
     path('admin/approval/', adminapproval, name='adminapproval'),
     path('admin/approve_order/<int:order_id>/', approve_order, name='approve_order'),
+    path('admin/orders/bulk/', bulk_resolve_orders, name='bulk_resolve_orders'),
     path('admin/allorders/', allorders, name='allorders'),
     path('past_orders/api/', past_orders, name='past_orders_api'),  # Updated API URL
     path('past_orders/', past_orders_page, name='past_orders_page'),
     path('stall/login/', stall_login, name='stall_login'),
     path('stall/bookings/', bookings, name='bookings'),
+    path('stall/bookings/changes/', bookings_changes, name='bookings_changes'),
     path('stall/update/<int:order_id>/status=<str:status>/', update_order_status, name='update_order_status'),
+    path('stall/orders/transitions/', stall_order_transitions, name='stall_order_transitions'),
     path('admin/login/', admin_login, name='admin_login'),
     path('admin/panel/', admin_panel, name='admin_panel'),
     path('admin/logout/', admin_logout, name='admin_logout'),
+    path('admin/metrics/tokens/', token_metrics, name='token_metrics'),
     path('admin/add_shop/', add_shop, name='add_shop'),
     path('admin/delete_shop/<int:shop_id>/', delete_shop, name='delete_shop'),
     path('admin/shop_listing/', shop_listing, name='shop_listing'),
@@ -40,8 +50,17 @@ urlpatterns = [
     path('admin/remove_order/<int:order_id>/', remove_order, name='remove_order'),
     path('stall/stall_history/', stall_history, name='stall_history'),
     path("admin/export-orders/", export_orders_to_excel, name="export_orders"),
+    path("admin/reports/", report_jobs, name="report_jobs"),
+    path("admin/dashboard/sales/", sales_dashboard_api, name="sales_dashboard"),
+    path("admin/reports/<int:job_id>/", report_job_status, name="report_job_status"),
+    path("admin/reports/<int:job_id>/download/", report_job_download, name="report_job_download"),
     path('create-order/', create_order, name='create_order'),
     path('payment-success/', payment_success_billdesk, name='payment_success_billdesk'),
     path('payment-failed/', payment_failed_billdesk, name='payment_failed_billdesk'),
+    path('payment-confirm/', payment_confirm_billdesk, name='payment_confirm_billdesk'),  # Server-to-server, from Express
 
 ]
+
+if settings.ASYNC_VIEWS:
+    # Push needs ASGI: under WSGI each open stream would hold a server thread
+    urlpatterns.append(path('order_status/stream/', order_status_stream, name='order_status_stream'))
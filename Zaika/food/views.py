@@ -1,15 +1,19 @@
 from django.shortcuts import redirect, render
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.utils import timezone
+from django.utils.dateformat import format as date_format
+from django.utils.html import format_html
 from django.http import JsonResponse
 from django.db import connection, transaction
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse
 from django.core.mail import send_mail
-from django.views.decorators.csrf import csrf_protect
+from django.views.decorators.csrf import csrf_protect, csrf_exempt
 from django.contrib import messages
 import json
 from datetime import datetime
 import os
 import logging
-import re
 from random import *
 
 logger = logging.getLogger(__name__)
@@ -17,8 +21,20 @@ import uuid
 from django.conf import settings
 from django.contrib.auth.hashers import check_password
 from django.contrib.auth.hashers import make_password
-import pandas as pd
-from io import BytesIO
+from . import event_bus
+from .menu_cache import get_menu_snapshot, bump_menu_version
+from .cart import MAX_QTY_PER_LINE, parse_cart, get_session_cart, save_session_cart, clear_session_cart, shop_ids_of
+from .pricing import price_cart
+from .tokens import allocate_dated_token, token_stats
+from .order_events import notify_order_change, order_change_stamp
+from .rollups import sales_dashboard
+from .sql_json import fetch_json
+from .order_history import history_page, parse_history_cursor, notify_orders_written
+from .reports import ReportError, enqueue_report, get_job, artifact_path
+from .exports import ORDER_STATUSES, PAYMENT_MODES, order_filters, csv_export, xlsx_export
+from .payment_gateway import express_gateway, GatewayUnavailable
+from .payments import SIGNATURE_HEADER, UnknownPayment, record_payment, save_payment_intent, verify_signature
+from .orders import validate_cart, insert_order_lines, write_order_lines, resolve_pending_orders, transition_order_lines, CartUnavailable, BOOKINGS_DELETIONS_RETENTION_HOURS
 
 
 # Home view to display all stalls and handle item selection
@@ -29,51 +45,8 @@ import json
 
 def home(request):
     if request.session.get("is_authenticated"):
-        # Execute raw SQL query to fetch shop and menu items
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT 
-                    s.shop_id, 
-                    s.shop_name, 
-                    m.id AS item_id, 
-                    m.name AS item_name, 
-                    m.price, 
-                    'Available' AS availability
-                FROM 
-                    shops s
-                LEFT JOIN 
-                    menuitems m ON s.shop_id = m.shop_id
-                WHERE 
-                    m.availability = 1  -- Availability column has 0 or 1
-                ORDER BY 
-                    s.shop_name, m.name;
-            """)
-
-            # Fetch all results
-            rows = cursor.fetchall()
-
-        # Format the results into a dictionary by shop
-        shops = {}
-        for row in rows:
-            shop_id = row[0]
-            shop_name = row[1]
-            item_id = row[2]
-            item_name = row[3]
-            price = row[4]
-            availability = row[5]
-
-            if shop_name not in shops:
-                shops[shop_name] = {'shop_id': shop_id, 'items': []}
-
-            # Add items to the respective shop
-            if item_name:  # Only add items if they exist
-                shops[shop_name]['items'].append({
-                    'item_id': item_id,
-                    'item_name': item_name,
-                    'price': price,
-                    'availability': availability,
-                    'shop_id': shop_id
-                })
+        # Shops and their available items, shared across requests until the menu changes
+        menu = get_menu_snapshot()
 
         # Load session data for pre-filling form fields on GET request
         user_name = request.session.get('user_name', '')
@@ -82,18 +55,13 @@ def home(request):
 
         # If the form is submitted, process selected items
         if request.method == 'POST':
-            selected_items = request.POST.getlist('selected_items')
-            formatted_items = []
-            for item in selected_items:
-                # Parse the JSON string correctly
-                item_data = json.loads(item)
-                formatted_items.append({
-                    'item_name': item_data['item_name'],
-                    'price': float(item_data['price']),
-                    'shop_id': int(item_data['shop_id']),
-                })
-            # Store formatted items in the session
-            request.session['selected_items'] = formatted_items
+            # Each checkbox value is a JSON [item_id, shop_id, qty] triple
+            try:
+                cart = parse_cart([json.loads(value) for value in request.POST.getlist('selected_items')])
+            except (ValueError, json.JSONDecodeError):
+                return HttpResponse("Invalid order items data", status=400)
+            # Store the cart (ids only) in the session
+            save_session_cart(request.session, cart)
             
             # Store user details in session
             # request.session['username'] = request.POST.get('name')
@@ -103,14 +71,9 @@ def home(request):
             # Redirect to confirmation page
             return redirect('confirm_order')
 
-        # Sort items in each shop by item_id
-        for shop in shops.values():
-            shop['items'] = sorted(shop['items'], key=lambda x: x['item_id'])
-        # Sort shops by shop_id
-        sorted_shops = dict(sorted(shops.items(), key=lambda x: x[1]['shop_id']))
-        # Pass the data to the template
+        # Pass the data to the template (shops are already ordered by shop_id, items by item_id)
         return render(request, 'home.html', {
-            'shops': sorted_shops,
+            'shops': menu.shops,
             'user_name': user_name,
             'user_email': user_email,
             'user_phone': user_phone,
@@ -120,14 +83,48 @@ def home(request):
 
 
 
+def menu_api(request):
+    """
+    GET /zaikaa/api/menu/
+    Available shops and items as compact JSON:
+    {"shops": [{"id": 1, "name": "...", "items": [[item_id, "name", "price"], ...]}]}
+    Clients that send back the ETag get a 304 without any DB access: the
+    ETag is compared before the session is loaded, since a client holding
+    the current ETag already has the menu and a 304 tells it nothing new.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+
+    menu = get_menu_snapshot()
+
+    if _etag_matches(request.META.get('HTTP_IF_NONE_MATCH', ''), menu.etag):
+        response = HttpResponse(status=304)
+    elif not request.session.get("is_authenticated"):
+        return JsonResponse({'status': 'error', 'message': 'Login required'}, status=401)
+    else:
+        response = HttpResponse(menu.payload, content_type='application/json; charset=utf-8')
+    response['ETag'] = menu.etag
+    # Let the browser keep its copy but always revalidate it
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # If-None-Match uses the weak comparison, so ignore any W/ prefix
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return any(tag[2:] == etag if tag.startswith('W/') else tag == etag for tag in candidates)
 
 
 
 
 def confirm_order(request):
     if request.session.get("is_authenticated"):
-        # Retrieve the selected items from the session
-        selected_items = request.session.get('selected_items', [])
+        # Retrieve the cart from the session and attach names/prices from the menu
+        selected_items = price_cart(get_session_cart(request.session)).items
         user_name = request.session['user_name'] 
         user_email = request.session['user_email'] 
         user_phone = request.session['user_phone'] 
@@ -139,6 +136,7 @@ def confirm_order(request):
         # Pass the selected items and user details to the template
         return render(request, 'confirm_order.html', {
             'selected_items': selected_items,
+            'max_qty': MAX_QTY_PER_LINE,
             'user_name' : user_name,
             'user_email' : user_email,
             'user_phone' : user_phone
@@ -149,63 +147,32 @@ def confirm_order(request):
 
 def create_order(request):
     if request.session.get("is_authenticated"):
-        import requests as http_requests
-
-        selected_items = request.session.get('selected_items', [])
+        cart = get_session_cart(request.session)
         user_name = request.session['user_name']
         user_email = request.session['user_email']
         user_phone = request.session['user_phone']
         order_id = request.POST.get('order_id') or request.session.get('order_id')
-        
-        # Safely extract shop_ids from items_name
-        shop_ids = list(set(item.get('item_name', '').split('(Shop ID: ')[-1].rstrip(')') for item in selected_items if '(Shop ID: ' in item.get('item_name', '')))
-        
-        # Calculate total from selected items
-        total_amount = sum(float(item.get('total_price', item.get('price', 0))) for item in selected_items)
-        
-        # Send to Express backend
-        Backend_url = os.environ.get("BACKEND_URL", "http://localhost:8000")
-        url = f'{Backend_url}/api/payments/create-order-zaikaa'
+        if not order_id:
+            return HttpResponse("Order ID missing. Please try again.", status=400)
 
-        try:
-            response = http_requests.post(
-                url,
-                json={
-                    "order_id": order_id,
-                    "total_amount": total_amount,
-                    "user_name": user_name,
-                    "user_email": user_email,
-                    "user_phone": user_phone,
-                    "selected_items": selected_items,
-                    "shop_ids": shop_ids
-                },
-                headers={'Content-Type': 'application/json'},
-                timeout=30
-            )
+        # Price the cart on the server from the menu snapshot
+        priced = price_cart(cart)
+        payload = _express_order_payload(order_id, user_name, user_email, user_phone, priced, shop_ids_of(cart))
+
+        # Send to Express backend over the shared, pooled client
+        gateway = express_gateway()
 
+        try:
+            # Lets the payment be recorded from Express's confirmation even if the session is gone
+            save_payment_intent(order_id, user_name, user_email, user_phone, cart)
+            response = gateway.post('/api/payments/create-order-zaikaa', json=payload)
             data = response.json()
             print(f"Express API response: {data}")
+            return _billdesk_redirect(request.session, gateway.base_url, order_id, response.status_code, data)
 
-            if response.status_code == 200 and data.get('success'):
-                # Store order details in session
-                request.session['order_id'] = order_id
-                request.session['transaction_id'] = data.get('data', {}).get('transactionId')
-                
-                # Get BillDesk redirect parameters
-                bd_data = data.get('data', {})
-                merchantid = bd_data.get('merchantid')
-                bdorderid = bd_data.get('bdorderid')
-                rdata = bd_data.get('rdata')
-                
-                if merchantid and bdorderid and rdata:
-                    # Redirect to Express forwardToBillDesk endpoint
-                    forward_url = f"{Backend_url}/api/payments/forward?merchantid={merchantid}&bdorderid={bdorderid}&rdata={rdata}"
-                    return redirect(forward_url)
-                else:
-                    return HttpResponse("Payment gateway configuration error", status=500)
-            else:
-                error_msg = data.get('message', 'Payment initiation failed')
-                return HttpResponse(f"Payment Error: {error_msg}", status=400)
+        except GatewayUnavailable:
+            # The breaker is open: fail fast instead of tying up a thread
+            return HttpResponse("The payment server is unavailable. Please try again in a minute.", status=503)
 
         except Exception as e:
             print(f"Error calling Express API: {e}")
@@ -215,6 +182,53 @@ def create_order(request):
         return redirect('ulogin')
 
 
+def _express_order_payload(order_id, user_name, user_email, user_phone, priced, shop_ids):
+    """Body of the Express create-order call (shared with the async create_order)."""
+    return {
+        "order_id": order_id,
+        "total_amount": float(priced.total),
+        "user_name": user_name,
+        "user_email": user_email,
+        "user_phone": user_phone,
+        "selected_items": [
+            {
+                "item_id": item.item_id,
+                "shop_id": item.shop_id,
+                "item_name": item.item_name,
+                "quantity": item.qty,
+                "price": str(item.price),
+                "total_price": str(item.total_price),
+            }
+            for item in priced.items
+        ],
+        "shop_ids": shop_ids,
+        "menu_version": priced.menu_version
+    }
+
+
+def _billdesk_redirect(session, backend_url, order_id, status_code, data):
+    """Turn the Express create-order answer into the redirect to BillDesk, or an error page."""
+    if status_code == 200 and data.get('success'):
+        # Store order details in session
+        session['order_id'] = order_id
+
+        # Get BillDesk redirect parameters
+        bd_data = data.get('data', {})
+        merchantid = bd_data.get('merchantid')
+        bdorderid = bd_data.get('bdorderid')
+        rdata = bd_data.get('rdata')
+
+        if merchantid and bdorderid and rdata:
+            # Redirect to Express forwardToBillDesk endpoint
+            forward_url = f"{backend_url}/api/payments/forward?merchantid={merchantid}&bdorderid={bdorderid}&rdata={rdata}"
+            return redirect(forward_url)
+        else:
+            return HttpResponse("Payment gateway configuration error", status=500)
+    else:
+        error_msg = data.get('message', 'Payment initiation failed')
+        return HttpResponse(f"Payment Error: {error_msg}", status=400)
+
+
 def settinguporder(request):
     # Get form data (from the form submitted)
     user_name = request.POST.get('name')
@@ -224,42 +238,24 @@ def settinguporder(request):
     # Update session with the new user details
     request.session['user_name'] = user_name
     request.session['user_email'] = user_email
-    request.session['user_mobile'] = mobile
 
     # Log session data for debugging
     print(f"Session keys: {list(request.session.keys())}")
     print(f"Full session data: {dict(request.session)}")
 
-    # Get selected items from session
-    selected_items = request.session.get('selected_items', [])
-
-    # Extract shop IDs from selected items (ensure no duplicates)
-    shop_ids = list(set(item['shop_id'] for item in selected_items))
-
     # Get total amount and order items
     total_amount = float(request.POST.get('total'))  # Get the total amount from the form
-    
+
     order_items_str = request.POST.get('order_items')
     print(f"Order Items (raw): {order_items_str}")  # Log the raw order items data
 
     try:
-        items = json.loads(order_items_str)  # Get a list of items from the form
-    except json.JSONDecodeError as e:
-        # print(f"Error decoding JSON for order_items: {e}")
+        cart = parse_cart(order_items_str)  # [item_id, shop_id, qty] triples from the form
+    except ValueError as e:
+        # print(f"Error decoding order_items: {e}")
         return HttpResponse("Invalid order items data", status=400)
 
-    # Print the data for debugging
-    # print(f"User Name: {user_name}")
-    # print(f"User Email: {user_email}")
-    # print(f"Mobile: {mobile}")
-    # print(f"Shop IDs (based on selected items): {shop_ids}")
-    # print(f"Total Amount: {total_amount}")
-    # print(f"Items: {items}")
-
-    # Print the selected items for debugging
-    # print("Selected Items:")
-    # for item in selected_items:
-    #     print(f"Item Name: {item['item_name']}, Shop ID: {item['shop_id']}, Price: ₹{item['price']}")
+    save_session_cart(request.session, cart)
 
     try:
         with transaction.atomic():  # Start a transaction block
@@ -283,47 +279,34 @@ def settinguporder(request):
                     user_id = cursor.fetchone()[0]
                     print(f"User ID: {user_id}")
 
-            # Query 2: Check if items are available before inserting into "orderlist"
+            # Query 2: Check availability for the whole cart, then insert every line at once
             with connection.cursor() as cursor:
-                for shop_id in shop_ids:
-                    shop_items = [item for item in items if re.search(r'\(Shop ID: (\d+)\)', item['item_name']) and int(re.search(r'\(Shop ID: (\d+)\)', item['item_name']).group(1)) == shop_id]
-                    
-                    for item in shop_items:
-                        item_name = item['item_name']
-                        quantity = item['quantity']
-                        price = float(item['price'])
-                        
-                        match = re.match(r'^(.*?) \(Shop ID: \d+\)$', item_name)
-                        item_name_without_shop = match.group(1) if match else item_name
-                        
-                        cursor.execute(""" 
-                            SELECT "availability" FROM "menuitems" WHERE "shop_id" = %s AND "name" = %s;
-                        """, [shop_id, item_name_without_shop])
-                        result = cursor.fetchone()
-                        
-                        if result:
-                            availability = result[0]
-                            if availability == 1:
-                                total_price = quantity * price
-                                timestamp = datetime.now()
-                                cursor.execute(""" 
-                                    INSERT INTO "orderlist" ("email", "name", "contact_no", "shop_id", "item_name", "qty", "total_amt", "status","timestamp")
-                                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s,%s) RETURNING "order_id";
-                                """, [user_email, user_name, mobile, shop_id, item_name_without_shop, quantity, total_price, 'Pending',timestamp])
-                                order_id = cursor.fetchone()[0]
-                                print(f"Executed INSERT into orderlist table: User ID = {user_id}, Shop ID = {shop_id}, Item = {item_name_without_shop}, Quantity = {quantity}, Price = {price}, Total Price = {total_price}")
-
-
-                            else:
-                                error_message = f"The item '{item_name_without_shop}' is unavailable at Shop ID {shop_id}. Please check availability or remove the item."
-                                raise Exception(error_message)
-                        else:
-                            error_message = f"The item '{item_name_without_shop}' was not found in the menu at Shop ID {shop_id}. Please check availability or remove the item."
-                            raise Exception(error_message)
+                validate_cart(cursor, cart)
+                priced = price_cart(cart)
+                if priced.missing:
+                    raise CartUnavailable(
+                        "Some items are no longer on the menu.", [line.item_id for line in priced.missing],
+                    )
+                order_ids = insert_order_lines(
+                    cursor, priced.items,
+                    email=user_email, name=user_name, contact_no=mobile,
+                    status='Pending', timestamp=datetime.now(), menu_version=priced.menu_version,
+                )
+                print(f"Executed INSERT into orderlist table: User ID = {user_id}, Order IDs = {order_ids}")
 
         print("Order processing completed successfully")
         return redirect('waiting')  # Redirect to a waiting page for further processing
 
+    except CartUnavailable as e:
+        # Nothing was written: the whole cart is rejected together.
+        # The message carries menu item names, so it is escaped.
+        error_message = format_html("""
+        {} <br>
+        Please visit the homepage, remove these items and try again. <br>
+        <a href="{}">Go to Homepage</a>
+        """, str(e), reverse('home'))
+        return HttpResponse(error_message, status=409)
+
     except Exception as e:
         # print(f"Error while processing the order: {e}")
         transaction.rollback()  # Rollback the transaction if an error occurs
@@ -343,8 +326,113 @@ def settinguporder(request):
 
 
 
+def _order_status(email):
+    """
+    Current waiting-page status for an email. Once nothing is pending, the
+    approved lines without a token get one and the status becomes 'success'.
+    Shared by check_order_status and the async order_status_stream.
+    """
+    # One pass over this email's open lines; served by the partial indexes
+    # idx_orderlist_pending_email and idx_orderlist_approved_untokened_email
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT
+                COUNT(*) FILTER (WHERE "status" = 'Pending'),
+                COUNT(*) FILTER (WHERE "status" = 'Approved' AND "tokenid" IS NULL)
+            FROM "orderlist"
+            WHERE "email" = %s
+              AND ("status" = 'Pending' OR ("status" = 'Approved' AND "tokenid" IS NULL));
+        """, [email])
+        pending_count, approved_count = cursor.fetchone()
+
+    if pending_count > 0:
+        return {
+            'status': 'pending',
+            'message': f'{pending_count} item(s) still pending approval',
+            'pending_count': pending_count
+        }
+
+    if approved_count == 0:
+        return {
+            'status': 'failed',
+            'message': 'No approved items found for this email.',
+            'pending_count': pending_count
+        }
+
+    # timestamp = datetime.now()
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Claim the lines before spending a token on them: a concurrent request
+        # (another tab, or the stream) waits here and then finds nothing left
+        cursor.execute("""
+            SELECT "order_id" FROM "orderlist"
+            WHERE "email" = %s AND "status" = 'Approved' AND "tokenid" IS NULL
+            FOR UPDATE;
+        """, [email])
+        claimed = [row[0] for row in cursor.fetchall()]
+
+        if claimed:
+            token_id, token_day = allocate_dated_token()
+            cursor.execute("""
+                UPDATE "orderlist"
+                SET "tokenid" = %s, "token_day" = %s, "mode_of_payment" = 'cash'
+                WHERE "order_id" = ANY(%s);
+            """, [token_id, token_day, claimed])
+            notify_orders_written(email)  # The lines now show on the past-orders page
+        else:
+            # The concurrent request assigned the token first; the stall may
+            # already have moved the lines on, so any status will do
+            cursor.execute("""
+                SELECT "tokenid" FROM "orderlist"
+                WHERE "email" = %s AND "mode_of_payment" = 'cash' AND "tokenid" IS NOT NULL
+                ORDER BY "order_id" DESC LIMIT 1;
+            """, [email])
+            row = cursor.fetchone()
+            if row is None:
+                return {
+                    'status': 'failed',
+                    'message': 'No approved items found for this email.',
+                    'pending_count': pending_count
+                }
+            token_id = row[0]
+
+    return {
+        'status': 'success',
+        'message': 'Order approved',
+        'token_id': token_id,
+        # 'timestamp': timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+        'pending_count': pending_count
+    }
+
+
+def _unchanged_status(email, stamp):
+    """
+    The poll answer for a client whose last answer was pending with `stamp`,
+    if no change for its email has been heard since (no query needed), else
+    None. Also returns the current stamp, taken before any status query so
+    a change made during the query still moves it.
+    """
+    current = order_change_stamp(email)
+    if stamp and stamp == current:
+        return {'status': 'pending', 'message': 'No change', 'unchanged': True, 'stamp': current}, current
+    return None, current
+
+
+def _stamped(payload, stamp):
+    # Only a pending answer can be repeated from memory
+    if payload['status'] == 'pending' and stamp is not None:
+        payload['stamp'] = stamp
+    return payload
+
+
 @csrf_protect
 def check_order_status(request):
+    """
+    POST {"email": ..., "stamp": ...}: the waiting page's status poll.
+    A pending answer carries a `stamp`; sending it back gets 'pending' from
+    memory, without touching the database, until a change for the email
+    is published (see food.order_events.order_change_stamp).
+    """
     if request.method == "POST":
         try:
             data = json.loads(request.body)
@@ -353,55 +441,10 @@ def check_order_status(request):
             if not email:
                 return JsonResponse({'status': 'error', 'message': 'Email not provided'}, status=400)
 
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    SELECT COUNT(*) 
-                    FROM "orderlist" 
-                    WHERE "email" = %s AND "status" = 'Pending';
-                """, [email])
-                pending_count = cursor.fetchone()[0]
-
-            if pending_count > 0:
-                return JsonResponse({
-                    'status': 'pending',
-                    'message': f'{pending_count} item(s) still pending approval',
-                    'pending_count': pending_count
-                })
-
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    SELECT COUNT(*)
-                    FROM "orderlist"
-                    WHERE "email" = %s AND "status" = 'Approved' AND "tokenid" IS NULL;
-                """, [email])
-                approved_count = cursor.fetchone()[0]
-
-            if approved_count == 0:
-                return JsonResponse({
-                    'status': 'failed',
-                    'message': 'No approved items found for this email.',
-                    'pending_count': pending_count
-                })
-
-            token_id = randint(1000, 9999)
-            # timestamp = datetime.now()
-
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    UPDATE "orderlist"
-                    SET "tokenid" = %s, "mode_of_payment" = 'cash'
-                    WHERE "email" = %s AND "status" = 'Approved' AND "tokenid" IS NULL;
-                """, [token_id, email])
-
-
-
-            return JsonResponse({
-                'status': 'success',
-                'message': 'Order approved',
-                'token_id': token_id,
-                # 'timestamp': timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                'pending_count': pending_count
-            })
+            unchanged, stamp = _unchanged_status(email, data.get('stamp'))
+            if unchanged:
+                return JsonResponse(unchanged)
+            return JsonResponse(_stamped(_order_status(email), stamp))
 
         except json.JSONDecodeError:
             return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
@@ -411,6 +454,13 @@ def check_order_status(request):
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
 
 
+# Server-Sent Events stream for the waiting page, served by food.async_views.order_status_stream.
+# There is no WSGI version: each open stream would hold one of waitress's threads, so
+# under run_waitress.py the waiting page polls check_order_status instead.
+ORDER_STATUS_MAX_HOLD = int(os.getenv('ORDER_STATUS_MAX_HOLD', '60'))   # seconds before the stream is closed
+ORDER_STATUS_HEARTBEAT = int(os.getenv('ORDER_STATUS_HEARTBEAT', '15'))  # seconds between keep-alive comments
+
+
 
 
 def success(request, token_id):
@@ -429,7 +479,9 @@ def waiting(request):
         user_email = request.session.get('user_email')  # Assuming it's passed from the form
         # print(f"User email from session: {user_email}")
         return render(request, 'waiting.html', {
-            'user_email': user_email
+            'user_email': user_email,
+            # The status stream only exists under ASGI; elsewhere the page polls
+            'order_stream': settings.ASYNC_VIEWS,
         })
     else:
         return redirect('ulogin')
@@ -439,18 +491,78 @@ def waiting(request):
 
 
 
+ADMIN_APPROVAL_PAGE_SIZE = 50
+
+
 def adminapproval(request):
-    # Get all orders where the status is 'Pending'
+    # Pending orders, oldest first, one page at a time: ?after=<last order_id of the previous page>
+    after = request.GET.get('after', '')
+    after = int(after) if after.isdigit() else 0
     with connection.cursor() as cursor:
         cursor.execute("""
             SELECT "order_id", "email", "name", "contact_no", "item_name", "qty", "total_amt" , "timestamp"
             FROM "orderlist" 
-            WHERE "status" = 'Pending';
-        """)
+            WHERE "status" = 'Pending' AND "order_id" > %s
+            ORDER BY "order_id"
+            LIMIT %s;
+        """, [after, ADMIN_APPROVAL_PAGE_SIZE + 1])
         pending_orders = cursor.fetchall()
-    
+
+    has_next = len(pending_orders) > ADMIN_APPROVAL_PAGE_SIZE
+    pending_orders = pending_orders[:ADMIN_APPROVAL_PAGE_SIZE]
+
     # Render the adminapproval.html template and pass pending orders
-    return render(request, 'adminapproval.html', {'pending_orders': pending_orders})
+    return render(request, 'adminapproval.html', {
+        'pending_orders': pending_orders,
+        'after': after,
+        'next_after': pending_orders[-1][0] if has_next else None,
+    })
+
+
+@csrf_protect
+def bulk_resolve_orders(request):
+    """
+    POST /zaikaa/admin/orders/bulk/
+    Approves or rejects many pending cash orders in one statement.
+
+    Form post from the approval page (action=approve|reject, order_ids=...,
+    emails=..., after=...) redirects back to the same page; a JSON body
+    {"action": "approve", "order_ids": [...], "emails": [...]} gets a JSON
+    reply listing the order ids that changed. Orders that are no longer
+    Pending are skipped.
+    """
+    if request.method != "POST":
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+    if not request.session.get('admin_logged_in'):
+        return JsonResponse({'status': 'error', 'message': 'Admin login required'}, status=401)
+
+    is_json = request.content_type == 'application/json'
+    try:
+        if is_json:
+            data = json.loads(request.body)
+            action = data.get('action')
+            order_ids = [int(order_id) for order_id in data.get('order_ids') or []]
+            emails = [str(email) for email in data.get('emails') or []]
+        else:
+            action = request.POST.get('action')
+            order_ids = [int(order_id) for order_id in request.POST.getlist('order_ids')]
+            emails = request.POST.getlist('emails')
+    except (json.JSONDecodeError, AttributeError, TypeError, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid order list'}, status=400)
+    if action not in ('approve', 'reject'):
+        return JsonResponse({'status': 'error', 'message': 'Invalid action'}, status=400)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        changed = resolve_pending_orders(cursor, action == 'approve', order_ids=order_ids, emails=emails)
+        # Wake the customers' waiting pages
+        notify_order_change(*(email for _, email in changed))
+    print(f"Bulk {action}: {len(changed)} order lines")
+
+    if is_json:
+        return JsonResponse({'status': 'success', 'action': action, 'order_ids': [order_id for order_id, _ in changed]})
+    after = request.POST.get('after', '')
+    url = reverse('adminapproval')
+    return redirect(f"{url}?after={after}" if after.isdigit() and after != '0' else url)
 
 
 
@@ -460,8 +572,14 @@ def approve_order(request, order_id):
         cursor.execute("""
             UPDATE "orderlist" 
             SET "status" = 'Approved' 
-            WHERE "order_id" = %s;
+            WHERE "order_id" = %s
+            RETURNING "email";
         """, [order_id])
+        approved = cursor.fetchone()
+
+    # Wake the customer's waiting page
+    if approved:
+        notify_order_change(approved[0])
     
 
     
@@ -475,8 +593,13 @@ def remove_order(request, order_id):
         with connection.cursor() as cursor:
             cursor.execute("""
                 DELETE FROM "orderlist" 
-                WHERE "order_id" = %s;
+                WHERE "order_id" = %s
+                RETURNING "email";
             """, [order_id])
+            removed = cursor.fetchone()
+
+        if removed:
+            notify_order_change(removed[0])
 
 
     
@@ -484,17 +607,86 @@ def remove_order(request, order_id):
 
 
 
+ALLORDERS_PAGE_SIZE = 100
+
+
+def _parse_order_cursor(value):
+    # "<timestamp ISO>_<order_id>" of the last row on the previous page
+    timestamp, _, order_id = value.rpartition('_')
+    try:
+        return datetime.fromisoformat(timestamp), int(order_id)
+    except ValueError:
+        return None
+
+
 def allorders(request):
-    # Get all orders from the database
+    """
+    Every order line, newest first, ALLORDERS_PAGE_SIZE rows per page.
+    Pages are keyed on ("timestamp", "order_id") rather than OFFSET, so any
+    page costs one short index range scan. Rows are always written with a
+    timestamp (column default or the order helpers); a row without one
+    would not be listed. ?count=estimate adds the planner's row estimate
+    for the current filters instead of a COUNT(*).
+    """
+    clauses, args, filters = order_filters(request.GET)
+    clauses.insert(0, '"timestamp" IS NOT NULL')
+    where = list(clauses)
+    page_args = list(args)
+    cursor_value = request.GET.get('cursor', '')
+    position = _parse_order_cursor(cursor_value) if cursor_value else None
+    if position:
+        where.append('("timestamp", "order_id") < (%s, %s)')
+        page_args.extend(position)
+
     with connection.cursor() as cursor:
-        cursor.execute("""
-            SELECT "order_id", "email", "name", "contact_no", "item_name", "qty", "total_amt", "status"
-            FROM "orderlist";
-        """)
+        cursor.execute(f"""
+            SELECT "order_id", "email", "name", "contact_no", "item_name", "qty", "total_amt", "status",
+                   "timestamp", "shop_id", "mode_of_payment"
+            FROM "orderlist"
+            WHERE {" AND ".join(where)}
+            ORDER BY "timestamp" DESC, "order_id" DESC
+            LIMIT %s;
+        """, page_args + [ALLORDERS_PAGE_SIZE + 1])
         all_orders = cursor.fetchall()
 
+        estimated_total = None
+        if request.GET.get('count') == 'estimate':
+            estimated_total = _estimate_rows(cursor, 'SELECT 1 FROM "orderlist" WHERE ' + " AND ".join(clauses), args)
+
+        cursor.execute('SELECT "shop_id", "shop_name" FROM "shops" ORDER BY "shop_id";')
+        shops = cursor.fetchall()
+
+    next_cursor = None
+    if len(all_orders) > ALLORDERS_PAGE_SIZE:
+        all_orders = all_orders[:ALLORDERS_PAGE_SIZE]
+        last = all_orders[-1]
+        next_cursor = f"{last[8].isoformat()}_{last[0]}"
+
+    query = dict(filters)
+    if estimated_total is not None:
+        query['count'] = 'estimate'
+
     # Render the allorders.html template and pass all orders
-    return render(request, 'allorders.html', {'all_orders': all_orders})
+    return render(request, 'allorders.html', {
+        'all_orders': all_orders,
+        'shops': shops,
+        'statuses': ORDER_STATUSES,
+        'payment_modes': PAYMENT_MODES,
+        'filters': filters,
+        'estimated_total': estimated_total,
+        'is_first_page': position is None,
+        'first_page_query': urlencode(query),
+        'next_page_query': urlencode({**query, 'cursor': next_cursor}) if next_cursor else None,
+    })
+
+
+def _estimate_rows(cursor, sql, args):
+    """The planner's row estimate for `sql`: costs a plan, not a scan."""
+    cursor.execute("EXPLAIN (FORMAT JSON) " + sql, args)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
 
 
 
@@ -503,7 +695,11 @@ def allorders(request):
 
 @csrf_protect
 def past_orders(request):
-
+    """
+    POST {"email": ..., "cursor": optional} -> one page of the email's past
+    tokens, newest first, and the cursor of the next page (null on the
+    last). Pages are cached per email; see food/order_history.py.
+    """
     if request.method == "POST":
         try:
             data = json.loads(request.body)
@@ -512,39 +708,14 @@ def past_orders(request):
             if not email:
                 return JsonResponse({"error": "Email not provided"}, status=400)
 
-            # Fetch all orders for this user with a tokenid
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    SELECT o.tokenid, o.timestamp, o.mode_of_payment, s.shop_name, o.item_name, o.qty, o.total_amt, o.status
-                    FROM orderlist o
-                    JOIN shops s ON o.shop_id = s.shop_id
-                    WHERE o.email = %s AND o.tokenid IS NOT NULL
-                    ORDER BY o.timestamp DESC, o.tokenid DESC;
-                """, [email])
-                rows = cursor.fetchall()
-
-            # Group by tokenid
-            grouped = {}
-            for tokenid, timestamp, mode_of_payment, shop_name, item_name, qty, total_amt, status in rows:
-                if tokenid not in grouped:
-                    grouped[tokenid] = {
-                        "token_id": tokenid,
-                        "timestamp": timestamp.strftime("%d %B %Y, %I:%M %p") if isinstance(timestamp, datetime) else "Unknown Date",
-                        "mode_of_payment": mode_of_payment,
-                        "items": [],
-                        "grand_total": 0
-                    }
-                grouped[tokenid]["items"].append({
-                    "shop_name": shop_name,
-                    "item_name": item_name,
-                    "quantity": qty,
-                    "total_amount": total_amt,
-                    "status": status
-                })
-                grouped[tokenid]["grand_total"] += total_amt
-
-            orders = list(grouped.values())
-            return JsonResponse({"orders": orders}, status=200)
+            position = None
+            if data.get("cursor"):
+                position = parse_history_cursor(str(data["cursor"]))
+                if position is None:
+                    return JsonResponse({"error": "Invalid cursor"}, status=400)
+
+            body = history_page(email, position)
+            return HttpResponse(body, content_type="application/json", status=200)
 
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
@@ -607,6 +778,19 @@ def stall_login(request):
 
 
 
+BOOKINGS_STATUSES = ('Approved', 'Completed')
+
+
+def _change_cursor(cursor):
+    """
+    Oldest transaction still running. Any orderlist write that is not
+    visible to a read made after this call was made by a transaction with an
+    id >= this, so `change_xid >= cursor` finds it on the next poll.
+    """
+    cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text;")
+    return cursor.fetchone()[0]
+
+
 def bookings(request):
     shop_id = request.session.get('shop_id')
     if not shop_id:
@@ -614,34 +798,86 @@ def bookings(request):
 
     # Fetch orders for the logged-in stall
     with connection.cursor() as cursor:
+        change_cursor = _change_cursor(cursor)  # Taken before the read, see _change_cursor
         cursor.execute("""
-            SELECT o."tokenid", o."order_id", o."item_name", o."qty", o."name", o."contact_no", o."status", o."timestamp"
+            SELECT o."tokenid", o."order_id", o."item_name", o."qty", o."name", o."contact_no", o."status", o."timestamp",
+                   COALESCE(o."token_day", o."timestamp"::date)
             FROM "orderlist" o
             WHERE o."shop_id" = %s AND o."status" IN ('Approved', 'Completed')
             ORDER BY o."timestamp" ASC;  -- Change DESC to ASC
         """, [shop_id])
         orders = cursor.fetchall()
 
-    return render(request, 'bookings.html', {'orders': orders})
+    return render(request, 'bookings.html', {
+        'orders': orders,
+        'change_cursor': change_cursor,
+        'deletions_retention_hours': BOOKINGS_DELETIONS_RETENTION_HOURS,
+    })
 
 
+def bookings_changes(request):
+    """
+    GET /zaikaa/stall/bookings/changes/?since=<cursor>
+    Orders of the logged-in stall written since `since` (the cursor from the
+    bookings page or the previous call), in any status, so the page can add,
+    move and drop rows. Lines deleted since then (a rejected or removed
+    order, a deleted shop) are listed by order_id in `deleted`, from the
+    tombstones the orderlist_track_delete trigger writes. A row may be sent
+    more than once; applying it again is harmless.
+    """
+    shop_id = request.session.get('shop_id')
+    if not shop_id:
+        return JsonResponse({'status': 'error', 'message': 'Stall login required'}, status=401)
+    since = request.GET.get('since', '')
+    if not since.isdigit():
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
 
+    with connection.cursor() as cursor:
+        change_cursor = _change_cursor(cursor)
+        cursor.execute("""
+            SELECT o."order_id", o."tokenid", o."item_name", o."qty", o."name", o."status", o."timestamp",
+                   COALESCE(o."token_day", o."timestamp"::date)
+            FROM "orderlist" o
+            WHERE o."shop_id" = %s AND o."change_xid" >= %s::xid8
+            ORDER BY o."timestamp" ASC;
+        """, [shop_id, since])
+        rows = cursor.fetchall()
+        cursor.execute("""
+            SELECT DISTINCT d."order_id"
+            FROM "orderlist_deletions" d
+            WHERE d."shop_id" = %s AND d."change_xid" >= %s::xid8;
+        """, [shop_id, since])
+        deleted = [row[0] for row in cursor.fetchall()]
 
+    orders = [{
+        'order_id': order_id,
+        'tokenid': tokenid,
+        'token_day': token_day.isoformat() if tokenid is not None and token_day else None,
+        'item_name': item_name,
+        'qty': qty,
+        'name': name,
+        'status': status,
+        'timestamp': timestamp.isoformat() if timestamp else None,
+        'display_time': date_format(timestamp, "D M d, Y H:i") if timestamp else "No Timestamp",
+        'on_board': status in BOOKINGS_STATUSES,
+    } for order_id, tokenid, item_name, qty, name, status, timestamp, token_day in rows]
+    return JsonResponse({'status': 'success', 'cursor': change_cursor, 'orders': orders, 'deleted': deleted})
 
 
 def update_order_status(request, order_id, status):
     if status not in ['completed', 'delivered']:
         return HttpResponse("Invalid status", status=400)
+    shop_id = request.session.get('shop_id')
+    if not shop_id:
+        return redirect('stall_login')
 
-    # Update the order status in the database
+    # Only moves the line if it is still in the status before `status`, so a
+    # second click (or a second operator) cannot complete it twice
     with connection.cursor() as cursor:
-        cursor.execute("""
-            UPDATE "orderlist"
-            SET "status" = %s
-            WHERE "order_id" = %s;
-        """, [status.capitalize(), order_id])
-
+        results, emails = transition_order_lines(cursor, shop_id, status.capitalize(), order_ids=[order_id])
+    print(f"Order {order_id} -> {status}: {results[0]['result']}")
 
+    notify_order_change(*emails)
 
     # Provide a success message
     # messages.success(request, f"Order {order_id} marked as {status.capitalize()}!")
@@ -650,7 +886,65 @@ def update_order_status(request, order_id, status):
     return redirect('bookings')  # Redirecting to 'stall/bookings' URL instead of 'past_orders'
 
 
+MAX_TRANSITIONS_PER_BATCH = 200
+
+
+@csrf_protect
+def stall_order_transitions(request):
+    """
+    POST /zaikaa/stall/orders/transitions/
+    {"transitions": [{"id": "t1", "status": "completed", "tokenid": 1042, "token_day": "2025-02-01"},
+                     {"id": "t2", "status": "delivered", "order_ids": [17, 18]}]}
+
+    Applies each transition in order, in one transaction, to the logged-in
+    stall's lines: every line of `tokenid` issued on `token_day` (tokens
+    restart each day; without it, the latest day the stall has that token)
+    and/or the listed `order_ids`. A line only moves if it is still in the preceding status;
+    every line is reported as applied, already_done, conflict or not_found.
+    Transitions only ever move forward, so a tablet that was offline can
+    resend its whole queue: lines already moved come back as already_done.
+    """
+    if request.method != "POST":
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+    shop_id = request.session.get('shop_id')
+    if not shop_id:
+        return JsonResponse({'status': 'error', 'message': 'Stall login required'}, status=401)
+
+    try:
+        transitions = json.loads(request.body).get('transitions')
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    if not isinstance(transitions, list) or not transitions:
+        return JsonResponse({'status': 'error', 'message': 'No transitions given'}, status=400)
+    if len(transitions) > MAX_TRANSITIONS_PER_BATCH:
+        return JsonResponse({'status': 'error', 'message': f'At most {MAX_TRANSITIONS_PER_BATCH} transitions per batch'}, status=400)
+
+    # Validate the whole batch before applying any of it
+    batch = []
+    for transition in transitions:
+        try:
+            to_status = str(transition['status']).capitalize()
+            order_ids = [int(order_id) for order_id in transition.get('order_ids') or []]
+            tokenid = int(transition['tokenid']) if transition.get('tokenid') is not None else None
+            token_day = datetime.strptime(transition['token_day'], '%Y-%m-%d').date() if transition.get('token_day') else None
+        except (TypeError, KeyError, ValueError, AttributeError):
+            return JsonResponse({'status': 'error', 'message': f'Invalid transition: {transition!r}'}, status=400)
+        if to_status not in ('Completed', 'Delivered') or (not order_ids and tokenid is None):
+            return JsonResponse({'status': 'error', 'message': f'Invalid transition: {transition!r}'}, status=400)
+        batch.append((transition.get('id'), to_status, order_ids, tokenid, token_day))
+
+    results = []
+    emails = set()
+    with transaction.atomic(), connection.cursor() as cursor:
+        for transition_id, to_status, order_ids, tokenid, token_day in batch:
+            lines, moved = transition_order_lines(
+                cursor, shop_id, to_status, order_ids=order_ids, tokenid=tokenid, token_day=token_day,
+            )
+            emails.update(moved)
+            results.append({'id': transition_id, 'status': to_status.lower(), 'tokenid': tokenid, 'lines': lines})
+        notify_order_change(*emails)
 
+    return JsonResponse({'status': 'success', 'results': results})
 
 
 # Dummy admin credentials
@@ -679,40 +973,24 @@ def admin_panel(request):
     if not request.session.get('admin_logged_in'):
         return redirect('admin_login')
 
-    # Fetch all shops and their menu items
+    # All shops with their menu items, one JSON document per shop
     with connection.cursor() as cursor:
-        cursor.execute("""
-            SELECT s."shop_id", s."shop_name", s."passkey", m."id", m."name", m."price", m."availability"
+        shops = fetch_json(cursor, """
+            SELECT jsonb_build_object(
+                'shop_id', s."shop_id",
+                'shop_name', s."shop_name",
+                'passkey', s."passkey",
+                'items', COALESCE(
+                    (SELECT json_agg(json_build_object(
+                                'id', m."id", 'name', m."name", 'price', m."price", 'availability', m."availability"
+                            ) ORDER BY m."id")
+                     FROM "menuitems" m
+                     WHERE m."shop_id" = s."shop_id"),
+                    '[]'::json)
+            ) AS "doc"
             FROM "shops" s
-            LEFT JOIN "menuitems" m ON s."shop_id" = m."shop_id"
+            ORDER BY s."shop_id"
         """)
-        data = cursor.fetchall()
-
-    # # Debugging: Print the raw data to see what's being fetched
-    # print("Fetched data:", data)
-
-    # # Organize data into a structured format
-    shops = {}
-    for row in data:
-        shop_id, shop_name, passkey, item_id, item_name, price, availability = row
-        print(f"Processing shop_id: {shop_id}, shop_name: {shop_name}")  # Debugging
-        if shop_id not in shops:
-            shops[shop_id] = {
-                'shop_id' : shop_id,
-                'shop_name': shop_name,
-                'passkey' : passkey,
-                'items': []
-            }
-        if item_id:  # Only append items if they exist
-            shops[shop_id]['items'].append({
-                'id': item_id,
-                'name': item_name,
-                'price': price,
-                'availability': availability
-            })
-
-    # # Debugging: Print the final structure of shops
-    # print("Shops structure:", shops)
 
     context = {
         'shops': shops
@@ -722,6 +1000,87 @@ def admin_panel(request):
 
 
 
+@csrf_protect
+def report_jobs(request):
+    """
+    POST /zaikaa/admin/reports/  {"kind": "orders_export" | "shop_sales", "params": {...}}
+    Queues a background report (food/reports.py) and returns its job; the
+    same report over unchanged orders returns the existing job at once.
+    """
+    if not request.session.get('admin_logged_in'):
+        return JsonResponse({'status': 'error', 'message': 'Admin login required'}, status=401)
+    if request.method != "POST":
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+    try:
+        data = json.loads(request.body)
+        job = enqueue_report(data.get('kind'), data.get('params'))
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    except ReportError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    return JsonResponse({'status': 'success', 'job': _report_job_json(job)})
+
+
+def report_job_status(request, job_id):
+    """GET /zaikaa/admin/reports/<job_id>/ -- progress of a report job, polled by the admin panel."""
+    if not request.session.get('admin_logged_in'):
+        return JsonResponse({'status': 'error', 'message': 'Admin login required'}, status=401)
+    job = get_job(job_id)
+    if job is None:
+        return JsonResponse({'status': 'error', 'message': 'Report not found'}, status=404)
+    return JsonResponse({'status': 'success', 'job': _report_job_json(job)})
+
+
+def report_job_download(request, job_id):
+    """GET /zaikaa/admin/reports/<job_id>/download/ -- the finished artifact."""
+    if not request.session.get('admin_logged_in'):
+        return JsonResponse({'status': 'error', 'message': 'Admin login required'}, status=401)
+    job = get_job(job_id)
+    path = artifact_path(job) if job else None
+    if path is None:
+        return JsonResponse({'status': 'error', 'message': 'Report is not ready'}, status=404)
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f"{job['kind']}{path.suffix}")
+
+
+def _report_job_json(job):
+    job = dict(job)
+    job['download_url'] = reverse('report_job_download', args=[job['job_id']]) if artifact_path(job) else None
+    del job['artifact']
+    return job
+
+
+def sales_dashboard_api(request):
+    """
+    GET /zaikaa/admin/dashboard/sales/?from=YYYY-MM-DD&to=YYYY-MM-DD&shop=<id>
+    Sales per shop, best-selling items and an hourly series from the rollup
+    tables (food/rollups.py). Both dates default to today.
+    """
+    if not request.session.get('admin_logged_in'):
+        return JsonResponse({'status': 'error', 'message': 'Admin login required'}, status=401)
+    try:
+        today = timezone.localdate()
+        first_day = datetime.strptime(request.GET['from'], '%Y-%m-%d').date() if request.GET.get('from') else today
+        last_day = datetime.strptime(request.GET['to'], '%Y-%m-%d').date() if request.GET.get('to') else first_day
+        shop = request.GET.get('shop')
+        shop_id = int(shop) if shop else None
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid date or shop'}, status=400)
+    if last_day < first_day:
+        return JsonResponse({'status': 'error', 'message': 'Invalid date range'}, status=400)
+
+    data = sales_dashboard(first_day, last_day, shop_id)
+    return JsonResponse({'status': 'success', 'from': first_day.isoformat(), 'to': last_day.isoformat(), **data})
+
+
+def token_metrics(request):
+    """Token allocation counters for this worker process (admin only)."""
+    if not request.session.get('admin_logged_in'):
+        return JsonResponse({'status': 'error', 'message': 'Admin login required'}, status=401)
+    return JsonResponse(token_stats())
+
+
+
+
 def admin_logout(request):
     request.session.flush()
     return redirect('admin_login')
@@ -753,6 +1112,7 @@ def add_shop(request):
                         VALUES (%s, %s, %s, %s)
                     """, [name, price, shop_id, 1])
 
+            bump_menu_version()
             return JsonResponse({'success': True, 'message': 'Shop and items added successfully!'})
         except Exception as e:
             return JsonResponse({'success': False, 'message': str(e)})
@@ -777,6 +1137,8 @@ def delete_shop(request, shop_id):
                 # Delete the shop itself
                 cursor.execute('DELETE FROM "shops" WHERE "shop_id" = %s', [shop_id])
 
+            # Tell every worker process; the menu cache rebuilds on this event
+            event_bus.publish(event_bus.SHOP_DELETED, {'shop_id': int(shop_id)})
             return JsonResponse({"success": True, "message": "Shop and its items deleted successfully."})
         except Exception as e:
             return JsonResponse({"success": False, "message": str(e)})
@@ -819,6 +1181,7 @@ def toggle_availability(request, item_id):
                     END
                     WHERE "id" = %s
                     """, [item_id])
+            bump_menu_version()
 
             # After updating availability, check session and redirect
             # print(f"Updated availability for item_id: {item_id}")
@@ -868,8 +1231,9 @@ def payment_success_view(request):
                 if payment_verified:
                     # logging.debug("Payment captured successfully.")
 
-                    # Retrieve cart items
-                    selected_items = request.session.get('selected_items', [])
+                    # Retrieve cart items (paid for, so keep items switched off since)
+                    priced = price_cart(get_session_cart(request.session), include_unavailable=True)
+                    selected_items = priced.items
                     if not selected_items:
                         return JsonResponse({'success': False, 'message': "No items in the session."})
                     
@@ -899,34 +1263,16 @@ def payment_success_view(request):
 
                             # Query 2: Check availability and insert order into `orderlist`
                             with connection.cursor() as cursor:
-                                for item in selected_items:
-                                    item_name = item['item_name']
-                                    quantity = item['quantity']
-                                    price = float(item['price'])
-
-                                    # Extract shop_id from item_name using regex
-                                    match = re.match(r'^(.*?) \(Shop ID: (\d+)\)$', item_name)
-                                    item_name_without_shop = match.group(1) if match else item_name
-                                    shop_id = match.group(2) if match else None
-
-                                    if not shop_id:
-                                        raise Exception(f"Shop ID not found in item: {item_name}")
-
-                                    # logging.debug(f"Extracted Shop ID: {shop_id}, Item Name: {item_name_without_shop}")
-
-                                    # Fix: Trust payment success and insert order regardless of availability
-                                    total_price = quantity * price
-                                    cursor.execute(""" 
-                                        INSERT INTO "orderlist" ("email", "name", "contact_no", "shop_id", "item_name", "qty", "total_amt", "status")
-                                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING "order_id";
-                                    """, [user_email, user_name, mobile, shop_id, item_name_without_shop, quantity, total_price, 'Pending'])
-                                    order_id = cursor.fetchone()[0]
-
-
-                                    # logging.debug(f"Inserted order for {item_name_without_shop} at shop_id={shop_id}")
+                                # Fix: Trust payment success and insert order regardless of availability
+                                write_order_lines(
+                                    cursor, selected_items,
+                                    email=user_email, name=user_name, contact_no=mobile,
+                                    status='Pending', timestamp=datetime.now(), menu_version=priced.menu_version,
+                                )
+                                # logging.debug(f"Inserted {len(selected_items)} order lines")
 
                             # ✅ **Fix: Generate token ID correctly**
-                            token_id = randint(1000, 9999)  # Ensure random module is not overridden
+                            token_id, token_day = allocate_dated_token()  # Unique for today, from the per-day counter
                             timestamp = datetime.now()
                             # logging.debug(f"Generated token_id={token_id}, timestamp={timestamp}")
 
@@ -934,10 +1280,11 @@ def payment_success_view(request):
                             with connection.cursor() as cursor:
                                 cursor.execute(""" 
                                     UPDATE "orderlist" 
-                                    SET "tokenid" = %s, "timestamp" = %s, "mode_of_payment" = 'Online'
+                                    SET "tokenid" = %s, "token_day" = %s, "timestamp" = %s, "mode_of_payment" = 'Online'
                                     WHERE "email" = %s AND "status" = 'Pending' AND "tokenid" IS NULL;
-                                """, [token_id, timestamp, user_email])
+                                """, [token_id, token_day, timestamp, user_email])
                                 # logging.debug("Updated orderlist with token ID and timestamp.")
+                                notify_orders_written(user_email)
 
 
                                 # logging.debug("Updated orderlist with token ID and timestamp.")
@@ -983,26 +1330,19 @@ def generate_order_id(request):
         'phone': request.session.get('user_phone')
     }
     
-    # Fetching selected items from the form data (submitted as JSON string)
-    selected_items = request.POST.get('order_items', '[]')  # Get the JSON string of items
-    selected_items = json.loads(selected_items)  # Convert the JSON string back to a Python object
-
-    # print("Before updating quantities:", selected_items)  # Debugging line
-
-    # Update total_price based on quantity
-    for item in selected_items:
-        item_quantity = item['quantity']  # Ensure 'quantity' is present
-        # print(f"Item quantity: {item_quantity}")  # Debugging line
-        item['total_price'] = float(item['price']) * item_quantity  # Update total price
+    # Fetching the cart from the form data ([item_id, shop_id, qty] triples as a JSON string)
+    try:
+        cart = parse_cart(request.POST.get('order_items', '[]'))
+    except ValueError:
+        return HttpResponse("Invalid order items data", status=400)
 
-    # print("After updating quantities:", selected_items)  # Debugging line
+    # Attach names and prices from the menu and recalculate the total on the server
+    priced = price_cart(cart)
+    selected_items = priced.items
+    total_amount = priced.total
 
-    # Recalculate total amount
-    total_amount = sum(item['total_price'] for item in selected_items)
-    
-    # Store updated items in session
-    request.session['selected_items'] = selected_items  
-    request.session.modified = True  # Ensure session updates
+    # Store the cart in session (ids only)
+    save_session_cart(request.session, cart)
 
     # TODO: Implement Billdesk order creation
     # Generate a unique order ID for Billdesk
@@ -1098,7 +1438,6 @@ def ulogin(request):
                 # print("Password match successful.")
                 # Store all necessary details in session
                 request.session["is_authenticated"] = True
-                request.session["user_id"] = user[0]  # Store user_id in session
                 request.session["user_name"] = user[1]  # Store username in session
                 request.session["user_email"] = user[3]  # Store email in session
                 request.session["user_phone"] = user[4]  # Store phone number in session
@@ -1270,10 +1609,8 @@ def stall_history(request):
     return render(request, 'stall_history.html', context)
 
 
-import pandas as pd
 import psycopg2
 from django.http import HttpResponse
-from io import BytesIO
 from django.conf import settings
 
 # Database Connection Config from settings.py
@@ -1289,25 +1626,26 @@ def get_db_connection():
 from sqlalchemy import create_engine
 
 def export_orders_to_excel(request):
+    """
+    GET /zaikaa/admin/export-orders/?format=xlsx|csv&shop=&from=&to=
+    Streams the matching orders from a server-side cursor (see food/exports.py):
+    CSV is sent as it is read, xlsx is spooled to a temporary file first.
+    Accepts the same filters as allorders.
+    """
     if request.method == "GET":
-        # Use Django's native connection to fetch data
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT * FROM orderlist;")
-            rows = cursor.fetchall()
-            columns = [col[0] for col in cursor.description]
-        
-        df = pd.DataFrame(rows, columns=columns)
+        clauses, args, filters = order_filters(request.GET)
 
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            df.to_excel(writer, index=False, sheet_name="Orders")
+        if request.GET.get('format') == 'csv':
+            response = StreamingHttpResponse(csv_export(clauses, args), content_type="text/csv; charset=utf-8")
+            response["Content-Disposition"] = 'attachment; filename="orders.csv"'
+            return response
 
-        response = HttpResponse(
-            output.getvalue(),
+        return FileResponse(
+            xlsx_export(clauses, args),
+            as_attachment=True,
+            filename="orders.xlsx",
             content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         )
-        response["Content-Disposition"] = 'attachment; filename="orders.xlsx"'
-        return response
 
     return HttpResponse("Invalid request", status=400)
 
@@ -1328,81 +1666,79 @@ def payment_success_billdesk(request):
 
         print(f"Payment success callback: order_id={order_id}, txn_id={txn_id}, status={status}")
 
-        if not order_id or status != 'success':
+        if not order_id or not txn_id or status != 'success':
             return redirect('payment_failed_billdesk')
 
-        # Get user details from session
-        user_name = request.session.get('user_name')
-        user_email = request.session.get('user_email')
-        user_phone = request.session.get('user_phone')
-        selected_items = request.session.get('selected_items', [])
-
-        print(f"Session Data: user_name={user_name}, user_email={user_email}, user_phone={user_phone}, selected_items={selected_items}")
-
-        if not user_email:
-            return HttpResponse("Session expired. Please try again.", status=400)
-
         try:
-            with transaction.atomic():
-                # Insert user if not exists
-                with connection.cursor() as cursor:
-                    cursor.execute("""
-                        SELECT "user_id" FROM "users" WHERE "mobile" = %s OR "email" = %s;
-                    """, [user_phone, user_email])
-                    result = cursor.fetchone()
-
-                    if result:
-                        user_id = result[0]
-                    else:
-                        cursor.execute("""
-                            INSERT INTO "users" ("name", "email", "mobile")
-                            VALUES (%s, %s, %s) RETURNING "user_id";
-                        """, [user_name, user_email, user_phone])
-                        user_id = cursor.fetchone()[0]
-
-                # Generate token ID
-                token_id = randint(1000, 9999)
-                timestamp = datetime.now()
-
-                # Insert orders into orderlist
-                with connection.cursor() as cursor:
-                    for item in selected_items:
-                        item_name = item.get('item_name', '')
-                        quantity = item.get('quantity', 1)
-                        price = float(item.get('price', 0))
-
-                        # Extract shop_id from item_name
-                        match = re.match(r'^(.*?) \(Shop ID: (\d+)\)$', item_name)
-                        item_name_without_shop = match.group(1) if match else item_name
-                        shop_id = match.group(2) if match else item.get('shop_id')
-
-                        if not shop_id:
-                            print(f"Warning: Shop ID not found for item: {item_name}")
-                            continue
-
-                        total_price = quantity * price
-
-                        cursor.execute("""
-                            INSERT INTO "orderlist" 
-                            ("email", "name", "contact_no", "shop_id", "item_name", "qty", "total_amt", "status", "tokenid", "timestamp", "mode_of_payment")
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING "order_id";
-                        """, [user_email, user_name, user_phone, shop_id, item_name_without_shop, quantity, total_price, 'Approved', token_id, timestamp, 'Online'])
-
-                print(f"Orders created successfully. Token ID: {token_id}")
-
-                # Clear cart from session
-                request.session['selected_items'] = []
-                request.session.modified = True
-
-                return redirect('success', token_id=token_id)
-
+            token_id = record_payment(
+                order_id, txn_id, source='redirect', fallback=_session_payment(request.session, order_id),
+            )[0]
+        except UnknownPayment:
+            return HttpResponse("Session expired. Please try again.", status=400)
         except Exception as e:
             print(f"Error processing payment success: {e}")
             return HttpResponse(f"Error processing order: {str(e)}", status=500)
 
+        _finish_checkout(request.session, order_id)
+        return redirect('success', token_id=token_id)
+
     return HttpResponse("Invalid request method", status=405)
 
 
+def _session_payment(session, order_id):
+    """
+    The (email, name, phone, cart) in the session, if it is checking out
+    this order; record_payment() only needs it for orders without an intent.
+    """
+    if session.get('order_id') != order_id or not session.get('user_email'):
+        return None
+    return (session.get('user_email'), session.get('user_name'), session.get('user_phone'),
+            get_session_cart(session))
+
+
+def _finish_checkout(session, order_id):
+    # A refreshed success page must not empty a cart the user has started since
+    if session.get('order_id') == order_id:
+        clear_session_cart(session)
+        session.pop('order_id', None)
+
+
+@csrf_exempt
+def payment_confirm_billdesk(request):
+    """
+    Server-to-server payment confirmation from the Express backend
+    POST /zaikaa/payment-confirm/ {"order_id", "txn_id", "status"}
+    signed with X-Zaika-Signature: sha256=<HMAC of the body under PAYMENT_WEBHOOK_SECRET>
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+    if not verify_signature(request.body, request.META.get(SIGNATURE_HEADER)):
+        return JsonResponse({'status': 'error', 'message': 'Invalid signature'}, status=403)
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    order_id = data.get('order_id')
+    txn_id = data.get('txn_id')
+    print(f"Payment confirmation: order_id={order_id}, txn_id={txn_id}, status={data.get('status')}")
+
+    if not order_id or not txn_id:
+        return JsonResponse({'status': 'error', 'message': 'order_id and txn_id are required'}, status=400)
+    if data.get('status') != 'success':
+        return JsonResponse({'status': 'success', 'recorded': False})
+
+    try:
+        token_id, created = record_payment(str(order_id), str(txn_id), source='server')
+    except UnknownPayment as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=404)
+    except Exception as e:
+        print(f"Error processing payment confirmation: {e}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+    return JsonResponse({'status': 'success', 'recorded': True, 'token_id': token_id, 'created': created})
+
+
 def payment_failed_billdesk(request):
     """
     Handle failed payment redirect from BillDesk via Express backend
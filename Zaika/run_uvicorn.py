@@ -0,0 +1,71 @@
+"""
+Uvicorn ASGI Server for Zaika BillDesk Django Application
+Run this script instead of run_waitress.py to serve Zaikaa/asgi.py, with the
+payment and order-status views running as coroutines (food/async_views.py)
+"""
+import os
+import sys
+
+# Before Django reads its settings: route the I/O-bound views to their async versions
+os.environ.setdefault('ASYNC_VIEWS', 'True')
+
+import uvicorn
+from dotenv import load_dotenv
+
+from run_waitress import start_report_workers, stop_report_workers
+
+# Load environment variables
+load_dotenv()
+
+
+def main():
+    # Get configuration from environment
+    port = int(os.getenv('PORT', '8002'))
+    host = os.getenv('HOST', '0.0.0.0')
+    workers = int(os.getenv('UVICORN_WORKERS', '1'))
+    limit_concurrency = int(os.getenv('ASGI_CONNECTION_LIMIT', '5000'))
+    debug = os.getenv('DEBUG', 'False') == 'True'
+    report_workers = int(os.getenv('REPORT_WORKERS', '1'))
+
+    print("=" * 50)
+    print("ZAIKA BILLDESK ASGI SERVER")
+    print("=" * 50)
+    print(f"Host: {host}")
+    print(f"Port: {port}")
+    print(f"Workers: {workers}")
+    print(f"Connection Limit: {limit_concurrency}")
+    print(f"Async Views: {os.environ['ASYNC_VIEWS']}")
+    print(f"Debug Mode: {debug}")
+    print(f"Report Workers: {report_workers}")
+    print(f"URL: http://{host}:{port}")
+    print("=" * 50)
+    print("Press Ctrl+C to stop the server")
+    print("")
+
+    report_processes = start_report_workers(report_workers)
+    try:
+        # Serve the application
+        uvicorn.run(
+            'Zaikaa.asgi:application',
+            host=host,
+            port=port,
+            workers=workers,
+            lifespan='off',  # Django does not implement the lifespan protocol
+            proxy_headers=True,  # For reverse proxy with SSL
+            forwarded_allow_ips=os.getenv('FORWARDED_ALLOW_IPS', '127.0.0.1'),
+            limit_concurrency=limit_concurrency,
+            timeout_keep_alive=120,
+            server_header=False,
+            log_level='debug' if debug else 'info',
+        )
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
+        sys.exit(0)
+    except Exception as e:
+        print(f"Error starting server: {e}")
+        sys.exit(1)
+    finally:
+        stop_report_workers(report_processes)
+
+if __name__ == '__main__':
+    main()
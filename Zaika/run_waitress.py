@@ -1,57 +1,309 @@
 """
 Waitress Production Server for Zaika BillDesk Django Application
 Run this script to start the production WSGI server
+
+With WAITRESS_WORKERS above 1 (or WAITRESS_MAX_REQUESTS set) it runs as a
+supervisor instead: it opens the listening socket once and starts that many
+worker processes (`run_waitress.py --worker`), each running waitress with
+WAITRESS_THREADS threads on the shared socket, so Python work is spread over
+several cores instead of queuing on one interpreter lock.
+
+* Workers inherit the socket (its fd on Linux, `socket.share()` on Windows);
+  whichever worker is idle accepts the next connection.
+* A worker that dies is replaced; one that keeps dying on start-up is
+  replaced with a growing delay, up to 30 seconds.
+* After WAITRESS_MAX_REQUESTS requests (plus up to
+  WAITRESS_MAX_REQUESTS_JITTER, so workers do not all restart together) a
+  worker drains and is replaced, capping memory growth.
+* Draining means: stop accepting, close idle keep-alive connections, let
+  requests in flight finish for up to WAITRESS_DRAIN_TIMEOUT seconds, exit.
+  SIGTERM or Ctrl+C drains every worker before the supervisor exits.
+
+Workers are started fresh rather than forked, so no worker shares database
+connections or threads with the supervisor, and the same code runs on Windows.
 """
-from waitress import serve
-from Zaikaa.wsgi import application
 import os
+import random
+import signal
+import socket
+import struct
+import subprocess
 import sys
+import threading
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+MIN_WORKER_UPTIME = 5      # Seconds; a worker that dies sooner is crash-looping
+MAX_RESPAWN_DELAY = 30
+
+
+def start_report_workers(count):
+    """Background report workers (manage.py run_report_worker), one process each"""
+    manage_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manage.py')
+    return [
+        subprocess.Popen([sys.executable, manage_py, 'run_report_worker'])
+        for _ in range(count)
+    ]
+
+
+def stop_report_workers(workers):
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        try:
+            worker.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            worker.kill()
+
+
+def server_options(threads, debug):
+    """waitress settings shared by the single-process server and every worker"""
+    return dict(
+        threads=threads,
+        url_scheme='https',  # For reverse proxy with SSL
+        channel_timeout=120,
+        connection_limit=1000,
+        cleanup_interval=30,
+        recv_bytes=8192,
+        send_bytes=8192,
+        expose_tracebacks=debug,
+        ident='ZaikaBillDesk',
+    )
+
+
+class Supervisor:
+    """Keeps `count` worker processes serving one listening socket."""
+
+    def __init__(self, sock, count, drain_timeout):
+        self.sock = sock
+        self.count = count
+        self.drain_timeout = drain_timeout
+        self.workers = {}  # Popen -> monotonic start time
+        self.stopping = False
+        self.respawn_delay = 0
+        self.respawn_at = 0
+
+    def spawn(self):
+        command = [sys.executable, os.path.abspath(__file__), '--worker']
+        if os.name == 'nt':
+            worker = subprocess.Popen(command + ['--shared'], stdin=subprocess.PIPE)
+            shared = self.sock.share(worker.pid)
+            worker.stdin.write(struct.pack('!I', len(shared)) + shared)
+            worker.stdin.flush()
+        else:
+            fd = self.sock.fileno()
+            worker = subprocess.Popen(command + ['--fd', str(fd)], stdin=subprocess.PIPE, pass_fds=(fd,))
+        # stdin stays open: the worker drains when it is closed, or when this process dies
+        self.workers[worker] = time.monotonic()
+        print(f"Worker {worker.pid} started", flush=True)
+
+    def reap(self):
+        now = time.monotonic()
+        for worker, started in list(self.workers.items()):
+            code = worker.poll()
+            if code is None:
+                continue
+            del self.workers[worker]
+            worker.stdin.close()
+            if code == 0:
+                print(f"Worker {worker.pid} exited (recycled)", flush=True)
+                continue
+            print(f"Worker {worker.pid} died with exit code {code}", flush=True)
+            if now - started < MIN_WORKER_UPTIME:
+                self.respawn_delay = min(max(self.respawn_delay * 2, 1), MAX_RESPAWN_DELAY)
+                self.respawn_at = now + self.respawn_delay
+                print(f"Worker crashed on start-up, waiting {self.respawn_delay}s before the next one", flush=True)
+            else:
+                self.respawn_delay = 0
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        if hasattr(signal, 'SIGBREAK'):
+            signal.signal(signal.SIGBREAK, self.stop)  # Windows: Ctrl+Break, and what service managers send
+        try:
+            while not self.stopping:
+                self.reap()
+                while len(self.workers) < self.count and time.monotonic() >= self.respawn_at:
+                    self.spawn()
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        self.shutdown()
+
+    def shutdown(self):
+        print(f"Draining {len(self.workers)} worker(s)...", flush=True)
+        for worker in self.workers:
+            try:
+                worker.stdin.close()  # Tells the worker to drain
+            except OSError:
+                pass
+        deadline = time.monotonic() + self.drain_timeout + 10
+        for worker in self.workers:
+            try:
+                worker.wait(timeout=max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                print(f"Worker {worker.pid} did not drain in time, killing it", flush=True)
+                worker.kill()
+            except KeyboardInterrupt:
+                worker.kill()
+        self.sock.close()
+
+
+class Worker:
+    """One waitress server on the supervisor's socket, which it can drain and leave."""
+
+    def __init__(self, sock, threads, debug, max_requests, drain_timeout):
+        from waitress.server import create_server
+        from Zaikaa.wsgi import application
+
+        self.application = application
+        self.max_requests = max_requests
+        self.drain_timeout = drain_timeout
+        self.served = 0
+        self.lock = threading.Lock()
+        self.draining = threading.Event()
+        self.deadline = None
+        self.server = create_server(self.count_requests, sockets=[sock], **server_options(threads, debug))
+
+    def count_requests(self, environ, start_response):
+        if self.max_requests:
+            with self.lock:
+                self.served += 1
+                served = self.served
+            if served == self.max_requests:
+                self.drain(f"served {served} requests")
+        return self.application(environ, start_response)
+
+    def drain(self, reason):
+        """Start draining; safe to call from any thread or a signal handler."""
+        if not self.draining.is_set():
+            print(f"Worker {os.getpid()} draining: {reason}", flush=True)
+            self.draining.set()
+            self.server.pull_trigger()  # Wake the loop
+
+    def watch_supervisor(self):
+        # Raw reads: a daemon thread blocked in sys.stdin's buffer aborts the interpreter on exit
+        while os.read(sys.stdin.fileno(), 4096):
+            pass  # Returns b'' when the supervisor closes the pipe or dies
+        self.drain("asked by the supervisor")
+
+    def run(self):
+        from waitress import wasyncore
+
+        signal.signal(signal.SIGTERM, lambda *args: self.drain("SIGTERM"))
+        signal.signal(signal.SIGINT, lambda *args: self.drain("interrupted"))
+        threading.Thread(target=self.watch_supervisor, daemon=True).start()
+
+        server = self.server
+        adj = server.adj
+        while True:
+            wasyncore.loop(timeout=adj.asyncore_loop_timeout, map=server._map, use_poll=adj.asyncore_use_poll, count=1)
+            if not self.draining.is_set():
+                continue
+            if self.deadline is None:
+                self.deadline = time.monotonic() + self.drain_timeout
+                server.accepting = False  # Other workers take new connections from here on
+            channels = list(server.active_channels.values())
+            for channel in channels:
+                # Close keep-alive connections between requests; busy ones are closed once they finish
+                if not channel.requests and channel.request is None and not channel.total_outbufs_len:
+                    channel.will_close = True
+            if not channels or time.monotonic() >= self.deadline:
+                break
+
+        if server.active_channels:
+            print(f"Worker {os.getpid()} dropping {len(server.active_channels)} connection(s) after the drain timeout", flush=True)
+        server.task_dispatcher.shutdown(cancel_pending=True, timeout=5)
+        wasyncore.close_all(server._map)
+
+
+def read_stdin(size):
+    data = b''
+    while len(data) < size:
+        chunk = os.read(sys.stdin.fileno(), size - len(data))
+        if not chunk:
+            raise EOFError("Supervisor closed stdin before handing over the socket")
+        data += chunk
+    return data
+
+
+def worker_main():
+    """Entry point of `run_waitress.py --worker`, started by the Supervisor"""
+    if '--shared' in sys.argv:
+        (length,) = struct.unpack('!I', read_stdin(4))
+        sock = socket.fromshare(read_stdin(length))
+    else:
+        sock = socket.socket(fileno=int(sys.argv[sys.argv.index('--fd') + 1]))
+
+    max_requests = int(os.getenv('WAITRESS_MAX_REQUESTS', '0'))
+    jitter = int(os.getenv('WAITRESS_MAX_REQUESTS_JITTER', str(max_requests // 10)))
+    worker = Worker(
+        sock,
+        threads=int(os.getenv('WAITRESS_THREADS', '8')),
+        debug=os.getenv('DEBUG', 'False') == 'True',
+        max_requests=max_requests + random.randint(0, jitter) if max_requests else 0,
+        drain_timeout=float(os.getenv('WAITRESS_DRAIN_TIMEOUT', '30')),
+    )
+    worker.run()
+
+
 def main():
     # Get configuration from environment
     port = int(os.getenv('PORT', '8002'))
     host = os.getenv('HOST', '0.0.0.0')
     threads = int(os.getenv('WAITRESS_THREADS', '8'))
+    workers = int(os.getenv('WAITRESS_WORKERS', '1'))
+    max_requests = int(os.getenv('WAITRESS_MAX_REQUESTS', '0'))
+    drain_timeout = float(os.getenv('WAITRESS_DRAIN_TIMEOUT', '30'))
     debug = os.getenv('DEBUG', 'False') == 'True'
-    
+    report_workers = int(os.getenv('REPORT_WORKERS', '1'))
+    supervised = workers > 1 or max_requests > 0
+
     print("=" * 50)
     print("ZAIKA BILLDESK PRODUCTION SERVER")
     print("=" * 50)
     print(f"Host: {host}")
     print(f"Port: {port}")
     print(f"Threads: {threads}")
+    if supervised:
+        print(f"Workers: {workers}")
+        print(f"Max Requests per Worker: {max_requests or 'unlimited'}")
     print(f"Debug Mode: {debug}")
+    print(f"Report Workers: {report_workers}")
     print(f"URL: http://{host}:{port}")
     print("=" * 50)
     print("Press Ctrl+C to stop the server")
     print("")
-    
+
+    report_processes = start_report_workers(report_workers)
     try:
-        # Serve the application
-        serve(
-            application,
-            host=host,
-            port=port,
-            threads=threads,
-            url_scheme='https',  # For reverse proxy with SSL
-            channel_timeout=120,
-            connection_limit=1000,
-            cleanup_interval=30,
-            recv_bytes=8192,
-            send_bytes=8192,
-            expose_tracebacks=debug,
-            ident='ZaikaBillDesk',
-        )
+        if supervised:
+            family = socket.AF_INET6 if ':' in host else socket.AF_INET
+            sock = socket.create_server((host, port), family=family, backlog=1024)
+            Supervisor(sock, workers, drain_timeout).run()
+        else:
+            from waitress import serve
+            from Zaikaa.wsgi import application
+
+            # Serve the application
+            serve(application, host=host, port=port, **server_options(threads, debug))
     except KeyboardInterrupt:
         print("\nServer stopped.")
         sys.exit(0)
     except Exception as e:
         print(f"Error starting server: {e}")
         sys.exit(1)
+    finally:
+        stop_report_workers(report_processes)
 
 if __name__ == '__main__':
-    main()
+    if '--worker' in sys.argv:
+        worker_main()
+    else:
+        main()
@@ -41,6 +41,148 @@ CREATE TABLE orderlist (
     total_amt DECIMAL(10, 2) NOT NULL,
     status VARCHAR(50) DEFAULT 'Pending', -- Values: 'Pending', 'Approved', 'Completed', 'Delivered'
     tokenid INTEGER,                      -- Null initially, generated upon approval
+    token_day DATE,                       -- Day the token was issued on (tokens restart daily); null on lines tokened before migration 0015
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    mode_of_payment VARCHAR(50)           -- Values: 'cash', 'Online'
-);
\ No newline at end of file
+    mode_of_payment VARCHAR(50),          -- Values: 'cash', 'Online'
+    menu_version VARCHAR(16),             -- price_version of the menu snapshot the order was priced at
+    updated_at TIMESTAMP,                 -- Set by the orderlist_track_change trigger on every write
+    change_xid xid8                       -- Writing transaction id, cursor for the bookings delta feed
+);
+-- Table: token_counters
+-- Per-day pickup token counter; worker processes claim blocks from it (food/tokens.py)
+CREATE TABLE token_counters (
+    event_day DATE PRIMARY KEY,
+    next_token INTEGER NOT NULL           -- First token not yet handed out for that day
+);
+
+-- Indexes: check_order_status counts an email's pending lines and its approved lines still waiting for a token
+CREATE INDEX idx_orderlist_pending_email ON orderlist (email) WHERE status = 'Pending';
+CREATE INDEX idx_orderlist_approved_untokened_email ON orderlist (email) WHERE status = 'Approved' AND tokenid IS NULL;
+
+-- Change tracking: stamps every written orderlist row for the stall bookings delta feed
+CREATE FUNCTION orderlist_track_change() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := CURRENT_TIMESTAMP;
+    NEW.change_xid := pg_current_xact_id();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER orderlist_track_change BEFORE INSERT OR UPDATE ON orderlist
+    FOR EACH ROW EXECUTE FUNCTION orderlist_track_change();
+
+-- Indexes: the bookings board loads a shop's open orders by status, then polls for changes
+CREATE INDEX idx_orderlist_shop_status_timestamp ON orderlist (shop_id, status, timestamp);
+CREATE INDEX idx_orderlist_shop_change_xid ON orderlist (shop_id, change_xid);
+
+-- Table: orderlist_deletions
+-- Tombstones of deleted orderlist rows, so the bookings delta feed can drop them (migration 0013)
+CREATE TABLE orderlist_deletions (
+    order_id INTEGER NOT NULL,
+    shop_id INTEGER,
+    change_xid xid8 NOT NULL DEFAULT pg_current_xact_id(), -- Deleting transaction id, same cursor as orderlist.change_xid
+    deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP -- Pruned after BOOKINGS_DELETIONS_RETENTION_HOURS
+);
+CREATE INDEX idx_orderlist_deletions_shop_change_xid ON orderlist_deletions (shop_id, change_xid);
+CREATE INDEX idx_orderlist_deletions_deleted_at ON orderlist_deletions (deleted_at);
+CREATE FUNCTION orderlist_track_delete() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO orderlist_deletions (order_id, shop_id)
+    SELECT order_id, shop_id FROM old_rows;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER orderlist_track_delete AFTER DELETE ON orderlist REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION orderlist_track_delete();
+
+-- Index: stalls move a whole token at once (food.orders.transition_order_lines)
+CREATE INDEX idx_orderlist_shop_tokenid ON orderlist (shop_id, tokenid) WHERE tokenid IS NOT NULL;
+
+-- Index: report cache keys are built from the latest change_xid (food/reports.py, migration 0014)
+CREATE INDEX idx_orderlist_change_xid ON orderlist (change_xid);
+
+-- Index: the cash approval queue pages through pending lines by order_id
+CREATE INDEX idx_orderlist_pending_order_id ON orderlist (order_id) WHERE status = 'Pending';
+
+-- Indexes: allorders pages through (timestamp, order_id), newest first, optionally for one shop
+CREATE INDEX idx_orderlist_timestamp_order_id ON orderlist (timestamp, order_id);
+CREATE INDEX idx_orderlist_shop_timestamp_order_id ON orderlist (shop_id, timestamp, order_id);
+
+-- Index: the past-orders API pages through an email's tokens, newest first
+CREATE INDEX idx_orderlist_email_timestamp_tokenid ON orderlist (email, timestamp, tokenid) WHERE tokenid IS NOT NULL;
+
+-- Table: report_jobs
+-- Background admin reports, claimed with FOR UPDATE SKIP LOCKED by `manage.py run_report_worker` (food/reports.py)
+CREATE TABLE report_jobs (
+    job_id SERIAL PRIMARY KEY,
+    kind VARCHAR(32) NOT NULL,            -- Values: 'orders_export', 'shop_sales'
+    params TEXT NOT NULL,                 -- Canonical JSON of the report parameters
+    cache_key VARCHAR(40) NOT NULL,       -- sha1 of kind + params + orderlist watermark
+    status VARCHAR(16) NOT NULL DEFAULT 'queued', -- Values: 'queued', 'running', 'done', 'failed'
+    progress INTEGER NOT NULL DEFAULT 0,  -- Percent
+    artifact VARCHAR(255),                -- File name under REPORTS_DIR once done
+    error TEXT,
+    worker VARCHAR(64),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    heartbeat_at TIMESTAMP,               -- Last progress update of a running job
+    finished_at TIMESTAMP
+);
+CREATE INDEX idx_report_jobs_open ON report_jobs (job_id) WHERE status IN ('queued', 'running');
+CREATE INDEX idx_report_jobs_cache_key ON report_jobs (cache_key);
+
+-- Tables: sales rollups, kept current by statement-level triggers on orderlist (food/rollups.py)
+-- A line counts as a sale once it is no longer 'Pending'
+CREATE TABLE sales_by_shop (
+    shop_id INTEGER NOT NULL,
+    sale_day DATE NOT NULL,
+    order_lines INTEGER NOT NULL DEFAULT 0,
+    items_sold INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    cash_revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    online_revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_day, shop_id)
+);
+CREATE TABLE sales_by_item (
+    shop_id INTEGER NOT NULL,
+    item_name VARCHAR(255) NOT NULL,
+    sale_day DATE NOT NULL,
+    order_lines INTEGER NOT NULL DEFAULT 0,
+    items_sold INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_day, shop_id, item_name)
+);
+CREATE TABLE sales_by_hour (
+    shop_id INTEGER NOT NULL,
+    sale_hour TIMESTAMP NOT NULL,
+    order_lines INTEGER NOT NULL DEFAULT 0,
+    items_sold INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_hour, shop_id)
+);
+-- The trigger function and triggers are installed by migrations 0009/0012: run `python manage.py migrate`
+-- after loading this file (the migrations are idempotent and also folds in existing orders)
+
+-- Table: payment_intents
+-- Customer and cart (JSON [item_id, shop_id, qty] triples) under the order id handed to Express (food/payments.py)
+CREATE TABLE payment_intents (
+    order_id VARCHAR(64) PRIMARY KEY,
+    email VARCHAR(255) NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    contact_no VARCHAR(15) NOT NULL,
+    cart TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Table: payment_ledger
+-- One row per BillDesk payment; the unique (order_id, txn_id) makes recording a payment idempotent
+CREATE TABLE payment_ledger (
+    ledger_id SERIAL PRIMARY KEY,
+    order_id VARCHAR(64) NOT NULL,
+    txn_id VARCHAR(64) NOT NULL,
+    source VARCHAR(16) NOT NULL,          -- Values: 'redirect', 'server'
+    status VARCHAR(16) NOT NULL DEFAULT 'recorded', -- Values: 'recorded', 'duplicate' (order already paid by another txn)
+    email VARCHAR(255),
+    tokenid INTEGER,                      -- Token the payment's order lines were written under
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT payment_ledger_order_txn UNIQUE (order_id, txn_id)
+);
@@ -42,25 +42,13 @@ document.addEventListener("DOMContentLoaded", function () {
       stagger: 0.2
   });
 
-  // ✅ Processing Order Items on Load
-  document.querySelectorAll(".order-item .item-name").forEach(itemEl => {
-      let text = itemEl.textContent.trim();
-      console.log("📌 Processing item:", text); // Debugging
-
-      let match = text.match(/^(.*?) \(Shop ID: \d+\)$/);
-      if (match) {
-          console.log("✅ Matched item:", match[1]); // Debugging
-          itemEl.textContent = `${match[1]} (Shop ID: ${extractShopID(text)})`;
-      }
-  });
-
   updatePrice(); // ✅ Update prices on page load
 
   // ✅ Increase Quantity
   document.querySelectorAll('.increase').forEach(button => {
       button.addEventListener('click', function () {
           const input = document.querySelector(`.quantity-input[data-item="${this.dataset.item}"]`);
-          input.value = parseInt(input.value) + 1;
+          input.value = Math.min(parseInt(input.max), parseInt(input.value) + 1);
           updatePrice();
       });
   });
@@ -85,7 +73,7 @@ document.addEventListener("DOMContentLoaded", function () {
   document.getElementById('online-payment-form').addEventListener('submit', function (event) {
       const orderItems = collectOrderItems();
       document.getElementById('online-order-items-input').value = JSON.stringify(orderItems);
-      let total = orderItems.reduce((sum, item) => sum + parseFloat(item.total_price), 0);
+      let total = calculateTotal();
       document.getElementById('online-total-input').value = total.toFixed(2);
       console.log(orderItems);
       console.log('Total:', total.toFixed(2));
@@ -119,47 +107,34 @@ function animateTransition() {
   });
 }
 
-// ✅ Function to collect order items
+// ✅ Function to collect order items as [item_id, shop_id, qty] triples
 function collectOrderItems() {
   const items = [];
   document.querySelectorAll('.order-item').forEach(item => {
-      let itemName = item.querySelector('.item-name').textContent.trim();
+      const itemID = parseInt(item.dataset.itemId);
+      const shopID = parseInt(item.dataset.shopId);
       const quantity = parseInt(item.querySelector('.quantity-input').value);
-      const price = parseFloat(item.querySelector('.item-price').textContent.replace('₹', ''));
-      const totalPrice = price * quantity;
-      let shopID = extractShopID(itemName);
-
-      if (shopID) {
-          itemName = itemName.replace(/\(Shop ID: \d+\)/g, "").trim() + ` (Shop ID: ${shopID})`;
-      }
-
-      items.push({
-          item_name: itemName,
-          quantity: quantity,
-          price: price.toFixed(2),
-          total_price: totalPrice.toFixed(2)
-      });
+
+      items.push([itemID, shopID, quantity]);
   });
 
   return items;
 }
 
-// ✅ Extract Shop ID from Item Name
-function extractShopID(text) {
-  let match = text.match(/\(Shop ID: (\d+)\)/);
-  return match ? match[1] : null;
-}
-
-// ✅ Calculate total price dynamically
-function updatePrice() {
+// ✅ Sum of displayed price * quantity (the server recomputes it from the menu)
+function calculateTotal() {
   let total = 0;
   document.querySelectorAll('.order-item').forEach(item => {
       const price = parseFloat(item.querySelector('.item-price').textContent.replace('₹', ''));
       const quantity = parseInt(item.querySelector('.quantity-input').value);
       total += price * quantity;
   });
+  return total;
+}
+
+// ✅ Calculate total price dynamically
+function updatePrice() {
+  const total = calculateTotal();
   document.getElementById('total-price').textContent = total.toFixed(2);
   document.getElementById('total-input').value = total.toFixed(2);
 }
-
-